@@ -0,0 +1,125 @@
+"""
+Compares the memory usage and the speed of the slotted OneNoteElement with the former element
+class, which kept its fields in a `__dict__`, when the elements are decoded from and encoded to
+the format of the onenoteElements.json file.
+
+Usage: python benchmarks/benchmark_elements.py [numberOfElements ...]
+"""
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import onenote_json
+import onenote_types as types
+
+DEFAULT_NUMBERS_OF_ELEMENTS = [10000, 100000, 1000000]
+PAGES_PER_SECTION = 100
+
+
+class DictOneNoteElement(object):
+    """
+    The element class as it was before it used slots.
+    """
+
+    def __init__(self, title, autocomplete, uid, subtitle, arg, icon, icontype, onenoteType, parentUid,
+                 lastModifiedDateTime, match):
+        self.title = title
+        self.autocomplete = autocomplete
+        self.uid = uid
+        self.subtitle = subtitle
+        self.arg = arg
+        self.icon = icon
+        self.icontype = icontype
+        self.onenoteType = onenoteType
+        self.parentUid = parentUid
+        self.lastModifiedDateTime = lastModifiedDateTime
+        self.match = match
+
+
+def decode_dict_elements(document: str):
+    return {data['uid']: DictOneNoteElement(data['title'], data['autocomplete'], data['uid'], data['subtitle'],
+                                            data['arg'], data['icon'], data['icontype'], data['onenoteType'],
+                                            data['parentUid'], data['lastModifiedDateTime'], data['match'])
+            for data in json.loads(document)}
+
+
+def encode_dict_elements(elements):
+    return json.dumps([element.__dict__ for element in elements.values()])
+
+
+def decode_slotted_elements(document: str):
+    return {data['uid']: types.as_onenoteelement(data) for data in onenote_json.loads(document)}
+
+
+def encode_slotted_elements(elements):
+    return onenote_json.dumps([types.onenoteelement_as_dict(element) for element in elements.values()])
+
+
+def generate_document(numberOfElements: int):
+    elements = []
+
+    for index in range(numberOfElements):
+        sectionIndex = index // PAGES_PER_SECTION
+        subtitle = "Notebook {} > Section Group {} > Section {}".format(sectionIndex // 100, sectionIndex // 10,
+                                                                       sectionIndex)
+        title = "Page {}".format(index)
+        elements.append({
+            'title': title,
+            'autocomplete': title,
+            'uid': "0-{:032x}!{}-{:032x}".format(index, sectionIndex, sectionIndex),
+            'subtitle': subtitle,
+            'arg': "onenote:https://d.docs.live.net/notebooks/Section%20{}.one#page-id={}&end".format(sectionIndex,
+                                                                                                    index),
+            'icon': "icons/page.png",
+            'icontype': "file",
+            'onenoteType': types.OneNoteType.PAGE.value,
+            'parentUid': "0-{:032x}".format(sectionIndex),
+            'lastModifiedDateTime': "2021-01-01T00:00:00Z",
+            'match': subtitle + " > " + title,
+        })
+
+    return json.dumps(elements)
+
+
+def measure(decode, encode, document: str):
+    gc.collect()
+    start = time.perf_counter()
+    elements = decode(document)
+    decodeSeconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encode(elements)
+    encodeSeconds = time.perf_counter() - start
+
+    # the memory is measured in a second run, as tracing the allocations slows down the decoding
+    del elements
+    gc.collect()
+    tracemalloc.start()
+    elements = decode(document)
+    memoryInBytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return memoryInBytes, decodeSeconds, encodeSeconds
+
+
+def main(numbersOfElements: [int]):
+    print("{:>10} {:>8} {:>12} {:>12} {:>12}".format("elements", "class", "memory (MB)", "decode (s)", "encode (s)"))
+
+    for numberOfElements in numbersOfElements:
+        document = generate_document(numberOfElements)
+
+        for name, decode, encode in [("dict", decode_dict_elements, encode_dict_elements),
+                                     ("slots", decode_slotted_elements, encode_slotted_elements)]:
+            memoryInBytes, decodeSeconds, encodeSeconds = measure(decode, encode, document)
+            print("{:>10} {:>8} {:>12.1f} {:>12.3f} {:>12.3f}".format(numberOfElements, name,
+                                                                     memoryInBytes / 1024 / 1024, decodeSeconds,
+                                                                     encodeSeconds))
+
+
+if __name__ == "__main__":
+    main([int(argument) for argument in sys.argv[1:]] or DEFAULT_NUMBERS_OF_ELEMENTS)
@@ -0,0 +1,88 @@
+"""
+Measures how long the read-only entry points take to import and to start, and checks that they
+neither import Scrapy, Twisted nor MSAL, which are only needed by a sync. Exits with status 1 if
+a read-only entry point is slower than the limit or imports one of those modules, so that it can
+guard against import-time regressions.
+
+Usage: python benchmarks/benchmark_import_time.py [numberOfRuns]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SOURCE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# modules that the tools reading the synced data import, directly or through the scripts
+READ_ONLY_MODULES = ["pick_page", "search_pages", "find_elements", "main", "onenote_element_store",
+                     "onenote_content_store", "onenote_page_picker"]
+# modules a sync imports, which are measured for comparison
+SYNC_MODULES = ["onenote_sync_scraper", "onenote_page_content_scraper"]
+HEAVY_PACKAGES = ("scrapy", "twisted", "msal")
+
+READ_ONLY_IMPORT_LIMIT_IN_MILLISECONDS = 100
+DEFAULT_NUMBER_OF_RUNS = 5
+
+
+def run_python(arguments: [str], working_directory: str = None):
+    environment = dict(os.environ, PYTHONPATH=SOURCE_FOLDER)
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable] + arguments, cwd=working_directory, env=environment,
+                             capture_output=True, text=True, check=True)
+
+    return time.perf_counter() - start, process.stderr
+
+
+def measure_import(module: str):
+    """
+    Returns the cumulative import time of the module in seconds and the heavy packages it imported.
+    """
+    _, importTimes = run_python(["-X", "importtime", "-c", "import " + module])
+    seconds = 0
+    importedPackages = set()
+
+    for line in importTimes.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulativeMicroseconds, importedModule = line[len("import time:"):].split("|")
+        importedModule = importedModule.strip()
+        if importedModule == module:
+            seconds = int(cumulativeMicroseconds) / 1000000
+        if importedModule.split(".")[0] in HEAVY_PACKAGES:
+            importedPackages.add(importedModule.split(".")[0])
+
+    return seconds, importedPackages
+
+
+def main(numberOfRuns: int):
+    regressions = []
+    print("{:>30} {:>12} {:>24}".format("module", "import (ms)", "heavy packages"))
+
+    for module in READ_ONLY_MODULES + SYNC_MODULES:
+        # the fastest run is the one least disturbed by other processes
+        measurements = [measure_import(module) for _ in range(numberOfRuns)]
+        seconds = min(seconds for seconds, _ in measurements)
+        importedPackages = measurements[0][1]
+        print("{:>30} {:>12.1f} {:>24}".format(module, seconds * 1000, ", ".join(sorted(importedPackages)) or "-"))
+
+        tooSlow = seconds * 1000 > READ_ONLY_IMPORT_LIMIT_IN_MILLISECONDS
+        if module in READ_ONLY_MODULES and (tooSlow or importedPackages):
+            regressions.append(module)
+
+    # the whole start of the picker in a folder without synced data, including the start of the interpreter
+    with tempfile.TemporaryDirectory() as folder:
+        startSeconds = min(run_python(["-c", "pass"], folder)[0] for _ in range(numberOfRuns))
+        pickSeconds = min(run_python([os.path.join(SOURCE_FOLDER, "pick_page.py")], folder)[0]
+                          for _ in range(numberOfRuns))
+    print("\ninterpreter start: {:.1f} ms, pick_page.py: {:.1f} ms".format(startSeconds * 1000, pickSeconds * 1000))
+
+    if regressions:
+        print("\nslower than {} ms or importing {}: {}".format(READ_ONLY_IMPORT_LIMIT_IN_MILLISECONDS,
+                                                              ", ".join(HEAVY_PACKAGES), ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUMBER_OF_RUNS)
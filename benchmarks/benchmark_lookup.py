@@ -0,0 +1,131 @@
+"""
+Measures the lookup index of the titles and match strings: the time to index a synthetic tree of
+notebooks, sections and pages, to update 1% of the elements like an incremental sync does, the
+size of the index and the latency of as-you-type queries, i.e. the prefixes of one or two words,
+with and without restricting them to pages.
+
+Usage: python benchmarks/benchmark_lookup.py [numberOfElements ...]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import onenote_lookup_index as lookup_index
+import onenote_types as types
+from onenote_element_dictionary import OneNoteElementDictionary
+
+DEFAULT_NUMBERS_OF_ELEMENTS = [10000, 100000]
+VOCABULARY_SIZE = 20000
+NOTEBOOKS = 20
+SECTIONS_PER_NOTEBOOK = 50
+NUMBER_OF_QUERIES = 300
+RESULTS_PER_QUERY = 20
+
+
+def generate_title(rng: random.Random, vocabulary: [str], weights: [float]):
+    return " ".join(word.capitalize() for word in rng.choices(vocabulary, cum_weights=weights, k=rng.randint(1, 6)))
+
+
+def create_element(uid: str, title: str, onenoteType: types.OneNoteType, parent: types.OneNoteElement):
+    match = title if parent is None else parent.match + " > " + title
+    return types.OneNoteElement(title, title, uid, parent.match if parent else None, "onenote:" + uid, None, None,
+                                onenoteType, parent.uid if parent else None, None, match)
+
+
+def generate_elements(rng: random.Random, numberOfElements: int, vocabulary: [str], weights: [float]):
+    elements = []
+    for notebookNumber in range(NOTEBOOKS):
+        notebook = create_element("n{}".format(notebookNumber), generate_title(rng, vocabulary, weights),
+                                  types.OneNoteType.NOTEBOOK, None)
+        elements.append(notebook)
+        for sectionNumber in range(SECTIONS_PER_NOTEBOOK):
+            elements.append(create_element("s{}-{}".format(notebookNumber, sectionNumber),
+                                           generate_title(rng, vocabulary, weights), types.OneNoteType.SECTION,
+                                           notebook))
+
+    sections = elements[1:]
+    sections = [element for element in sections if element.onenoteType == types.OneNoteType.SECTION]
+    for pageNumber in range(numberOfElements - len(elements)):
+        elements.append(create_element("p{}".format(pageNumber), generate_title(rng, vocabulary, weights),
+                                       types.OneNoteType.PAGE, rng.choice(sections)))
+
+    return OneNoteElementDictionary(elements)
+
+
+def measure(numberOfElements: int):
+    rng = random.Random(numberOfElements)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    vocabulary = ["".join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(VOCABULARY_SIZE)]
+    # the words are distributed like in natural language (Zipf's law)
+    cumulativeWeights = []
+    total = 0.0
+    for rank in range(1, VOCABULARY_SIZE + 1):
+        total += 1.0 / rank
+        cumulativeWeights.append(total)
+
+    elements = generate_elements(rng, numberOfElements, vocabulary, cumulativeWeights)
+
+    with tempfile.TemporaryDirectory() as folder:
+        databasePath = os.path.join(folder, lookup_index.LOOKUP_INDEX_DATABASE)
+        elementLookupIndex = lookup_index.ElementLookupIndex(databasePath)
+
+        start = time.perf_counter()
+        lookup_index.update_lookup_index(elementLookupIndex, elements)
+        indexSeconds = time.perf_counter() - start
+        elements.clear_changes()
+
+        pagesUids = sorted(elements.uids_of_type(types.OneNoteType.PAGE))
+        for pageUid in rng.sample(pagesUids, numberOfElements // 100):
+            page = elements[pageUid]
+            elements[pageUid] = create_element(pageUid, generate_title(rng, vocabulary, cumulativeWeights),
+                                               types.OneNoteType.PAGE, elements[page.parentUid])
+        start = time.perf_counter()
+        lookup_index.update_lookup_index(elementLookupIndex, elements)
+        updateSeconds = time.perf_counter() - start
+        elementLookupIndex.close()
+
+        # the queries are typed one letter after the other, starting with the second letter of a word
+        queries = []
+        for _ in range(NUMBER_OF_QUERIES):
+            words = [vocabulary[rng.randint(0, 2000)] for _ in range(rng.randint(1, 2))]
+            words[-1] = words[-1][:rng.randint(2, len(words[-1]))]
+            queries.append(" ".join(words))
+
+        elementLookupIndex = lookup_index.ElementLookupIndex(databasePath, read_only=True)
+        latencies = {None: [], types.OneNoteType.PAGE: []}
+        for onenoteType, typeLatencies in latencies.items():
+            for query in queries:
+                start = time.perf_counter()
+                elementLookupIndex.find(query, [onenoteType] if onenoteType else None, RESULTS_PER_QUERY)
+                typeLatencies.append(time.perf_counter() - start)
+        elementLookupIndex.close()
+
+        indexSize = os.path.getsize(databasePath)
+
+    for typeLatencies in latencies.values():
+        typeLatencies.sort()
+    return indexSeconds, updateSeconds, indexSize, [(statistics.median(typeLatencies),
+                                                     typeLatencies[int(len(typeLatencies) * 0.95)])
+                                                    for typeLatencies in latencies.values()]
+
+
+def main(numbersOfElements: [int]):
+    print("{:>10} {:>10} {:>13} {:>10} {:>12} {:>9} {:>17} {:>14}".format(
+        "elements", "index (s)", "update 1% (s)", "size (MB)", "median (ms)", "p95 (ms)", "pages median (ms)",
+        "pages p95 (ms)"))
+
+    for numberOfElements in numbersOfElements:
+        indexSeconds, updateSeconds, indexSize, latencies = measure(numberOfElements)
+        (median, p95), (pagesMedian, pagesP95) = latencies
+        print("{:>10} {:>10.1f} {:>13.2f} {:>10.1f} {:>12.2f} {:>9.2f} {:>17.2f} {:>14.2f}".format(
+            numberOfElements, indexSeconds, updateSeconds, indexSize / 1024 / 1024, median * 1000, p95 * 1000,
+            pagesMedian * 1000, pagesP95 * 1000))
+
+
+if __name__ == "__main__":
+    main([int(argument) for argument in sys.argv[1:]] or DEFAULT_NUMBERS_OF_ELEMENTS)
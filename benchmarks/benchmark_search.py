@@ -0,0 +1,102 @@
+"""
+Measures the full-text index of the pages: the time to index synthetic pages, to update 1% of
+them like an incremental sync does, the size of the index and the latency of ranked queries of
+one to three words.
+
+Usage: python benchmarks/benchmark_search.py [numberOfPages ...]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import onenote_search_index as search_index
+
+DEFAULT_NUMBERS_OF_PAGES = [10000, 50000]
+VOCABULARY_SIZE = 50000
+WORDS_PER_PAGE = 300
+NUMBER_OF_QUERIES = 200
+RESULTS_PER_QUERY = 20
+
+
+def generate_vocabulary(rng: random.Random):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(VOCABULARY_SIZE)]
+
+
+def generate_text(rng: random.Random, vocabulary: [str], weights: [float]):
+    words = rng.choices(vocabulary, cum_weights=weights, k=WORDS_PER_PAGE)
+    return "\n".join(" ".join(words[start:start + 15]) for start in range(0, len(words), 15))
+
+
+def index_pages(pageSearchIndex, pages: {str, str}):
+    with pageSearchIndex.connection:
+        for pageUid, text in pages.items():
+            pageSearchIndex.index_page(pageUid, "Page " + pageUid, "Notebook > Section", text, pageUid)
+
+
+def measure(numberOfPages: int):
+    rng = random.Random(numberOfPages)
+    vocabulary = generate_vocabulary(rng)
+    # the words are distributed like in natural language (Zipf's law)
+    cumulativeWeights = []
+    total = 0.0
+    for rank in range(1, VOCABULARY_SIZE + 1):
+        total += 1.0 / rank
+        cumulativeWeights.append(total)
+
+    pages = {str(index): generate_text(rng, vocabulary, cumulativeWeights) for index in range(numberOfPages)}
+
+    with tempfile.TemporaryDirectory() as folder:
+        databasePath = os.path.join(folder, search_index.SEARCH_INDEX_DATABASE)
+        pageSearchIndex = search_index.PageSearchIndex(databasePath)
+
+        start = time.perf_counter()
+        index_pages(pageSearchIndex, pages)
+        pageSearchIndex.optimize()
+        indexSeconds = time.perf_counter() - start
+
+        modifiedPages = {pageUid: generate_text(rng, vocabulary, cumulativeWeights)
+                         for pageUid in rng.sample(sorted(pages.keys()), numberOfPages // 100)}
+        start = time.perf_counter()
+        index_pages(pageSearchIndex, modifiedPages)
+        updateSeconds = time.perf_counter() - start
+        pageSearchIndex.close()
+
+        # the queries use words of medium frequency, of which the last one may not have been typed completely
+        queries = []
+        for _ in range(NUMBER_OF_QUERIES):
+            words = [vocabulary[rng.randint(10, 2000)] for _ in range(rng.randint(1, 3))]
+            words[-1] = words[-1][:max(3, len(words[-1]) - 2)]
+            queries.append(" ".join(words))
+
+        pageSearchIndex = search_index.PageSearchIndex(databasePath, read_only=True)
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            pageSearchIndex.search(query, RESULTS_PER_QUERY)
+            latencies.append(time.perf_counter() - start)
+        pageSearchIndex.close()
+
+        indexSize = os.path.getsize(databasePath)
+
+    latencies.sort()
+    return indexSeconds, updateSeconds, indexSize, statistics.median(latencies), latencies[int(len(latencies) * 0.95)]
+
+
+def main(numbersOfPages: [int]):
+    print("{:>10} {:>11} {:>13} {:>12} {:>13} {:>10}".format("pages", "index (s)", "update 1% (s)", "size (MB)",
+                                                              "median (ms)", "p95 (ms)"))
+
+    for numberOfPages in numbersOfPages:
+        indexSeconds, updateSeconds, indexSize, median, p95 = measure(numberOfPages)
+        print("{:>10} {:>11.1f} {:>13.2f} {:>12.1f} {:>13.2f} {:>10.2f}".format(
+            numberOfPages, indexSeconds, updateSeconds, indexSize / 1024 / 1024, median * 1000, p95 * 1000))
+
+
+if __name__ == "__main__":
+    main([int(argument) for argument in sys.argv[1:]] or DEFAULT_NUMBERS_OF_PAGES)
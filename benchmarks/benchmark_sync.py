@@ -0,0 +1,454 @@
+"""
+Runs full and incremental syncs of main.py against the local stand-in of the Graph API in
+mock_graph_server.py and reports for every tenant size the wall time, the number of requests,
+the peak memory (RSS) of the sync and the time its requests have been delayed by the rate limiter
+(paced) and by `429 - Too many requests` responses (throttled), summed up over all requests, as
+well as how often the concurrency controller decreased the concurrency, which it has to do once
+the server throttles the sync.
+
+Every sync runs in its own process, as the Twisted reactor cannot be restarted, in a temporary
+folder with its own element and content stores. With `--daemon-syncs`, further incremental syncs
+are run by one sync daemon (sync_daemon.py) in the same folder, which shows the overhead a sync
+saves by keeping the process. With `--accounts`, that many accounts, each with its own tenant and
+stand-in, are synced at the same time by sync_accounts.py, as a full and an incremental sync. The
+windows of the OneNote service limits are shortened by `--time-scale` for both the server and the
+spiders, so that a large tenant can be synced in minutes instead of days.
+
+Usage: python benchmarks/benchmark_sync.py [--pages 1000 10000 100000] [--latency 0.05] [--batch] ...
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from scrapy.statscollectors import MemoryStatsCollector
+
+import mock_graph_server as mock
+
+SOURCE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+STATS_FILE = "crawlerStats.jsonl"
+SYNC_LOG_FILE = "sync.log"
+DAEMON_SOCKET_FILE = "syncDaemon.sock"
+ACCOUNTS_FILE = "accounts.json"
+DAEMON_START_TIMEOUT_IN_SECONDS = 60
+DEFAULT_NUMBERS_OF_PAGES = [1000, 10000, 100000]
+
+
+class FileStatsCollector(MemoryStatsCollector):
+    """
+    Appends the stats of every crawler of a sync to the file `BENCHMARK_STATS_FILE` when its spider is closed.
+    """
+
+    def __init__(self, crawler):
+        super(FileStatsCollector, self).__init__(crawler)
+        self.filePath = crawler.settings.get('BENCHMARK_STATS_FILE')
+
+    def _persist_stats(self, stats, spider):
+        super(FileStatsCollector, self)._persist_stats(stats, spider)
+
+        with open(self.filePath, "a") as file:
+            file.write(json.dumps(dict(stats, spider=spider.name), default=str) + "\n")
+
+
+def configure_sync(configuration: dict, crawler_config: dict):
+    """
+    Points a sync in the current folder to the stand-in, is called in the process of a sync.
+    """
+    import microsoft_graph_device_flow as auth
+
+    # the stand-in accepts every bearer token, therefore no token needs to be requested with the device flow
+    auth.AccountAuthentication.retrieveAccessTokenResult = \
+        lambda self, forceRefresh=False: {"access_token": "benchmark", "expires_in": 3600}
+    # the token holder of the default account has been created with the method of before
+    auth.defaultAccount.accessTokenHolder.retrieveAccessTokenResult = auth.defaultAccount.retrieveAccessTokenResult
+
+    crawler_config.update({
+        'ONENOTE_GRAPH_BASE_URL': configuration["baseUrl"],
+        'ONENOTE_RATE_LIMITS': configuration["limits"],
+        'ONENOTE_BATCH_REQUESTS': configuration["batch"],
+        'STATS_CLASS': 'benchmark_sync.FileStatsCollector',
+        'BENCHMARK_STATS_FILE': os.path.abspath(STATS_FILE),
+        'LOG_LEVEL': 'INFO',
+    })
+
+
+def run_sync(configuration: dict):
+    sys.path.insert(0, SOURCE_FOLDER)
+    import main as sync
+
+    configure_sync(configuration, sync.CRAWLER_CONFIG)
+    sync.main()
+
+
+def run_daemon(configuration: dict):
+    sys.path.insert(0, SOURCE_FOLDER)
+    import sync_daemon
+
+    configure_sync(configuration, sync_daemon.DAEMON_CRAWLER_CONFIG)
+    sync_daemon.run_daemon(None, 0, DAEMON_SOCKET_FILE)
+
+
+def run_accounts(configuration: dict):
+    sys.path.insert(0, SOURCE_FOLDER)
+    import main as sync
+    import sync_accounts
+
+    configure_sync(configuration, sync.CRAWLER_CONFIG)
+    sync_accounts.main(ACCOUNTS_FILE)
+
+
+class SyncResult(object):
+    def __init__(self, seconds: float, peak_rss: int, server_statistics: dict, crawler_stats: [dict]):
+        # the peak RSS is None for the syncs of the daemon, whose process is still running
+        self.seconds = seconds
+        self.peakRss = peak_rss
+        self.serverStatistics = server_statistics
+        self.crawlerStats = crawler_stats
+
+    def crawler_stat(self, name: str):
+        return sum(stats.get(name, 0) for stats in self.crawlerStats)
+
+
+def measure_sync(server: mock.MockGraphServer, folder: str, arguments, limits):
+    """
+    Runs one sync in a new process and returns its SyncResult.
+    """
+    server.reset_statistics()
+    configuration = {"baseUrl": server.base_url, "limits": limits, "batch": arguments.batch}
+    seconds, peakRss = run_process(folder, "--run-sync", configuration)
+
+    return SyncResult(seconds, peakRss, server.statistics.as_dict(), read_crawler_stats(folder))
+
+
+def measure_accounts_sync(servers: [mock.MockGraphServer], folder: str, arguments, limits):
+    """
+    Runs one sync of all accounts in a new process and returns its SyncResult, with the requests of all stand-ins.
+    """
+    accounts = []
+    for accountNumber, server in enumerate(servers):
+        server.reset_statistics()
+        accounts.append({"name": "account{}".format(accountNumber), "config": "config.json",
+                         "settings": {'ONENOTE_GRAPH_BASE_URL': server.base_url}})
+    with open(os.path.join(folder, ACCOUNTS_FILE), "w") as file:
+        json.dump(accounts, file)
+
+    configuration = {"baseUrl": servers[0].base_url, "limits": limits, "batch": arguments.batch}
+    seconds, peakRss = run_process(folder, "--run-accounts", configuration)
+
+    serverStatistics = {"httpRequests": 0, "graphRequests": 0, "statusCounts": {}}
+    for server in servers:
+        statistics = server.statistics.as_dict()
+        serverStatistics["httpRequests"] += statistics["httpRequests"]
+        serverStatistics["graphRequests"] += statistics["graphRequests"]
+        for status, count in statistics["statusCounts"].items():
+            serverStatistics["statusCounts"][status] = serverStatistics["statusCounts"].get(status, 0) + count
+
+    return SyncResult(seconds, peakRss, serverStatistics, read_crawler_stats(folder))
+
+
+def run_process(folder: str, option: str, configuration: dict):
+    """
+    Runs this script with the option in a new process in the folder, returns its wall time and peak RSS.
+    """
+    if os.path.isfile(os.path.join(folder, STATS_FILE)):
+        os.remove(os.path.join(folder, STATS_FILE))
+
+    with open(os.path.join(folder, SYNC_LOG_FILE), "a") as logFile:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), option, json.dumps(configuration)],
+                                   cwd=folder, stdout=logFile, stderr=subprocess.STDOUT)
+        # unlike waiting for the process with subprocess, wait4 returns the resource usage of this process only
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode != 0:
+        raise RuntimeError("The sync failed, see " + os.path.join(folder, SYNC_LOG_FILE))
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peakRss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return seconds, peakRss
+
+
+def read_crawler_stats(folder: str):
+    with open(os.path.join(folder, STATS_FILE), "r") as file:
+        return [json.loads(line) for line in file]
+
+
+def send_daemon_command(folder: str, command: str):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(os.path.join(folder, DAEMON_SOCKET_FILE))
+        connection.sendall((command + "\n").encode("utf-8"))
+
+        with connection.makefile("r", encoding="utf-8") as answer:
+            return answer.readline().strip()
+
+
+def start_daemon(server: mock.MockGraphServer, folder: str, arguments, limits):
+    """
+    Starts the sync daemon in a new process and waits until it listens on its socket.
+    """
+    configuration = {"baseUrl": server.base_url, "limits": limits, "batch": arguments.batch}
+    with open(os.path.join(folder, SYNC_LOG_FILE), "a") as logFile:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--run-daemon",
+                                    json.dumps(configuration)], cwd=folder, stdout=logFile, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT_IN_SECONDS
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            send_daemon_command(folder, "status")
+            return process
+        except OSError:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError("The sync daemon did not start, see " + os.path.join(folder, SYNC_LOG_FILE))
+
+
+def measure_daemon_sync(server: mock.MockGraphServer, folder: str):
+    """
+    Asks the running daemon for a sync and returns its SyncResult once it is finished.
+    """
+    server.reset_statistics()
+    if os.path.isfile(os.path.join(folder, STATS_FILE)):
+        os.remove(os.path.join(folder, STATS_FILE))
+
+    start = time.perf_counter()
+    answer = send_daemon_command(folder, "sync")
+    seconds = time.perf_counter() - start
+    if not answer.startswith("done"):
+        raise RuntimeError("The sync of the daemon failed: " + answer)
+
+    return SyncResult(seconds, None, server.statistics.as_dict(), read_crawler_stats(folder))
+
+
+def verify_sync(folder: str, tenants: [mock.SyntheticTenant], content_folders: [str]):
+    """
+    Checks that the elements synced into the folder have the parents and the versions of the pages
+    of the tenants and that the content store of every tenant (in the folder of its account) has
+    the current content of all its pages and no other pages. Raises an error listing the differences.
+    """
+    sys.path.insert(0, SOURCE_FOLDER)
+    import main as sync
+    import onenote_content_store as content_store
+    import onenote_element_store as element_store
+
+    expectedParents = {}
+    expectedVersions = {}
+    for tenant in tenants:
+        for notebookUid in tenant.notebooks:
+            expectedParents[notebookUid] = None
+        for elementUid, element in list(tenant.sectionGroups.items()) + list(tenant.sections.items()):
+            parent = element["parentSectionGroup"] or element["parentNotebook"]
+            expectedParents[elementUid] = parent["id"]
+        for pageUid, page in tenant.pages.items():
+            expectedParents[pageUid] = page["parentSection"]["id"]
+            expectedVersions[pageUid] = page["lastModifiedDateTime"]
+
+    elementStore = element_store.SqliteElementStore(os.path.join(folder, sync.ONENOTE_ELEMENTS_DATABASE),
+                                                    read_only=True)
+    try:
+        elements = {element.uid: element for element in elementStore.find()}
+    finally:
+        elementStore.close()
+
+    differences = []
+    missingUids = expectedParents.keys() - elements.keys()
+    unexpectedUids = elements.keys() - expectedParents.keys()
+    if missingUids or unexpectedUids:
+        differences.append("{} elements are missing, {} should not be there, e.g. {}".format(
+            len(missingUids), len(unexpectedUids), sorted(missingUids | unexpectedUids)[:3]))
+
+    wrongParents = [uid for uid in expectedParents.keys() & elements.keys()
+                    if elements[uid].parentUid != expectedParents[uid]]
+    if wrongParents:
+        differences.append("{} elements have the wrong parent, e.g. {}".format(len(wrongParents), wrongParents[:3]))
+
+    wrongVersions = [uid for uid in expectedVersions.keys() & elements.keys()
+                     if elements[uid].lastModifiedDateTime != expectedVersions[uid]]
+    if wrongVersions:
+        differences.append("{} pages have an old version, e.g. {}".format(len(wrongVersions), wrongVersions[:3]))
+
+    for tenant, contentFolder in zip(tenants, content_folders):
+        storedPages = read_stored_pages(sync, content_store, contentFolder)
+        missingUids = tenant.pages.keys() - storedPages.keys()
+        unexpectedUids = storedPages.keys() - tenant.pages.keys()
+        if missingUids or unexpectedUids:
+            differences.append("{} page contents are missing, {} should not be there in {}, e.g. {}".format(
+                len(missingUids), len(unexpectedUids), contentFolder, sorted(missingUids | unexpectedUids)[:3]))
+
+        # the stand-in writes the version of the content into every page
+        oldContents = [pageUid for pageUid in tenant.pages.keys() & storedPages.keys() if
+                       "<p>Version {}</p>".format(tenant.contentVersions[pageUid]) not in storedPages[pageUid]]
+        if oldContents:
+            differences.append("{} page contents are outdated in {}, e.g. {}".format(len(oldContents), contentFolder,
+                                                                                    oldContents[:3]))
+
+    if differences:
+        raise RuntimeError("The synced data does not match the tenant: " + "; ".join(differences))
+
+
+def read_stored_pages(sync, content_store, folder: str):
+    """
+    Returns the content of every page in the content store of the folder (page uid -> content).
+    """
+    if sync.CONTENT_STORE_BACKEND == content_store.PACKED_BACKEND:
+        store = content_store.PackedContentStore(os.path.join(folder, sync.PAGE_CONTENT_PACK_FOLDER))
+        try:
+            return dict(store.iterate_pages())
+        finally:
+            store.close()
+
+    store = content_store.FileContentStore(os.path.join(folder, sync.PAGE_CONTENT_FOLDER))
+    return {fileName[:-len(content_store.PAGE_FILE_EXTENSION)]:
+            store.read(fileName[:-len(content_store.PAGE_FILE_EXTENSION)])
+            for fileName in os.listdir(store.folderPath) if fileName.endswith(content_store.PAGE_FILE_EXTENSION)}
+
+
+def print_result(numberOfPages: int, kind: str, result: SyncResult):
+    statusCounts = result.serverStatistics["statusCounts"]
+    peakRss = "{:.1f}".format(result.peakRss / 1024 / 1024) if result.peakRss is not None else "-"
+    decreases = result.crawler_stat('onenote_aimd/decreases')
+    print("{:>8} {:>12} {:>9.2f} {:>9} {:>9} {:>6} {:>6} {:>9} {:>10.1f} {:>13.1f} {:>10}".format(
+        numberOfPages, kind, result.seconds, result.serverStatistics["httpRequests"],
+        result.serverStatistics["graphRequests"], statusCounts.get(401, 0), statusCounts.get(429, 0),
+        peakRss, result.crawler_stat('onenote_rate_limiter/delay_seconds'),
+        result.crawler_stat('onenote_rate_limiter/throttled_seconds'), decreases))
+
+    # the AIMD controller has to back off when the server throttles the sync
+    if statusCounts.get(429, 0) and not decreases:
+        print("WARNING: {} requests have been throttled, but the concurrency has never been decreased."
+              .format(statusCounts[429]))
+
+
+def main(arguments):
+    limits = [(capacity, period / arguments.time_scale) for capacity, period in mock.ONENOTE_SERVICE_LIMITS]
+    options = mock.MockGraphOptions(arguments.latency, arguments.unauthorized_rate, arguments.throttle_rate,
+                                    time_scale=arguments.time_scale,
+                                    max_account_sections=arguments.max_account_sections)
+
+    print("{:>8} {:>12} {:>9} {:>9} {:>9} {:>6} {:>6} {:>9} {:>10} {:>13} {:>10}".format(
+        "pages", "sync", "wall (s)", "HTTP", "Graph", "401", "429", "RSS (MB)", "paced (s)", "throttled (s)",
+        "decreases"))
+
+    for numberOfPages in arguments.pages:
+        tenant = mock.SyntheticTenant(numberOfPages, content_size=arguments.content_size)
+        server = mock.MockGraphServer(tenant, options).start()
+        folder = tempfile.mkdtemp(prefix="onenote-benchmark-")
+
+        try:
+            with open(os.path.join(folder, "lastSyncDate.txt"), "w") as file:
+                file.write("")
+            with open(os.path.join(folder, "onenoteElements.json"), "w") as file:
+                file.write("[]")
+
+            print_result(numberOfPages, "full", measure_sync(server, folder, arguments, limits))
+            verify_sync(folder, [tenant], [folder])
+
+            tenant.modify_pages(arguments.modified, arguments.deleted, arguments.added)
+            print_result(numberOfPages, "incremental", measure_sync(server, folder, arguments, limits))
+            verify_sync(folder, [tenant], [folder])
+
+            if arguments.daemon_syncs:
+                daemon = start_daemon(server, folder, arguments, limits)
+                try:
+                    for syncNumber in range(1, arguments.daemon_syncs + 1):
+                        tenant.modify_pages(arguments.modified, arguments.deleted, arguments.added)
+                        print_result(numberOfPages, "daemon #{}".format(syncNumber),
+                                     measure_daemon_sync(server, folder))
+                        verify_sync(folder, [tenant], [folder])
+                finally:
+                    send_daemon_command(folder, "stop")
+                    daemon.wait()
+        finally:
+            server.stop()
+            if not arguments.keep:
+                shutil.rmtree(folder)
+            else:
+                print("kept " + folder)
+
+        if arguments.accounts:
+            measure_accounts(numberOfPages, arguments, limits, options)
+
+
+def measure_accounts(numberOfPages: int, arguments, limits, options: mock.MockGraphOptions):
+    """
+    Runs a full and an incremental sync of `--accounts` accounts with the same number of pages.
+    """
+    tenants = [mock.SyntheticTenant(numberOfPages, content_size=arguments.content_size,
+                                    id_prefix="account{}-".format(accountNumber))
+               for accountNumber in range(arguments.accounts)]
+    servers = [mock.MockGraphServer(tenant, options).start() for tenant in tenants]
+    folder = tempfile.mkdtemp(prefix="onenote-benchmark-")
+    kind = "{} accounts".format(arguments.accounts)
+    # sync_accounts.py keeps the stores of every account in accounts/<name>/
+    accountFolders = [os.path.join(folder, "accounts", "account{}".format(accountNumber))
+                      for accountNumber in range(arguments.accounts)]
+
+    try:
+        print_result(numberOfPages, kind, measure_accounts_sync(servers, folder, arguments, limits))
+        verify_sync(folder, tenants, accountFolders)
+
+        for tenant in tenants:
+            tenant.modify_pages(arguments.modified, arguments.deleted, arguments.added)
+        print_result(numberOfPages, kind + " +", measure_accounts_sync(servers, folder, arguments, limits))
+        verify_sync(folder, tenants, accountFolders)
+    finally:
+        for server in servers:
+            server.stop()
+        if not arguments.keep:
+            shutil.rmtree(folder)
+        else:
+            print("kept " + folder)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmarks full and incremental syncs against a local Graph API.")
+    parser.add_argument("--pages", type=int, nargs="+", default=DEFAULT_NUMBERS_OF_PAGES,
+                        help="the numbers of pages of the synthetic tenants")
+    parser.add_argument("--latency", type=float, default=0.0, help="the latency of every request in seconds")
+    parser.add_argument("--unauthorized-rate", type=float, default=0.0,
+                        help="the share of requests answered with 401 - Unauthorized")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="the share of requests answered with 429 - Too many requests")
+    parser.add_argument("--max-account-sections", type=int, default=None,
+                        help="the listing of the pages of the account fails for tenants with more sections")
+    parser.add_argument("--time-scale", type=float, default=3600.0,
+                        help="the windows of the service limits are divided by this factor")
+    parser.add_argument("--content-size", type=int, default=mock.CONTENT_SIZE_IN_BYTES,
+                        help="the size of the content of a page in bytes")
+    parser.add_argument("--modified", type=float, default=0.01,
+                        help="the share of the pages modified before the incremental sync")
+    parser.add_argument("--deleted", type=float, default=0.001,
+                        help="the share of the pages deleted before the incremental sync")
+    parser.add_argument("--added", type=float, default=0.001,
+                        help="the share of pages added before the incremental sync")
+    parser.add_argument("--batch", action="store_true", help="groups the requests into JSON batch requests")
+    parser.add_argument("--daemon-syncs", type=int, default=0,
+                        help="the number of incremental syncs run by the sync daemon after the other syncs")
+    parser.add_argument("--accounts", type=int, default=0,
+                        help="the number of accounts synced at the same time after the other syncs")
+    parser.add_argument("--keep", action="store_true", help="keeps the folders of the syncs")
+    parser.add_argument("--run-sync", help=argparse.SUPPRESS)
+    parser.add_argument("--run-daemon", help=argparse.SUPPRESS)
+    parser.add_argument("--run-accounts", help=argparse.SUPPRESS)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    parsedArguments = parse_arguments()
+
+    if parsedArguments.run_sync is not None:
+        run_sync(json.loads(parsedArguments.run_sync))
+    elif parsedArguments.run_daemon is not None:
+        run_daemon(json.loads(parsedArguments.run_daemon))
+    elif parsedArguments.run_accounts is not None:
+        run_accounts(json.loads(parsedArguments.run_accounts))
+    else:
+        main(parsedArguments)
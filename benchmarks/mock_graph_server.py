@@ -0,0 +1,508 @@
+"""
+Local stand-in of the OneNote part of the Microsoft Graph API for benchmarks and manual tests. It
+serves a synthetic tenant of notebooks, section groups, sections and pages, with paginated page
+listings (`@odata.nextLink`), page contents with ETags and JSON batch requests. Latency, `401 -
+Unauthorized` and `429 - Too many requests` responses (with `Retry-After`) can be injected, and
+the OneNote service limits (120 requests a minute and 400 an hour) are enforced, optionally with
+shorter windows so that large tenants can be synced in a reasonable time.
+
+Usage: python benchmarks/mock_graph_server.py [numberOfPages] [port]
+
+The spiders are pointed to it with `'ONENOTE_GRAPH_BASE_URL': 'http://127.0.0.1:<port>'` in the
+crawler configuration; it accepts any bearer token.
+"""
+import base64
+import collections
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlencode, urlparse
+
+GRAPH_VERSION_PATH = "/v1.0"
+ONENOTE_SERVICE_LIMITS = ((120, 60), (400, 60 * 60))
+DEFAULT_PAGE_SIZE = 20
+
+PAGES_PER_SECTION = 50
+SECTIONS_PER_NOTEBOOK = 20
+# every other section of a notebook is in one of its section groups
+SECTION_GROUPS_PER_NOTEBOOK = 2
+CONTENT_SIZE_IN_BYTES = 2048
+
+SECTION_PAGES_PATH_PATTERN = re.compile(r"^/(?:me|users/me)/onenote/sections/([^/]+)/pages$")
+PAGE_CONTENT_PATH_PATTERN = re.compile(r"^/(?:me|users/me)/onenote/pages/([^/]+)/content$")
+MODIFIED_SINCE_FILTER_PATTERN = re.compile(r"lastModifiedDateTime ge (\S+)")
+
+
+def format_graph_date(date: datetime):
+    return date.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def parse_graph_date(value: str):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class SyntheticTenant(object):
+    """
+    The notebooks, section groups, sections and pages of a synthetic user, in the format the Graph
+    API lists them. All elements have been modified before the tenant was created, `modify_pages`
+    changes, deletes and adds pages for an incremental sync afterward. The ids of all elements start
+    with `id_prefix`, so that several tenants can be told apart, e.g. as the accounts of one sync.
+    """
+
+    def __init__(self, number_of_pages: int, pages_per_section: int = PAGES_PER_SECTION,
+                 sections_per_notebook: int = SECTIONS_PER_NOTEBOOK, content_size: int = CONTENT_SIZE_IN_BYTES,
+                 seed: int = 0, id_prefix: str = ""):
+        self.random = random.Random(seed)
+        self.idPrefix = id_prefix
+        self.contentSize = content_size
+        self.lock = threading.Lock()
+        self.notebooks: {str, dict} = {}
+        self.sectionGroups: {str, dict} = {}
+        self.sections: {str, dict} = {}
+        self.pages: {str, dict} = {}
+        self.pagesBySection: {str, {str, dict}} = {}
+        # is increased by every modification, the server caches the sorted page listings per revision
+        self.revision = 0
+        # page uid -> version of the content, which is also its ETag
+        self.contentVersions: {str, int} = {}
+        self.nextPageNumber = 0
+
+        numberOfSections = max(1, math.ceil(number_of_pages / pages_per_section))
+        created = datetime.now(timezone.utc) - timedelta(days=365)
+
+        for sectionNumber in range(numberOfSections):
+            notebookNumber = sectionNumber // sections_per_notebook
+            notebook = self.notebooks.get("{}notebook-{}".format(self.idPrefix, notebookNumber)) or \
+                self.add_notebook(notebookNumber, created)
+            sectionGroup = None
+            if sectionNumber % 2:
+                groupNumber = notebookNumber * SECTION_GROUPS_PER_NOTEBOOK + \
+                    sectionNumber // 2 % SECTION_GROUPS_PER_NOTEBOOK
+                sectionGroup = self.sectionGroups.get("{}group-{}".format(self.idPrefix, groupNumber)) or \
+                    self.add_section_group(groupNumber, notebook, created)
+
+            section = self.add_section(sectionNumber, notebook, sectionGroup, created)
+            for _ in range(min(pages_per_section, number_of_pages - len(self.pages))):
+                # the pages have been modified at different times during the last year
+                self.add_page(section, created + timedelta(seconds=self.random.randrange(365 * 24 * 60 * 60)))
+
+    def add_notebook(self, number: int, modified: datetime):
+        notebook = {
+            "id": "{}notebook-{}".format(self.idPrefix, number),
+            "displayName": "Notebook {}".format(number),
+            "lastModifiedDateTime": format_graph_date(modified),
+            "links": {"oneNoteClientUrl": {"href": "onenote:https://d.docs.live.net/Notebook%20{}".format(number)}},
+        }
+        self.notebooks[notebook["id"]] = notebook
+        return notebook
+
+    def add_section_group(self, number: int, notebook: dict, modified: datetime):
+        sectionGroup = {
+            "id": "{}group-{}".format(self.idPrefix, number),
+            "displayName": "Section Group {}".format(number),
+            "lastModifiedDateTime": format_graph_date(modified),
+            "parentNotebook": {"id": notebook["id"], "displayName": notebook["displayName"]},
+            "parentSectionGroup": None,
+        }
+        self.sectionGroups[sectionGroup["id"]] = sectionGroup
+        return sectionGroup
+
+    def add_section(self, number: int, notebook: dict, sectionGroup: dict, modified: datetime):
+        section = {
+            "id": "{}section-{}".format(self.idPrefix, number),
+            "displayName": "Section {}".format(number),
+            "lastModifiedDateTime": format_graph_date(modified),
+            "links": {"oneNoteClientUrl": {"href": "onenote:https://d.docs.live.net/Section%20{}.one".format(number)}},
+            "parentNotebook": {"id": notebook["id"], "displayName": notebook["displayName"]},
+            "parentSectionGroup": {"id": sectionGroup["id"]} if sectionGroup is not None else None,
+        }
+        self.sections[section["id"]] = section
+        self.pagesBySection[section["id"]] = {}
+        return section
+
+    def add_page(self, section: dict, modified: datetime):
+        number = self.nextPageNumber
+        self.nextPageNumber += 1
+        page = {
+            "id": "{}page-{}".format(self.idPrefix, number),
+            "title": "Page {}".format(number),
+            "lastModifiedDateTime": format_graph_date(modified),
+            "links": {"oneNoteClientUrl": {"href": "{}#Page%20{}&page-id={{{}}}".format(
+                section["links"]["oneNoteClientUrl"]["href"], number, number)}},
+            "parentSection": {"id": section["id"], "displayName": section["displayName"]},
+        }
+        self.pages[page["id"]] = page
+        self.pagesBySection[section["id"]][page["id"]] = page
+        self.contentVersions[page["id"]] = 1
+        return page
+
+    def touch_section(self, sectionUid: str, modified: datetime):
+        """
+        Like OneNote, marks the section and its parents as modified when one of its pages changed.
+        """
+        section = self.sections[sectionUid]
+        section["lastModifiedDateTime"] = format_graph_date(modified)
+        self.notebooks[section["parentNotebook"]["id"]]["lastModifiedDateTime"] = format_graph_date(modified)
+
+        if section["parentSectionGroup"] is not None:
+            self.sectionGroups[section["parentSectionGroup"]["id"]]["lastModifiedDateTime"] = \
+                format_graph_date(modified)
+
+    def modify_pages(self, modified_fraction: float, deleted_fraction: float = 0.0, added_fraction: float = 0.0):
+        """
+        Changes the content of, deletes and adds the given fractions of the pages now.
+        """
+        now = datetime.now(timezone.utc)
+
+        with self.lock:
+            pagesUids = sorted(self.pages.keys())
+            changedPagesUids = self.random.sample(pagesUids, round(len(pagesUids) * modified_fraction))
+            deletedPagesUids = self.random.sample(pagesUids, round(len(pagesUids) * deleted_fraction))
+            sectionsUids = sorted(self.sections.keys())
+
+            for pageUid in changedPagesUids:
+                self.pages[pageUid]["lastModifiedDateTime"] = format_graph_date(now)
+                self.contentVersions[pageUid] += 1
+                self.touch_section(self.pages[pageUid]["parentSection"]["id"], now)
+
+            for pageUid in deletedPagesUids:
+                if pageUid in self.pages:
+                    sectionUid = self.pages[pageUid]["parentSection"]["id"]
+                    self.touch_section(sectionUid, now)
+                    del self.pagesBySection[sectionUid][pageUid]
+                    del self.pages[pageUid]
+                    del self.contentVersions[pageUid]
+
+            for _ in range(round(len(pagesUids) * added_fraction)):
+                section = self.sections[self.random.choice(sectionsUids)]
+                self.add_page(section, now)
+                self.touch_section(section["id"], now)
+
+            self.revision += 1
+
+    def page_content(self, pageUid: str):
+        page = self.pages[pageUid]
+        header = "<html><head><title>{}</title></head><body><p>Version {}</p>".format(
+            page["title"], self.contentVersions[pageUid])
+        filler = "<p>{}</p>".format("Lorem ipsum dolor sit amet. " * 8)
+
+        body = header + filler * max(1, (self.contentSize - len(header)) // len(filler)) + "</body></html>"
+        return body.encode("utf-8")
+
+
+class SlidingWindowQuota(object):
+    """
+    Counts the requests of the last `period` seconds and tells how long a request has to wait
+    for the quota. Unlike the token buckets of the spiders this is how a server enforces it.
+    """
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.period = period
+        self.requestTimes = collections.deque()
+
+    def acquire(self, now: float):
+        """
+        Counts a request and returns 0 or, if the quota is exhausted, the seconds until it has a free slot again.
+        """
+        while self.requestTimes and self.requestTimes[0] <= now - self.period:
+            self.requestTimes.popleft()
+
+        if len(self.requestTimes) >= self.capacity:
+            return self.requestTimes[0] + self.period - now
+
+        self.requestTimes.append(now)
+        return 0
+
+
+class MockGraphOptions(object):
+    """
+    The behaviour of the server: the latency of every request, the share of requests answered with
+    `401 - Unauthorized` or with `429 - Too many requests` and the enforced limits, whose windows
+    are divided by `time_scale` (e.g. 3600 lets an hour of quota pass in a second). Like the Graph
+    API, the listing of the pages of the account fails for tenants with more than
+    `max_account_sections` sections, if it is set.
+    """
+
+    def __init__(self, latency: float = 0.0, unauthorized_rate: float = 0.0, throttle_rate: float = 0.0,
+                 retry_after: int = 1, limits=ONENOTE_SERVICE_LIMITS, time_scale: float = 1.0, seed: int = 0,
+                 max_account_sections: int = None):
+        self.maxAccountSections = max_account_sections
+        self.latency = latency
+        self.unauthorizedRate = unauthorized_rate
+        self.throttleRate = throttle_rate
+        self.retryAfter = retry_after
+        self.limits = tuple((capacity, period / time_scale) for capacity, period in limits)
+        self.random = random.Random(seed)
+
+
+class MockGraphStatistics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.httpRequests = 0
+        # every sub-request of a batch request counts as a request, like for the service limits
+        self.graphRequests = 0
+        self.statusCounts: {int, int} = collections.Counter()
+
+    def count(self, httpRequests: int = 0, graphRequests: int = 0, status: int = None):
+        with self.lock:
+            self.httpRequests += httpRequests
+            self.graphRequests += graphRequests
+            if status is not None:
+                self.statusCounts[status] += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "httpRequests": self.httpRequests,
+                "graphRequests": self.graphRequests,
+                "statusCounts": dict(self.statusCounts),
+            }
+
+
+class MockGraphServer(object):
+    """
+    Serves a tenant on a local port (a free one if the port is 0) in a background thread.
+    """
+
+    def __init__(self, tenant: SyntheticTenant, options: MockGraphOptions = None, port: int = 0):
+        self.tenant = tenant
+        self.options = options or MockGraphOptions()
+        self.statistics = MockGraphStatistics()
+        self.quotaLock = threading.Lock()
+        self.quotas = [SlidingWindowQuota(capacity, period) for capacity, period in self.options.limits]
+        # (path, $filter, $orderby) -> (revision of the tenant, filtered and sorted pages)
+        self.listingCache: {(str, str, str), (int, [dict])} = {}
+        self.httpServer = ThreadingHTTPServer(("127.0.0.1", port), self.request_handler_class())
+        self.httpServer.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return "http://{}:{}".format(*self.httpServer.server_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpServer.serve_forever, name="MockGraphServer", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+
+    def reset_statistics(self):
+        self.statistics = MockGraphStatistics()
+
+    def request_handler_class(self):
+        server = self
+
+        class RequestHandler(MockGraphRequestHandler):
+            mockServer = server
+
+        return RequestHandler
+
+    def acquire_quota(self):
+        """
+        Returns None if the request is within the limits, otherwise the seconds to wait as `Retry-After`.
+        """
+        with self.quotaLock:
+            now = time.monotonic()
+            waitingTime = max(quota.acquire(now) for quota in self.quotas)
+
+        return None if waitingTime <= 0 else max(1, math.ceil(waitingTime))
+
+    def inject_fault(self):
+        """
+        Returns the status of an injected `401 - Unauthorized` or `429 - Too many requests` or None.
+        """
+        draw = self.options.random.random()
+        if draw < self.options.unauthorizedRate:
+            return 401
+        if draw < self.options.unauthorizedRate + self.options.throttleRate:
+            return 429
+
+        return None
+
+    def handle(self, method: str, url: str, headers: {str, str}, body: bytes = None):
+        """
+        Returns the status, the headers and the body of the response to a Graph request.
+        """
+        fault = self.inject_fault()
+        if fault == 401:
+            return json_response(401, {"error": {"code": "InvalidAuthenticationToken"}})
+
+        retryAfter = self.options.retryAfter if fault == 429 else self.acquire_quota()
+        if retryAfter is not None:
+            return json_response(429, {"error": {"code": "20166", "message": "Too many requests"}},
+                                 {"Retry-After": str(retryAfter)})
+
+        parsedUrl = urlparse(url)
+        path = parsedUrl.path[len(GRAPH_VERSION_PATH):] if parsedUrl.path.startswith(GRAPH_VERSION_PATH) \
+            else parsedUrl.path
+        parameters = {key: values[0] for key, values in parse_qs(parsedUrl.query).items()}
+
+        with self.tenant.lock:
+            if method == "GET":
+                return self.handle_get(path, parameters, headers)
+
+        return json_response(405, {"error": {"code": "MethodNotAllowed"}})
+
+    def handle_get(self, path: str, parameters: {str, str}, headers: {str, str}):
+        tenant = self.tenant
+
+        if path in ("/me/onenote/notebooks", "/users/me/onenote/notebooks"):
+            return json_response(200, {"value": list(tenant.notebooks.values())})
+        if path in ("/me/onenote/sectionGroups", "/users/me/onenote/sectionGroups"):
+            return json_response(200, {"value": list(tenant.sectionGroups.values())})
+        if path in ("/me/onenote/sections", "/users/me/onenote/sections"):
+            return json_response(200, {"value": list(tenant.sections.values())})
+        if path in ("/me/onenote/pages", "/users/me/onenote/pages"):
+            if self.options.maxAccountSections is not None and len(tenant.sections) > self.options.maxAccountSections:
+                return json_response(400, {"error": {"code": "20266",
+                                                     "message": "The number of maximum sections is exceeded."}})
+            return self.list_pages(path, parameters, tenant.pages.values())
+
+        match = SECTION_PAGES_PATH_PATTERN.match(path)
+        if match:
+            if match.group(1) not in tenant.sections:
+                return json_response(404, {"error": {"code": "20111"}})
+            return self.list_pages(path, parameters, tenant.pagesBySection[match.group(1)].values())
+
+        match = PAGE_CONTENT_PATH_PATTERN.match(path)
+        if match:
+            pageUid = match.group(1)
+            if pageUid not in tenant.pages:
+                return json_response(404, {"error": {"code": "20102"}})
+
+            etag = '"{}-{}"'.format(pageUid, tenant.contentVersions[pageUid])
+            if headers.get("If-None-Match") == etag:
+                return 304, {"ETag": etag}, b""
+            return 200, {"Content-Type": "text/html", "ETag": etag}, tenant.page_content(pageUid)
+
+        return json_response(404, {"error": {"code": "NotFound"}})
+
+    def list_pages(self, path: str, parameters: {str, str}, pages: [dict]):
+        """
+        Lists the pages like the Graph API, with `$filter`, `$orderby`, `$select=id` and the paging with `$top`.
+        """
+        pages = self.filtered_and_sorted_pages(path, parameters.get("$filter", ""), parameters.get("$orderby", ""),
+                                               pages)
+
+        top = int(parameters.get("$top", DEFAULT_PAGE_SIZE))
+        skip = int(parameters.get("$skip", 0))
+        value = pages[skip:skip + top]
+        if parameters.get("$select") == "id":
+            value = [{"id": page["id"]} for page in value]
+
+        body = {"value": value}
+        if skip + top < len(pages):
+            nextParameters = dict(parameters, **{"$skip": str(skip + top)})
+            body["@odata.nextLink"] = self.base_url + GRAPH_VERSION_PATH + path + "?" + \
+                urlencode(nextParameters, quote_via=quote, safe="$,()=:")
+
+        return json_response(200, body)
+
+    def filtered_and_sorted_pages(self, path: str, filter: str, orderBy: str, pages: [dict]):
+        """
+        The result is cached until the tenant is modified, so that paging through a listing does not sort it again.
+        """
+        key = (path, filter, orderBy)
+        cached = self.listingCache.get(key)
+        if cached is not None and cached[0] == self.tenant.revision:
+            return cached[1]
+
+        modifiedSince = MODIFIED_SINCE_FILTER_PATTERN.match(filter)
+        if modifiedSince:
+            since = parse_graph_date(modifiedSince.group(1))
+            pages = [page for page in pages if parse_graph_date(page["lastModifiedDateTime"]) >= since]
+
+        if orderBy.startswith("lastModifiedDateTime"):
+            pages = sorted(pages, key=lambda page: page["lastModifiedDateTime"], reverse=orderBy.endswith("desc"))
+        else:
+            pages = sorted(pages, key=lambda page: page["id"])
+
+        self.listingCache[key] = (self.tenant.revision, pages)
+        return pages
+
+    def handle_batch(self, body: bytes):
+        """
+        Answers the sub-requests of a JSON batch request, every one of them counts against the limits.
+        """
+        responses = []
+
+        for subRequest in json.loads(body)["requests"]:
+            status, headers, subBody = self.handle(subRequest["method"], GRAPH_VERSION_PATH + subRequest["url"],
+                                                   subRequest.get("headers") or {})
+            self.statistics.count(graphRequests=1, status=status)
+
+            response = {"id": subRequest["id"], "status": status, "headers": headers}
+            if subBody:
+                # JSON bodies are embedded as they are, all other bodies base64 encoded
+                response["body"] = json.loads(subBody) if headers.get("Content-Type") == "application/json" \
+                    else base64.b64encode(subBody).decode("ascii")
+            responses.append(response)
+
+        return json_response(200, {"responses": responses})
+
+
+class MockGraphRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mockServer: MockGraphServer = None
+
+    def do_GET(self):
+        self.respond(*self.handle_request())
+
+    def do_POST(self):
+        self.respond(*self.handle_request())
+
+    def handle_request(self):
+        server = self.mockServer
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if server.options.latency > 0:
+            time.sleep(server.options.latency)
+
+        server.statistics.count(httpRequests=1)
+        if not self.headers.get("Authorization", "").lower().startswith("bearer "):
+            return json_response(401, {"error": {"code": "InvalidAuthenticationToken"}})
+
+        if self.command == "POST" and urlparse(self.path).path == GRAPH_VERSION_PATH + "/$batch":
+            return server.handle_batch(body)
+
+        status, headers, body = server.handle(self.command, self.path, dict(self.headers.items()))
+        server.statistics.count(graphRequests=1, status=status)
+        return status, headers, body
+
+    def respond(self, status: int, headers: {str, str}, body: bytes):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def json_response(status: int, data, headers: {str, str} = None):
+    return status, dict(headers or {}, **{"Content-Type": "application/json"}), json.dumps(data).encode("utf-8")
+
+
+def main(numberOfPages: int, port: int):
+    server = MockGraphServer(SyntheticTenant(numberOfPages), port=port).start()
+    print("Serving {} pages at {}".format(numberOfPages, server.base_url))
+
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000, int(sys.argv[2]) if len(sys.argv) > 2 else 8765)
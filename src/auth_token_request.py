@@ -1,5 +1,6 @@
-from scrapy import Request
+from scrapy import Request, signals
 from scrapy.http.headers import Headers
+from scrapy.utils.defer import maybe_deferred_to_future
 
 import microsoft_graph_device_flow as auth
 
@@ -7,15 +8,63 @@ import microsoft_graph_device_flow as auth
 class AuthTokenRequest(Request):
     """
     Override the Request object in order to set a new authorization token into the header when
-    the token expires. The token is a global variable.
+    the token expires. The token is held in memory by the access token holder of an account
+    (`auth.accessTokenHolder` by default) and only gets written into the headers of this request
+    when it differs from the one already set.
     Taken from: https://stackoverflow.com/questions/28771174/scrapy-scraped-website-authentication-token-expires-while-scraping
     """
 
+    # the holder is passed on to the copies of the request, e.g. the retried ones
+    attributes = Request.attributes + ("access_token_holder",)
+
+    def __init__(self, *args, access_token_holder: auth.AccessTokenHolder = None, **kwargs):
+        self.access_token_holder = access_token_holder or auth.accessTokenHolder
+        super(AuthTokenRequest, self).__init__(*args, **kwargs)
+
     @property
     def headers(self):
-        authorization_token = auth.retrieveAccessToken()
-        return Headers({'Authorization': 'BEARER {}'.format(authorization_token)}, encoding=self.encoding)
+        authorization_token = self.access_token_holder.get()
+
+        if authorization_token != self.authorization_token:
+            self._headers['Authorization'] = 'BEARER {}'.format(authorization_token)
+            self.authorization_token = authorization_token
+
+        return self._headers
 
     @headers.setter
     def headers(self, value):
-        pass
+        self._headers = Headers(value or {}, encoding=self.encoding)
+        self.authorization_token = None
+
+    def invalidate_authorization_token(self):
+        """
+        Is called when the server rejected the token of this request.
+        """
+        self.access_token_holder.invalidate(self.authorization_token)
+
+
+class AccessTokenRefreshMiddleware(object):
+    """
+    Downloader middleware that refreshes the access token of a request in a thread before the
+    request is sent, if it is about to expire or has been rejected, so that neither MSAL nor the
+    device flow blocks the reactor. The requests of the account wait for the refresh, the ones of
+    other accounts keep going. It runs after the rate limiter, whose waits can outlast the token.
+
+    The token of the spider is only refreshed in a thread from the time the spider is opened on,
+    reading the headers of a request on the reactor thread then never refreshes it.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls()
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        return middleware
+
+    def spider_opened(self, spider):
+        accessTokenHolder = getattr(spider, 'accessTokenHolder', None)
+        if accessTokenHolder is not None:
+            accessTokenHolder.refreshesInThread = True
+
+    async def process_request(self, request, spider):
+        if isinstance(request, AuthTokenRequest) and request.access_token_holder.needs_refresh():
+            await maybe_deferred_to_future(request.access_token_holder.refresh_in_thread())
@@ -0,0 +1,50 @@
+"""
+Looks up the notebooks, section groups, sections and pages whose title or match string contains
+words starting with the words of the query in the lookup index written by the sync, and prints
+the best matching ones as Alfred script filter results. Like search_pages.py it only reads the
+synced data.
+
+Usage: python ./src/find_elements.py [--type page] [--type section] <query>
+"""
+import argparse
+import os
+import sys
+
+import onenote_element_store as element_store
+import onenote_json
+import onenote_lookup_index as lookup_index
+import onenote_settings as settings
+import onenote_types as types
+
+MAX_RESULTS = 20
+
+
+def main(query: str, onenoteTypes: [types.OneNoteType] = None):
+    items = []
+
+    if os.path.isfile(lookup_index.LOOKUP_INDEX_DATABASE):
+        elementLookupIndex = lookup_index.ElementLookupIndex(lookup_index.LOOKUP_INDEX_DATABASE, read_only=True)
+        try:
+            uids = elementLookupIndex.find(query, onenoteTypes, MAX_RESULTS)
+        finally:
+            elementLookupIndex.close()
+
+        elements = element_store.read_elements(settings.ONENOTE_ELEMENTS_DATABASE, settings.ONENOTE_ELEMENTS_FILE, uids)
+        items = [types.onenoteelement_as_dict(element) for element in elements if element is not None]
+
+    sys.stdout.write(onenote_json.dumps({"items": items}) + "\n")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Finds OneNote elements by the words of their title and path.")
+    parser.add_argument("--type", dest="types", action="append",
+                        choices=[onenoteType.value for onenoteType in types.OneNoteType],
+                        help="only finds elements of this type, can be repeated")
+    parser.add_argument("query", nargs="*")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    main(" ".join(arguments.query), arguments.types)
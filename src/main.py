@@ -1,123 +1,401 @@
-import json
 import os
 from datetime import datetime
 
-from scrapy.crawler import CrawlerRunner
-from scrapy.utils.log import configure_logging
-from twisted.internet import defer, reactor
-
-import onenote_page_content_scraper as page_content_scraper
-import onenote_sync_scraper as sync_scraper
+import onenote_checkpoint as checkpoints
+import onenote_content_store as content_store
+import onenote_content_versions as content_versions
+import onenote_element_store as element_store
+import onenote_lookup_index as lookup_index
+import onenote_page_picker as page_picker
+import onenote_search_index as search_index
+import onenote_sync_metrics as sync_metrics
 import onenote_types as types
-
-LAST_SYNC_DATE_FILE = "lastSyncDate.txt"
-ONENOTE_ELEMENTS_FILE = "onenoteElements.json"
-PAGE_CONTENT_FOLDER = "./page-content/"
+from onenote_settings import LAST_SYNC_DATE_FILE, ONENOTE_ELEMENTS_DATABASE, ONENOTE_ELEMENTS_FILE, \
+    PAGE_CONTENT_FOLDER, PAGE_CONTENT_PACK_FOLDER, SYNC_CHECKPOINT_FILE
+
+ELEMENT_STORE_BACKEND = element_store.SQLITE_BACKEND
+# also exports all elements into onenoteElements.json at the end of a sync that changed elements, for the readers
+# that can not read the SQLite store; off by default, as the export rewrites the whole file from all elements
+EXPORT_ONENOTE_ELEMENTS_FILE = False
+CONTENT_STORE_BACKEND = content_store.FILES_BACKEND
+# with the packed content store, also writes the pages as HTML files into PAGE_CONTENT_FOLDER, e.g. for Spotlight
+EXPORT_PAGE_CONTENT_FILES = False
+# how likely a page is picked by pick_page.py,
+# e.g. PageWeighting(recency_half_life_days=90, notebook_weights={"Work": 2}, exclude_recently_shown=10)
+PAGE_PICKER_WEIGHTING = page_picker.PageWeighting(exclude_recently_shown=10)
+CHECKPOINT_INTERVAL_IN_SECONDS = 60
+# keeps the full-text index of the pages (pageSearchIndex.sqlite) up to date for search_pages.py
+UPDATE_SEARCH_INDEX = True
+# keeps the lookup index of the titles and match strings (elementLookupIndex.sqlite) up to date for find_elements.py
+UPDATE_LOOKUP_INDEX = True
+# writes the metrics of every sync into this file, None to not write them
+SYNC_METRICS_FILE = "syncMetrics.json"
+# or sync_metrics.PROMETHEUS_FORMAT, e.g. with "syncMetrics.prom" for the textfile collector of the node exporter
+SYNC_METRICS_FORMAT = sync_metrics.JSON_FORMAT
+# profiles every sync with cProfile and writes the stats into this file, e.g. "sync.prof" for `python -m pstats`
+PROFILE_FILE = None
 
 CRAWLER_CONFIG = {
     'USER_AGENT': 'Mozilla/4.0 (compatible; MSIE 7.0; Windows NT 5.1)',
     'FEED_FORMAT': 'json',
     'CONCURRENT_REQUESTS_PER_DOMAIN': 4,
+    # the output of a callback is only a few requests and items without pipelines, the default of 100 parallel
+    # consumers costs more CPU per response than the callback itself, which slows down concurrent syncs
+    'CONCURRENT_ITEMS': 1,
     'RETRY_HTTP_CODES': [401, 429],
     # 'CLOSESPIDER_PAGECOUNT': 10,
     'DOWNLOADER_MIDDLEWARES': {
         'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,  # deactivate default middleware
         'onenote_retry_middleware.TooManyRequestsRetryMiddleware': 543,
         # activate custom middleware for retries (543 is the priority of this middleware)
-    }
+        'onenote_rate_limiter.QuotaRateLimiterMiddleware': 550,
+        # paces all requests according to the OneNote service limits
+        'auth_token_request.AccessTokenRefreshMiddleware': 560,
+        # refreshes the access token in a thread instead of on the reactor thread
+    },
+    'EXTENSIONS': {
+        'onenote_concurrency_controller.AdaptiveConcurrencyController': 500,
+        # adapts CONCURRENT_REQUESTS_PER_DOMAIN to the latency and throttling of the server
+        'onenote_sync_metrics.SyncMetricsExtension': 510,
+        # records the latencies per endpoint, the quota usage and the stats of the crawlers for SYNC_METRICS_FILE
+    },
+    'ONENOTE_AIMD_ENABLED': True,
+    'ONENOTE_METRICS_ENABLED': True,
+    # order in which the pages are downloaded, see onenote_types.PageContentPriority
+    'ONENOTE_CONTENT_PRIORITY': ['missing', 'recent'],
+    # 'ONENOTE_CONTENT_PRIORITY_NOTEBOOKS': ['Notebook name'],
+    # maximum number of requests per run including retries, the pages that are not downloaded are left for the next
+    # run; the listings are always sent, but count against the budget of the page contents
+    # 'ONENOTE_REQUEST_BUDGET': 350,
 }
 
 
-def genarateListFromDictionary(allAlfredDataDictionary: {types.OneNoteElement}):
-    allAlfredListData = []
-
-    for key in allAlfredDataDictionary:
-        allAlfredListData.append(allAlfredDataDictionary[key])
-
-    return allAlfredListData
-
-
-def genarateDictionaryFromList(allAlfredData: [types.OneNoteElement]):
-    alfredDictionaryData = {}
-
-    for element in allAlfredData:
-        alfredDictionaryData[element.uid] = element
-
-    return alfredDictionaryData
-
-
-def load_alfred_data_from_file(file_path: str):
-    allAlfredData = []
-
-    with open(file_path, "r") as file:
-        data = json.load(file)
-        for element in data:
-            allAlfredData.append(types.as_onenoteelement(element))
-
-    return allAlfredData
-
-
-def store_alfred_data_in_file(file_path: str, data: [types.OneNoteElement]):
-    with open(file_path, mode='w') as file:
-        json.dump([element.__dict__ for element in data], file)
-
-
 def load_last_sync_date_from_file(file_path: str):
-    lastSyncDate = ""
-
     with open(file_path, "r") as file:
-        lastSyncDate = file.read()
-        lastSyncDate = lastSyncDate.strip()
+        return file.read().strip()
 
-        if lastSyncDate:
-            lastSyncDate = datetime.strptime(str(lastSyncDate), '%Y-%m-%dT%H:%M:%S.%f%z')
+
+def parse_last_sync_date(lastSyncDate: str):
+    if lastSyncDate:
+        return datetime.strptime(str(lastSyncDate), '%Y-%m-%dT%H:%M:%S.%f%z')
 
     return lastSyncDate
 
 
 def store_last_sync_date_in_file(file_path: str, date: str):
-    with open(file_path, mode='w') as file:
-        file.write(date)
-
-
-def delete_pages(pagesUids):
-    for pageUid in pagesUids:
-        filePath = PAGE_CONTENT_FOLDER + pageUid + ".html"
-        if os.path.isfile(filePath):
-            os.remove(filePath)
+    checkpoints.write_file_atomically(file_path, date)
+
+
+class OneNoteSync(object):
+    """
+    The stores of the synced data and the steps of a sync. A sync runs within a running reactor and
+    can be repeated while the stores stay open, the sync daemon (sync_daemon.py) runs one after the
+    other in the same process, so that the stores, the access token, the connections and the state
+    of the rate limiter are kept between them.
+
+    All files of a sync are kept in `folder` (the current folder by default), so that the syncs of
+    several accounts (sync_accounts.py) can run next to each other. The elements modified and
+    deleted by the last sync are kept in `elementsModified` and `elementsDeleted`.
+
+    The metrics of a sync (onenote_sync_metrics.py) are registered with the rate limiter key of its
+    crawlers, so that the spiders and the metrics extension of the crawlers add to them as well.
+    """
+
+    def __init__(self, crawler_config: dict = None, folder: str = ""):
+        # Scrapy, Twisted and the spiders (which import MSAL) are only imported by a sync, so that the
+        # tools reading the synced data can import the settings of this module without loading them
+        from scrapy.crawler import CrawlerRunner
+
+        crawler_config = crawler_config if crawler_config is not None else CRAWLER_CONFIG
+        self.folder = folder
+        self.metricsKey = sync_metrics.metrics_key(crawler_config)
+        self.metrics = sync_metrics.SyncMetrics()
+        sync_metrics.register_sync_metrics(self.metricsKey, self.metrics)
+
+        with self.metrics.phase("elements_load"):
+            self.elementStore = element_store.open_element_store(ELEMENT_STORE_BACKEND,
+                                                                 self.file_path(ONENOTE_ELEMENTS_DATABASE),
+                                                                 self.file_path(ONENOTE_ELEMENTS_FILE))
+            self.alfredDataDictionary = self.elementStore.load()
+        self.elementLookupIndex = lookup_index.ElementLookupIndex(self.file_path(lookup_index.LOOKUP_INDEX_DATABASE)) \
+            if UPDATE_LOOKUP_INDEX else None
+        self.contentStoreFolder = self.file_path(PAGE_CONTENT_FOLDER) \
+            if CONTENT_STORE_BACKEND == content_store.FILES_BACKEND else self.file_path(PAGE_CONTENT_PACK_FOLDER)
+        with self.metrics.phase("content_load"):
+            self.contentStore = content_store.open_content_store(CONTENT_STORE_BACKEND, self.contentStoreFolder)
+            # the versions are kept next to the element store instead of in the folder of the page files, which
+            # Spotlight indexes; the ones kept in that folder by a former version are moved
+            self.pageContentVersionsFile = self.file_path(content_versions.CONTENT_VERSIONS_FILE)
+            content_versions.move_versions_file(os.path.join(self.contentStoreFolder,
+                                                             content_versions.CONTENT_VERSIONS_FILE),
+                                                self.pageContentVersionsFile)
+            self.pageContentVersions = content_versions.PageContentVersions.load_from_file(
+                self.pageContentVersionsFile)
+        self.scrapyRunner = CrawlerRunner(crawler_config)
+        self.checkpoint = None
+        self.elementsAdded = set()
+        self.elementsModified = set()
+        self.elementsDeleted = set()
+
+    def file_path(self, file_name: str):
+        return os.path.join(self.folder, file_name)
+
+    def start(self):
+        """
+        Resumes the unfinished sync of the checkpoint file or starts a new one.
+        """
+        self.checkpoint = checkpoints.SyncCheckpoint.load_from_file(self.file_path(SYNC_CHECKPOINT_FILE))
+
+        if self.checkpoint is None:
+            self.checkpoint = checkpoints.SyncCheckpoint(
+                load_last_sync_date_from_file(self.file_path(LAST_SYNC_DATE_FILE)),
+                datetime.now().astimezone().strftime('%Y-%m-%dT%H:%M:%S.%f%z'))
+        else:
+            print("Resuming the unfinished sync started at {}.".format(self.checkpoint.thisSyncDate))
+
+        self.checkpoint.alfredDataDictionary = self.alfredDataDictionary
+        self.elementsAdded = set()
+        self.elementsModified = set()
+        self.elementsDeleted = set()
+        self.metrics.start()
+
+        # without a checkpoint file, elements saved by an interrupted sync would not be synced again
+        self.store_checkpoint()
+
+    def save_elements(self):
+        self.elementsAdded.difference_update(self.alfredDataDictionary.deletedUids)
+        self.elementsAdded.update(self.alfredDataDictionary.addedUids)
+        self.elementsModified.difference_update(self.alfredDataDictionary.deletedUids)
+        self.elementsModified.update(self.alfredDataDictionary.modifiedUids)
+        self.elementsDeleted.difference_update(self.alfredDataDictionary.modifiedUids)
+        self.elementsDeleted.update(self.alfredDataDictionary.deletedUids)
+
+        # the lookup index is updated first, as saving the elements clears the changes it is updated with
+        if self.elementLookupIndex is not None:
+            with self.metrics.phase("lookup_index_update"):
+                lookup_index.update_lookup_index(self.elementLookupIndex, self.alfredDataDictionary)
+        with self.metrics.phase("elements_save"):
+            self.elementStore.save(self.alfredDataDictionary)
+
+    def store_checkpoint(self):
+        # the elements and the page contents are saved first, a checkpoint that is older than the
+        # stores only causes some work to be repeated, while a newer one could skip modified pages
+        self.save_elements()
+        with self.metrics.phase("content_save"):
+            self.contentStore.flush()
+            self.pageContentVersions.store_in_file(self.pageContentVersionsFile)
+        self.checkpoint.store_in_file(self.file_path(SYNC_CHECKPOINT_FILE))
+
+    def store_metrics(self, pagesDeferred: int = None):
+        """
+        Writes the metrics of the sync into SYNC_METRICS_FILE and starts the metrics of the next one.
+        """
+        metrics = self.metrics
+        metrics.set_value("finished", int(self.checkpoint is None))
+        metrics.set_value("elements_added", len(self.elementsAdded))
+        metrics.set_value("elements_modified", len(self.elementsModified - self.elementsAdded))
+        metrics.set_value("elements_deleted", len(self.elementsDeleted))
+        if pagesDeferred is not None:
+            metrics.set_value("pages_deferred", pagesDeferred)
+
+        if SYNC_METRICS_FILE is not None:
+            metrics.store_in_file(self.file_path(SYNC_METRICS_FILE), SYNC_METRICS_FORMAT)
+
+        self.metrics = sync_metrics.SyncMetrics()
+        sync_metrics.register_sync_metrics(self.metricsKey, self.metrics)
+
+    def crawl(self):
+        """
+        Runs the spiders of the phases the checkpoint has not finished yet, returns a Deferred that
+        fires with the number of pages that are left for the next sync because of the request budget.
+        """
+        from twisted.internet import defer
+
+        import onenote_page_content_scraper as page_content_scraper
+        import onenote_sync_scraper as sync_scraper
+
+        checkpoint = self.checkpoint
+
+        @defer.inlineCallbacks
+        def crawl_phases():
+            requestsUsed = 0
+
+            if checkpoint.phase == checkpoints.SYNC_PHASE:
+                syncCrawler = self.scrapyRunner.create_crawler(sync_scraper.OneNoteSyncSpider)
+                with self.metrics.phase("sync_crawl"):
+                    yield self.scrapyRunner.crawl(syncCrawler, self.alfredDataDictionary,
+                                                  parse_last_sync_date(checkpoint.lastSyncDate),
+                                                  checkpoint.pagesModified, checkpoint.pagesDeleted)
+                requestsUsed = syncCrawler.stats.get_value('onenote_rate_limiter/requests', 0)
+                checkpoint.phase = checkpoints.CONTENT_PHASE
+                self.store_checkpoint()
+
+            pageContentCrawler = self.scrapyRunner.create_crawler(page_content_scraper.OneNotePageContentSpider)
+            with self.metrics.phase("content_crawl"):
+                yield self.scrapyRunner.crawl(pageContentCrawler, checkpoint.pending_pages_uids(), self.contentStore,
+                                              self.alfredDataDictionary, checkpoint.pagesDownloaded,
+                                              self.pageContentVersions, requestsUsed)
+            return pageContentCrawler.stats.get_value('onenote_content/pages_deferred', 0)
+
+        return crawl_phases()
+
+    def run(self):
+        """
+        Runs a whole sync, returns a Deferred that fires with the number of pages that are left for
+        the next sync because of the request budget. Those stay in the checkpoint, otherwise the
+        sync is finished. The metrics of the sync are written in any case.
+        """
+        from twisted.internet import defer, task
+
+        @defer.inlineCallbacks
+        def run_sync():
+            self.start()
+            profiler = sync_metrics.start_profiler() if PROFILE_FILE is not None else None
+            pagesDeferred = None
+
+            # the checkpoint is written periodically so that a crashed or interrupted sync can be resumed
+            checkpointLoop = task.LoopingCall(self.store_checkpoint)
+            checkpointLoop.start(CHECKPOINT_INTERVAL_IN_SECONDS, now=False)
+            try:
+                try:
+                    pagesDeferred = yield self.crawl()
+                finally:
+                    checkpointLoop.stop()
+
+                if pagesDeferred:
+                    # the sync is only finished once the remaining pages have been downloaded by the next run
+                    self.store_checkpoint()
+                else:
+                    with self.metrics.phase("finish"):
+                        yield self.finish()
+            finally:
+                if profiler is not None:
+                    sync_metrics.stop_profiler(profiler, self.file_path(PROFILE_FILE))
+                self.store_metrics(pagesDeferred)
+
+            return pagesDeferred
+
+        return run_sync()
+
+    def finish(self):
+        """
+        Saves the stores and updates the exports and the indexes of the finished sync, returns a
+        Deferred that fires once it is done. The export of the elements, the update of the search
+        index and of the sampling index and the export of the page files read all elements or pages
+        and therefore run in a thread, so that they do not block the other syncs of the reactor.
+        """
+        from twisted.internet import defer, threads
+
+        checkpoint = self.checkpoint
+
+        @defer.inlineCallbacks
+        def finish_sync():
+            self.save_elements()
+            # the JSON file is only rewritten if the elements changed, which a small incremental sync often does not
+            elementsFile = self.file_path(ONENOTE_ELEMENTS_FILE)
+            if EXPORT_ONENOTE_ELEMENTS_FILE and ELEMENT_STORE_BACKEND != element_store.JSON_BACKEND \
+                    and (self.elementsModified or self.elementsDeleted or not os.path.isfile(elementsFile)):
+                with self.metrics.phase("elements_export"):
+                    yield threads.deferToThread(element_store.export_elements_to_json, elementsFile,
+                                                list(self.alfredDataDictionary.values()))
+
+            self.contentStore.delete(checkpoint.pagesDeleted)
+            self.pageContentVersions.delete(checkpoint.pagesDeleted)
+            if UPDATE_SEARCH_INDEX:
+                with self.metrics.phase("search_index_update"):
+                    yield threads.deferToThread(self.update_search_index, checkpoint)
+
+            if EXPORT_PAGE_CONTENT_FILES and CONTENT_STORE_BACKEND != content_store.FILES_BACKEND:
+                yield threads.deferToThread(self.export_page_content_files, checkpoint)
+            with self.metrics.phase("content_save"):
+                self.contentStore.flush()
+                self.pageContentVersions.store_in_file(self.pageContentVersionsFile)
+
+            with self.metrics.phase("sampling_index_update"):
+                yield threads.deferToThread(page_picker.update_sampling_index,
+                                            self.file_path(page_picker.PAGE_SAMPLING_INDEX_FILE),
+                                            self.alfredDataDictionary, PAGE_PICKER_WEIGHTING,
+                                            checkpoint.pagesModified, checkpoint.pagesDeleted)
+
+            store_last_sync_date_in_file(self.file_path(LAST_SYNC_DATE_FILE), checkpoint.thisSyncDate)
+            checkpoints.delete_checkpoint_file(self.file_path(SYNC_CHECKPOINT_FILE))
+            self.checkpoint = None
+
+        return finish_sync()
+
+    def update_search_index(self, checkpoint: checkpoints.SyncCheckpoint):
+        """
+        Runs in a thread, therefore it opens its own connection to the search index.
+        """
+        pageSearchIndex = search_index.PageSearchIndex(self.file_path(search_index.SEARCH_INDEX_DATABASE))
+        try:
+            # renaming or moving a notebook or section changes the path of the pages below it, which are
+            # modified elements of the sync but not modified pages of the Graph API
+            pagesModified = checkpoint.pagesModified | (
+                self.elementsModified & self.alfredDataDictionary.uids_of_type(types.OneNoteType.PAGE))
+            search_index.update_search_index(pageSearchIndex, self.contentStore, self.alfredDataDictionary,
+                                             self.pageContentVersions, pagesModified, checkpoint.pagesDeleted)
+        finally:
+            pageSearchIndex.close()
+
+    def export_page_content_files(self, checkpoint: checkpoints.SyncCheckpoint):
+        # all pages are exported if the folder does not exist yet, otherwise only the ones downloaded by this sync
+        pageContentFolder = self.file_path(PAGE_CONTENT_FOLDER)
+        exportedPagesUids = set(checkpoint.pagesDownloaded.keys()) if os.path.isdir(pageContentFolder) else None
+        self.contentStore.export_to_files(pageContentFolder, exportedPagesUids)
+        content_store.FileContentStore(pageContentFolder).delete(checkpoint.pagesDeleted)
+
+    def close(self):
+        """
+        Stores the checkpoint and the metrics of an unfinished sync and closes the stores.
+        """
+        if self.checkpoint is not None:
+            self.store_checkpoint()
+
+        # the metrics of an interrupted sync have not been written by `run`
+        if self.metrics.startTime is not None:
+            self.store_metrics()
+
+        self.elementStore.close()
+        if self.elementLookupIndex is not None:
+            self.elementLookupIndex.close()
+        self.contentStore.close()
+
+
+def report_result(results: list):
+    """
+    Prints how a sync ended, `results` holds the result of its Deferred unless it has been interrupted.
+    """
+    from twisted.python.failure import Failure
+
+    if results and isinstance(results[0], Failure):
+        results[0].printTraceback()
+
+    if not results or isinstance(results[0], Failure):
+        print("Sync interrupted. Rerun to resume it.")
+    elif results[0]:
+        print("Request budget used up, {} pages are left. Rerun to download them.".format(results[0]))
+    else:
+        print("Done")
 
 
 def main():
-    all_alfred_data = load_alfred_data_from_file(ONENOTE_ELEMENTS_FILE)
-    alfred_data_dictionary: {str, types.OneNoteElement} = genarateDictionaryFromList(all_alfred_data)
-
-    pages_deleted = set()
-    pages_modified = set()
-
-    lastSyncDate = load_last_sync_date_from_file(LAST_SYNC_DATE_FILE)
-    thisSyncDate = datetime.now().astimezone().strftime('%Y-%m-%dT%H:%M:%S.%f%z')
+    from scrapy.utils.log import configure_logging
+    from twisted.internet import reactor
 
     configure_logging()
-    scrapyRunner = CrawlerRunner(CRAWLER_CONFIG)
-
-    @defer.inlineCallbacks
-    def crawl():
-        yield scrapyRunner.crawl(sync_scraper.OneNoteSyncSpider, alfred_data_dictionary,
-                                 lastSyncDate, pages_modified, pages_deleted)
-        yield scrapyRunner.crawl(page_content_scraper.OneNotePageContentSpider, pages_modified, PAGE_CONTENT_FOLDER,
-                                 alfred_data_dictionary)
-        reactor.stop()
+    oneNoteSync = OneNoteSync()
+    results = []
 
-    crawl()
-    reactor.run()  # the script will block here until the crawling is finished
-
-    allAlfredDataList = genarateListFromDictionary(alfred_data_dictionary)
-    store_alfred_data_in_file(ONENOTE_ELEMENTS_FILE, allAlfredDataList)
-    store_last_sync_date_in_file(LAST_SYNC_DATE_FILE, thisSyncDate)
-
-    delete_pages(pages_deleted)
+    def stop(result):
+        results.append(result)
+        reactor.stop()
 
-    print("Done")
+    oneNoteSync.run().addBoth(stop)
+    reactor.run()  # the script will block here until the crawling is finished or interrupted
+    oneNoteSync.close()
+    report_result(results)
 
 
-main()
+if __name__ == "__main__":
+    main()
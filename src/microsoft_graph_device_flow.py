@@ -1,52 +1,224 @@
 import json
 import logging
 import os
-
-import msal
 import sys  # For simplicity, we'll read config file from 1st CLI param sys.argv[1]
+import time
+
+TOKEN_CACHE_FILE = "token_cache.bin"
+# MSAL considers access tokens as expired 5 minutes before they actually expire
+ACCESS_TOKEN_REFRESH_MARGIN_IN_SECONDS = 5 * 60
+
+
+class AccessTokenHolder(object):
+    """
+    Keeps the current access token in memory together with its expiry so that MSAL only
+    gets asked for a token when the current one is about to expire or has been rejected.
+
+    During a crawl the token is refreshed in a thread with `refresh_in_thread`, as MSAL blocks
+    while it refreshes the token and the device flow even until the user signed in, which would
+    stall the crawls of all accounts on the reactor thread. While `refreshesInThread` is set, `get`
+    only returns the current token and leaves refreshing it to the thread.
+    """
+
+    def __init__(self, retrieve_access_token_result):
+        self.accessToken = None
+        self.expiresAt = 0
+        self.forceRefresh = False
+        self.retrieveAccessTokenResult = retrieve_access_token_result
+        self.refreshesInThread = False
+        # the Deferreds waiting for the refresh that is running in a thread, None if none is running
+        self.refreshWaiters = None
+
+    def get(self):
+        if not self.refreshesInThread and self.needs_refresh():
+            self.refresh()
+
+        return self.accessToken
+
+    def needs_refresh(self):
+        return self.accessToken is None or time.time() >= self.expiresAt - ACCESS_TOKEN_REFRESH_MARGIN_IN_SECONDS
+
+    def refresh_in_thread(self):
+        """
+        Returns a Deferred that fires once the token has been refreshed in a thread of the reactor.
+        The callers that ask while a refresh is running wait for the same refresh.
+        """
+        from twisted.internet import defer, threads
+
+        waiter = defer.Deferred()
+
+        if self.refreshWaiters is None:
+            self.refreshWaiters = []
+            threads.deferToThread(self.refresh).addBoth(self.refreshed)
+        self.refreshWaiters.append(waiter)
+
+        return waiter
+
+    def refreshed(self, result):
+        from twisted.python.failure import Failure
+
+        waiters, self.refreshWaiters = self.refreshWaiters, None
+        for waiter in waiters:
+            if isinstance(result, Failure):
+                waiter.errback(result)
+            else:
+                waiter.callback(self.accessToken)
+
+    def refresh(self):
+        result = self.retrieveAccessTokenResult(self.forceRefresh)
+        self.forceRefresh = False
+
+        if result is None:
+            self.accessToken = None
+            self.expiresAt = 0
+            return
+
+        self.accessToken = result["access_token"]
+        self.expiresAt = time.time() + int(result.get("expires_in", 0))
+
+    def invalidate(self, accessToken):
+        """
+        Marks the passed in token as rejected (e.g. because of a `401 - Unauthorized`). Only the
+        first call for the current token forces a refresh, all the other requests that were
+        sent with the same token share the new one.
+        """
+        if accessToken is not None and accessToken == self.accessToken:
+            self.accessToken = None
+            self.forceRefresh = True
+
+
+class AccountAuthentication(object):
+    """
+    The config, the token cache, the MSAL app and the access token of one Microsoft account. The
+    config, the token cache and the MSAL app are only loaded once the first token is needed, so
+    that creating an account neither requires the config file nor imports MSAL.
+
+    Several accounts can be signed in at the same time, each with its own token cache file. The
+    token cache holds the signed in user of an account, or the one with the configured username.
+    """
+
+    def __init__(self, config_file_path: str = None, token_cache_file: str = TOKEN_CACHE_FILE, username: str = None):
+        self.configFilePath = config_file_path
+        self.tokenCacheFile = token_cache_file
+        self.username = username
+        self.config = None
+        self.tokenCache = None
+        self.app = None
+        self.accessTokenHolder = AccessTokenHolder(self.retrieveAccessTokenResult)
+
+    def initializeApp(self, configFilePath=None):
+        """
+        Loads the config (from the passed in file, the file of the account or the 1st CLI param)
+        and the token cache and builds the MSAL app.
+        """
+        import msal
+
+        logging.getLogger("msal").setLevel(logging.INFO)
+        with open(configFilePath or self.configFilePath or sys.argv[1]) as configFile:
+            self.config = json.load(configFile)
+
+        # SerializableTokenCache: https://msal-python.rtfd.io/en/latest/#msal.SerializableTokenCache
+        self.tokenCache = msal.SerializableTokenCache()
+        if os.path.exists(self.tokenCacheFile):
+            with open(self.tokenCacheFile, "r") as tokenCacheFile:
+                self.tokenCache.deserialize(tokenCacheFile.read())
 
-logging.getLogger("msal").setLevel(logging.INFO)
-config = json.load(open(sys.argv[1]))
+        self.app = msal.PublicClientApplication(
+            self.config["client_id"], authority=self.config["authority"],
+            token_cache=self.tokenCache
+        )
 
-# SerializableTokenCache: https://msal-python.rtfd.io/en/latest/#msal.SerializableTokenCache
-tokenCache = msal.SerializableTokenCache()
-if os.path.exists("token_cache.bin"):
-    tokenCache.deserialize(open("token_cache.bin", "r").read())
+        return self.app
+
+    def getApp(self):
+        return self.app if self.app is not None else self.initializeApp()
+
+    def retrieveAccessToken(self):
+        return self.accessTokenHolder.get()
+
+    def retrieveAccessTokenResult(self, forceRefresh=False):
+        result = None
+        app = self.getApp()
+        accounts = app.get_accounts(username=self.username)
+        if accounts:
+            account = accounts[0]
+            result = app.acquire_token_silent(self.config["scope"], account=account, force_refresh=forceRefresh)
+
+        if not result:
+            logging.info("No suitable token exists in cache. Let's get a new one from AAD.")
+
+            flow = app.initiate_device_flow(scopes=self.config["scope"])
+            if "user_code" not in flow:
+                raise ValueError(
+                    "Fail to create device flow. Err: %s" % json.dumps(flow, indent=4))
+
+            print(flow["message"])
+            sys.stdout.flush()  # Some terminal needs this to ensure the message is shown
+
+            result = app.acquire_token_by_device_flow(flow)  # By default it will block
+            # You can follow this instruction to shorten the block time
+            #    https://msal-python.readthedocs.io/en/latest/#msal.PublicClientApplication.acquire_token_by_device_flow
+            # or you may even turn off the blocking behavior,
+            # and then keep calling acquire_token_by_device_flow(flow) in your own customized loop.
+
+        if "access_token" in result:
+            self.storeTokenCache()
+            return result
+        else:
+            print(result.get("error"))
+            print(result.get("error_description"))
+            print(result.get("correlation_id"))  # You may need this when reporting a bug
+            return None
+
+    def storeTokenCache(self):
+        """
+        Persists the token cache, but only if MSAL actually changed it.
+        """
+        if self.tokenCache is not None and self.tokenCache.has_state_changed:
+            open(self.tokenCacheFile, "w").write(self.tokenCache.serialize())
+            self.tokenCache.has_state_changed = False
+
+
+# the account of a single-account sync, whose config file is the 1st CLI param
+defaultAccount = AccountAuthentication()
+accessTokenHolder = defaultAccount.accessTokenHolder
+
+# the accounts of a multi-account sync by their names
+_accounts: {str, AccountAuthentication} = {}
+
+
+def register_account(name: str, account: AccountAuthentication):
+    _accounts[name] = account
+
+
+def get_account(name: str = None):
+    """
+    Returns the account registered with the name, or the default account if no name is passed in.
+    """
+    if name is None:
+        return defaultAccount
+
+    if name not in _accounts:
+        raise ValueError("Unknown account: " + name)
+
+    return _accounts[name]
+
+
+def initializeApp(configFilePath=None):
+    return defaultAccount.initializeApp(configFilePath)
+
+
+def getApp():
+    return defaultAccount.getApp()
 
-app = msal.PublicClientApplication(
-    config["client_id"], authority=config["authority"],
-    token_cache=tokenCache
-)
 
 def retrieveAccessToken():
-    result = None
-    accounts = app.get_accounts()
-    if accounts:
-        account = accounts[0]
-        result = app.acquire_token_silent(config["scope"], account=account)
-
-    if not result:
-        logging.info("No suitable token exists in cache. Let's get a new one from AAD.")
-
-        flow = app.initiate_device_flow(scopes=config["scope"])
-        if "user_code" not in flow:
-            raise ValueError(
-                "Fail to create device flow. Err: %s" % json.dumps(flow, indent=4))
-
-        print(flow["message"])
-        sys.stdout.flush()  # Some terminal needs this to ensure the message is shown
-
-        result = app.acquire_token_by_device_flow(flow)  # By default it will block
-        # You can follow this instruction to shorten the block time
-        #    https://msal-python.readthedocs.io/en/latest/#msal.PublicClientApplication.acquire_token_by_device_flow
-        # or you may even turn off the blocking behavior,
-        # and then keep calling acquire_token_by_device_flow(flow) in your own customized loop.
-
-    if "access_token" in result:
-        open("token_cache.bin", "w").write(tokenCache.serialize())
-        return result['access_token']
-    else:
-        print(result.get("error"))
-        print(result.get("error_description"))
-        print(result.get("correlation_id"))  # You may need this when reporting a bug
-        return None
+    return defaultAccount.retrieveAccessToken()
+
+
+def retrieveAccessTokenResult(forceRefresh=False):
+    return defaultAccount.retrieveAccessTokenResult(forceRefresh)
+
+
+def storeTokenCache():
+    defaultAccount.storeTokenCache()
@@ -0,0 +1,199 @@
+import base64
+import binascii
+import inspect
+import json
+from itertools import islice
+from urllib.parse import urlparse
+
+import scrapy
+from scrapy import signals
+from scrapy.downloadermiddlewares.retry import get_retry_request
+from scrapy.http.headers import Headers
+from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.defer import maybe_deferred_to_future
+from scrapy.utils.log import failure_to_exc_info
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+import auth_token_request as req
+import microsoft_graph_device_flow as auth
+import onenote_graph_api as graph_api
+import onenote_json
+import onenote_rate_limiter as rate_limiter
+import onenote_sync_metrics as sync_metrics
+import onenote_types as types
+
+# the Graph API accepts up to 20 sub-requests per batch request
+MAX_BATCH_SIZE = 20
+# waiting time in case a throttled sub-request does not tell how long to wait
+DEFAULT_RETRY_AFTER_IN_SECONDS = 60
+# the headers of the original requests that are passed on with their sub-requests
+FORWARDED_HEADERS = ('If-None-Match',)
+
+
+class GraphBatchSpider(scrapy.Spider):
+    """
+    Base class of the spiders that can group their requests into Graph JSON batch requests
+    (https://docs.microsoft.com/en-us/graph/json-batching). Batching is activated with the setting
+    `ONENOTE_BATCH_REQUESTS`. The response of every sub-request is passed to the callback of the
+    original request, sub-requests that failed with a 429 or a 401 are retried on their own and the
+    ones that failed otherwise are passed to the errback of the original request, if it has one.
+
+    The spiders send their requests to `ONENOTE_GRAPH_BASE_URL` (the Graph API by default), which
+    can be set to a local stand-in such as `benchmarks/mock_graph_server.py`, with the access token
+    of the account registered as `ONENOTE_ACCOUNT` (the account of the config file by default).
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(GraphBatchSpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.baseUrl = crawler.settings.get('ONENOTE_GRAPH_BASE_URL', graph_api.GRAPH_BASE_URL)
+        # the links to the next pages of the listings point to the same host
+        spider.allowed_domains = [urlparse(spider.baseUrl).hostname]
+        spider.accessTokenHolder = auth.get_account(crawler.settings.get('ONENOTE_ACCOUNT')).accessTokenHolder
+
+        return spider
+
+    def auth_token_request(self, **kwargs):
+        """
+        Creates a request that is sent with the access token of the account of the spider.
+        """
+        return req.AuthTokenRequest(access_token_holder=self.accessTokenHolder, **kwargs)
+
+    def batch_requests(self, requests):
+        """
+        Groups the passed in requests into batch requests if batching is activated.
+        """
+        if not self.settings.getbool('ONENOTE_BATCH_REQUESTS'):
+            yield from requests
+            return
+
+        requests = iter(requests)
+        while True:
+            batchedRequests = list(islice(requests, MAX_BATCH_SIZE))
+
+            if len(batchedRequests) > 1:
+                yield self.build_batch_request(batchedRequests)
+            else:
+                yield from batchedRequests
+
+            if len(batchedRequests) < MAX_BATCH_SIZE:
+                return
+
+    def build_batch_request(self, requests: [scrapy.Request]):
+        body = {"requests": [self.build_sub_request(index, request) for index, request in enumerate(requests)]}
+
+        return self.auth_token_request(meta={types.BATCHED_REQUESTS_KEY: requests,
+                                             types.REQUEST_COST_KEY: len(requests)},
+                                       url=graph_api.batch_url(self.baseUrl), method="POST", body=json.dumps(body),
+                                       headers={'Content-Type': 'application/json'},
+                                       priority=max(request.priority for request in requests),
+                                       callback=self.parse_batch_response, dont_filter=True)
+
+    def build_sub_request(self, index, request: scrapy.Request):
+        subRequest = {"id": str(index), "method": request.method,
+                      "url": graph_api.relative_url(request.url, self.baseUrl)}
+
+        headers = {header: request.headers.get(header).decode("latin-1") for header in FORWARDED_HEADERS
+                   if request.headers.get(header) is not None}
+        if headers:
+            subRequest["headers"] = headers
+
+        return subRequest
+
+    async def parse_batch_response(self, response):
+        """
+        Unpacks the responses of the sub-requests of a batch request and passes each one to
+        the callback of its request. Coroutine callbacks run concurrently and the batch response
+        is only done once all of them are done. A failing callback is logged and does not keep
+        the other sub-responses from being processed.
+        """
+        requests = response.meta[types.BATCHED_REQUESTS_KEY]
+        pendingCallbacks = []
+
+        for subResponse in onenote_json.loads(response.body)["responses"]:
+            request = requests[int(subResponse["id"])]
+            status = int(subResponse["status"])
+            headers = Headers(subResponse.get("headers") or {})
+            requestResponse = self.build_sub_response(request, status, headers, subResponse.get("body"))
+            self.crawler.stats.inc_value('onenote_batch/response_status_count/{}'.format(status))
+            # the sub-responses are recorded per endpoint of their request, their bytes are the ones of the batch
+            self.crawler.signals.send_catch_log(signal=sync_metrics.response_observed, response=requestResponse,
+                                                request=request, latency=response.meta.get('download_latency'),
+                                                downloaded=False, spider=self)
+
+            if status in (401, 429):
+                for retryRequest in self.retry_batched_request(response, request, status, headers):
+                    yield retryRequest
+            elif 200 <= status < 300 or status in request.meta.get('handle_httpstatus_list', ()):
+                try:
+                    result = request.callback(requestResponse)
+                    if inspect.iscoroutine(result):
+                        pendingCallbacks.append(defer.ensureDeferred(result).addErrback(self.sub_response_failed,
+                                                                                        requestResponse))
+                    elif result is not None:
+                        for item in result:
+                            yield item
+                except Exception:
+                    self.sub_response_failed(Failure(), requestResponse)
+            elif request.errback is not None:
+                # like the HttpError of a response that is not batched
+                for item in request.errback(Failure(HttpError(requestResponse, "Ignoring non-200 response"))) or ():
+                    yield item
+            else:
+                self.logger.warning("Ignoring batched response (%s) for %s", status, request.url)
+
+        if pendingCallbacks:
+            results = await maybe_deferred_to_future(defer.gatherResults(pendingCallbacks, consumeErrors=True))
+            for result in results:
+                for item in result or ():
+                    yield item
+
+    def sub_response_failed(self, failure, response):
+        """
+        Reports the failure of the callback of a sub-response like Scrapy reports the failure of a callback.
+        """
+        self.logger.error("Spider error processing %(request)s (batched response)", {"request": response.request},
+                          exc_info=failure_to_exc_info(failure))
+        self.crawler.signals.send_catch_log(signal=signals.spider_error, failure=failure, response=response,
+                                            spider=self)
+        self.crawler.stats.inc_value("spider_exceptions/{}".format(failure.value.__class__.__name__))
+
+    def retry_batched_request(self, batchResponse, request, status, headers):
+        """
+        Retries a single sub-request of a batch request on its own.
+        """
+        if status == 429:  # Too many requests
+            retryAfter = rate_limiter.parse_retry_after(headers)
+            retryAfter = DEFAULT_RETRY_AFTER_IN_SECONDS if retryAfter is None else retryAfter
+
+            throttledSeconds = rate_limiter.rate_limiter_of_crawler(self.settings).block_for(retryAfter)
+            self.crawler.stats.inc_value('onenote_rate_limiter/throttled_seconds', throttledSeconds)
+            self.crawler.signals.send_catch_log(signal=rate_limiter.response_throttled, response=batchResponse,
+                                                request=batchResponse.request, spider=self)
+
+        if status == 401 and isinstance(batchResponse.request, req.AuthTokenRequest):  # Unauthorized
+            batchResponse.request.invalidate_authorization_token()
+
+        retryRequest = get_retry_request(request, spider=self, reason="batched response {}".format(status))
+        if retryRequest is not None:
+            yield retryRequest
+
+    def build_sub_response(self, request, status, headers, body):
+        """
+        Builds a Scrapy response from a sub-response. JSON bodies are embedded as JSON into
+        the batch response, all other bodies are base64 encoded.
+        """
+        if body is None:
+            body = b""
+        elif isinstance(body, str) and b"json" not in headers.get("Content-Type", b""):
+            try:
+                body = base64.b64decode(body, validate=True)
+            except binascii.Error:
+                body = body.encode("utf-8")
+        else:
+            body = json.dumps(body).encode("utf-8")
+
+        responseClass = responsetypes.from_args(headers=headers, url=request.url, body=body)
+        return responseClass(url=request.url, status=status, headers=headers, body=body, request=request)
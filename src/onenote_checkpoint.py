@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+
+import onenote_types as types
+
+# the phases of a sync, a resumed sync continues with the phase stored in the checkpoint
+SYNC_PHASE = "sync"
+CONTENT_PHASE = "content"
+
+
+def write_file_atomically(file_path: str, data):
+    """
+    Writes the data (str or bytes) into a temporary file next to the target file and replaces
+    the target file with it, so that the target file either has its old or its new content but
+    is never written partially.
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fileDescriptor, temporaryFilePath = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+
+    try:
+        with os.fdopen(fileDescriptor, mode='wb' if isinstance(data, bytes) else 'w') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temporaryFilePath, file_path)
+    except BaseException:
+        if os.path.exists(temporaryFilePath):
+            os.remove(temporaryFilePath)
+        raise
+
+
+class SyncCheckpoint(object):
+    """
+    The state of a sync that has not finished yet: the modified and deleted pages found so far
+    and the pages whose content has already been downloaded (page uid -> lastModifiedDateTime
+    of the downloaded version). The elements themselves are not part of the checkpoint, they
+    are saved into the element store whenever the checkpoint is stored.
+    """
+
+    def __init__(self, last_sync_date: str, this_sync_date: str, phase: str = SYNC_PHASE):
+        self.lastSyncDate = last_sync_date
+        self.thisSyncDate = this_sync_date
+        self.phase = phase
+        self.alfredDataDictionary: {str, types.OneNoteElement} = {}
+        self.pagesModified: {str} = set()
+        self.pagesDeleted: {str} = set()
+        self.pagesDownloaded: {str, str} = {}
+
+    def pending_pages_uids(self):
+        """
+        Returns the uids of the modified pages whose current version has not been downloaded yet.
+        """
+        pendingPagesUids = set()
+
+        for pageUid in self.pagesModified:
+            element = self.alfredDataDictionary.get(pageUid)
+            if element is None:
+                continue
+
+            if self.pagesDownloaded.get(pageUid) != element.lastModifiedDateTime:
+                pendingPagesUids.add(pageUid)
+
+        return pendingPagesUids
+
+    def store_in_file(self, file_path: str):
+        write_file_atomically(file_path, json.dumps({
+            "lastSyncDate": self.lastSyncDate,
+            "thisSyncDate": self.thisSyncDate,
+            "phase": self.phase,
+            "pagesModified": list(self.pagesModified),
+            "pagesDeleted": list(self.pagesDeleted),
+            "pagesDownloaded": self.pagesDownloaded,
+        }))
+
+    @classmethod
+    def load_from_file(cls, file_path: str):
+        """
+        Returns the checkpoint stored in the file or None if there is no unfinished sync.
+        """
+        if not os.path.isfile(file_path):
+            return None
+
+        with open(file_path, "r") as file:
+            data = json.load(file)
+
+        checkpoint = cls(data["lastSyncDate"], data["thisSyncDate"], data["phase"])
+        checkpoint.pagesModified = set(data["pagesModified"])
+        checkpoint.pagesDeleted = set(data["pagesDeleted"])
+        checkpoint.pagesDownloaded = data["pagesDownloaded"]
+
+        return checkpoint
+
+
+def delete_checkpoint_file(file_path: str):
+    if os.path.isfile(file_path):
+        os.remove(file_path)
@@ -0,0 +1,123 @@
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+import onenote_rate_limiter as rate_limiter
+
+# the state of the controllers of the finished crawlers: (rate limiter key, spider name) -> (concurrency, lowest latency)
+_previous_states: {(str, str), (float, float)} = {}
+
+
+class AdaptiveConcurrencyController(object):
+    """
+    Scrapy extension that adapts the number of concurrent requests per download slot with the
+    AIMD (additive increase, multiplicative decrease) scheme: the concurrency grows by
+    `ONENOTE_AIMD_INCREASE` for every window of fast responses without throttling and is cut
+    by `ONENOTE_AIMD_DECREASE_FACTOR` as soon as a `429 - Too many requests` is returned (also for
+    a request that is retried or a sub-request of a batch request) or the smoothed latency rises
+    above `ONENOTE_AIMD_LATENCY_TOLERANCE` times the lowest smoothed latency seen so far.
+    Latencies below `ONENOTE_AIMD_LATENCY_FLOOR` seconds are never considered as rising.
+
+    The concurrency stays between `ONENOTE_AIMD_MIN_CONCURRENCY` and `ONENOTE_AIMD_MAX_CONCURRENCY`
+    and starts at `CONCURRENT_REQUESTS_PER_DOMAIN`, or where the previous crawler of the process
+    with the same `ONENOTE_RATE_LIMITER_KEY` and the same spider stopped, e.g. in the sync daemon.
+    The state is not shared between spiders, as their responses differ in size and latency. The
+    current value is exposed in the stats.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.minConcurrency = settings.getint('ONENOTE_AIMD_MIN_CONCURRENCY', 1)
+        self.maxConcurrency = settings.getint('ONENOTE_AIMD_MAX_CONCURRENCY', 8)
+        self.increase = settings.getfloat('ONENOTE_AIMD_INCREASE', 1.0)
+        self.decreaseFactor = settings.getfloat('ONENOTE_AIMD_DECREASE_FACTOR', 0.5)
+        self.latencyTolerance = settings.getfloat('ONENOTE_AIMD_LATENCY_TOLERANCE', 3.0)
+        self.latencyFloor = settings.getfloat('ONENOTE_AIMD_LATENCY_FLOOR', 0.5)
+        self.concurrency = float(min(max(settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN'), self.minConcurrency),
+                                     self.maxConcurrency))
+        self.smoothedLatency = None
+        self.lowestLatency = None
+        # the first throttled response always decreases the concurrency
+        self.responsesSinceDecrease = self.maxConcurrency
+        self.rateLimiterKey = settings.get('ONENOTE_RATE_LIMITER_KEY', rate_limiter.DEFAULT_RATE_LIMITER_KEY)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ONENOTE_AIMD_ENABLED'):
+            raise NotConfigured
+
+        controller = cls(crawler)
+        crawler.signals.connect(controller.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(controller.response_received, signal=signals.response_received)
+        crawler.signals.connect(controller.response_throttled, signal=rate_limiter.response_throttled)
+        crawler.signals.connect(controller.spider_closed, signal=signals.spider_closed)
+        return controller
+
+    def spider_opened(self, spider):
+        # some spiders only get their name when they are created
+        stateKey = (self.rateLimiterKey, spider.name)
+        if stateKey in _previous_states:
+            previousConcurrency, self.lowestLatency = _previous_states[stateKey]
+            self.concurrency = min(max(previousConcurrency, self.minConcurrency), self.maxConcurrency)
+
+        self.update_stats()
+
+    def spider_closed(self, spider):
+        _previous_states[(self.rateLimiterKey, spider.name)] = (self.concurrency, self.lowestLatency)
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        if latency is None:
+            return
+
+        self.responsesSinceDecrease += 1
+        self.smoothedLatency = latency if self.smoothedLatency is None else 0.8 * self.smoothedLatency + 0.2 * latency
+
+        if response.status == 429 or self.is_latency_rising():
+            self.decrease_concurrency()
+        else:
+            # one full window of good responses increases the concurrency by `increase`
+            self.concurrency = min(self.maxConcurrency, self.concurrency + self.increase / self.concurrency)
+
+        self.lowestLatency = self.smoothedLatency if self.lowestLatency is None else min(self.lowestLatency,
+                                                                                         self.smoothedLatency)
+        self.apply_concurrency(request)
+
+    def response_throttled(self, response, request, spider):
+        """
+        The throttled responses are retried by the retry middleware or by the batch spider, therefore
+        they are reported with their own signal instead of reaching `response_received`.
+        """
+        self.responsesSinceDecrease += 1
+        self.decrease_concurrency()
+        self.apply_concurrency(request)
+
+    def is_latency_rising(self):
+        if self.lowestLatency is None or self.smoothedLatency < self.latencyFloor:
+            return False
+
+        return self.smoothedLatency > self.lowestLatency * self.latencyTolerance
+
+    def decrease_concurrency(self):
+        """
+        The concurrency is decreased at most once per window, as all the requests that are
+        in flight when the server starts to throttle are likely to be throttled as well.
+        """
+        if self.responsesSinceDecrease < self.concurrency or self.concurrency <= self.minConcurrency:
+            return
+
+        self.concurrency = max(self.minConcurrency, self.concurrency * self.decreaseFactor)
+        self.responsesSinceDecrease = 0
+        self.crawler.stats.inc_value('onenote_aimd/decreases')
+
+    def apply_concurrency(self, request):
+        slot = self.crawler.engine.downloader.slots.get(request.meta.get('download_slot'))
+        if slot is not None:
+            slot.concurrency = int(self.concurrency)
+
+        self.update_stats()
+
+    def update_stats(self):
+        self.crawler.stats.set_value('onenote_aimd/concurrency', int(self.concurrency))
+        self.crawler.stats.max_value('onenote_aimd/max_concurrency', int(self.concurrency))
+        self.crawler.stats.min_value('onenote_aimd/min_concurrency', int(self.concurrency))
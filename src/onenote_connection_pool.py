@@ -0,0 +1,50 @@
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from twisted.internet import defer
+from twisted.web.client import HTTPConnectionPool
+
+_connection_pool: HTTPConnectionPool = None
+
+
+def get_connection_pool(max_persistent_per_host: int):
+    """
+    Returns the connection pool shared by all crawlers of the process.
+    """
+    global _connection_pool
+    from twisted.internet import reactor
+
+    if _connection_pool is None:
+        _connection_pool = HTTPConnectionPool(reactor, persistent=True)
+        _connection_pool._factory.noisy = False
+
+    _connection_pool.maxPersistentPerHost = max(_connection_pool.maxPersistentPerHost, max_persistent_per_host)
+    return _connection_pool
+
+
+def close_connection_pool():
+    """
+    Closes the connections of the shared pool, returns a Deferred that fires once they are closed.
+    """
+    global _connection_pool
+
+    if _connection_pool is None:
+        return defer.succeed(None)
+
+    connectionPool, _connection_pool = _connection_pool, None
+    return connectionPool.closeCachedConnections()
+
+
+class SharedPoolDownloadHandler(HTTP11DownloadHandler):
+    """
+    Download handler for HTTP and HTTPS that keeps the connections in the pool shared by all
+    crawlers of the process instead of a pool of its own, which is closed with the crawler. The
+    requests of the next crawler, e.g. of the next sync of the sync daemon, reuse the open
+    connections (and their TLS sessions) instead of connecting again. The pool is closed with
+    `close_connection_pool`.
+    """
+
+    def __init__(self, settings, crawler=None):
+        super(SharedPoolDownloadHandler, self).__init__(settings, crawler)
+        self._pool = get_connection_pool(settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN'))
+
+    def close(self):
+        return defer.succeed(None)
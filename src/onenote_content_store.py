@@ -0,0 +1,344 @@
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+
+import onenote_checkpoint as checkpoints
+
+FILES_BACKEND = "files"
+PACKED_BACKEND = "packed"
+
+PAGE_FILE_EXTENSION = ".html"
+PACK_INDEX_FILE = "pages.index"
+PACK_FILE = "pages.{}.pack"
+PACK_FILE_PATTERN = re.compile(r"pages\.(\d+)\.pack")
+
+# index file: header (magic, version, generation of the pack file, number of entries) followed by
+# the entries (uid hash, offset and length of the record in the pack file) sorted by uid hash
+INDEX_HEADER = struct.Struct("<4sIII")
+INDEX_ENTRY = struct.Struct("<16sQI")
+INDEX_MAGIC = b"ONPI"
+INDEX_VERSION = 1
+# record in the pack file: length of the uid and of the compressed content, uid, compressed content
+RECORD_HEADER = struct.Struct("<HI")
+
+COMPRESSION_LEVEL = 6
+# the pack file is compacted when more than this share of it is taken by deleted or replaced pages
+COMPACTION_RATIO = 0.5
+COMPACTION_MIN_DEAD_BYTES = 1024 * 1024
+
+
+def hash_page_uid(pageUid: str):
+    return hashlib.blake2b(pageUid.encode("utf-8"), digest_size=16).digest()
+
+
+class FileContentStore(object):
+    """
+    Stores the content of every page in its own HTML file, which is the layout Spotlight indexes.
+    """
+
+    def __init__(self, folder_path: str):
+        self.folderPath = folder_path
+        os.makedirs(self.folderPath, exist_ok=True)
+
+    def file_path(self, pageUid: str):
+        return os.path.join(self.folderPath, pageUid + PAGE_FILE_EXTENSION)
+
+    def store(self, pageUid: str, content: str):
+        """
+        Stores the content of the page, returns the number of bytes written.
+        """
+        return self.store_chunks(pageUid, (content,))
+
+    def store_chunks(self, pageUid: str, chunks: [str]):
+        """
+        Stores the content of the page, which is passed in as chunks that are written one by one.
+        """
+        with open(self.file_path(pageUid), mode='w') as file:
+            for chunk in chunks:
+                file.write(chunk)
+            return file.tell()
+
+    def contains(self, pageUid: str):
+        return os.path.isfile(self.file_path(pageUid))
+
+    def read(self, pageUid: str):
+        filePath = self.file_path(pageUid)
+        if not os.path.isfile(filePath):
+            return None
+
+        with open(filePath, mode='r') as file:
+            return file.read()
+
+    def delete(self, pagesUids: [str]):
+        for pageUid in pagesUids:
+            filePath = self.file_path(pageUid)
+            if os.path.isfile(filePath):
+                os.remove(filePath)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class PackedContentStore(object):
+    """
+    Stores the content of all pages compressed in one append-only pack file. A new version of a
+    page is appended and the index file, which maps the uid of every page to the position of its
+    latest version, is rewritten on `flush`. Until then a crashed sync only leaves unreferenced
+    records behind. Deleted and replaced pages are reclaimed when the store is closed and they
+    take more than half of the pack file, by copying the current versions into a new pack file.
+    The pack files of other generations, which a crashed compaction leaves behind, are deleted
+    when the store is opened. The store can be used from several threads.
+    """
+
+    def __init__(self, folder_path: str):
+        self.folderPath = folder_path
+        os.makedirs(self.folderPath, exist_ok=True)
+
+        self.generation, self.entries = read_index_file(self.index_file_path())
+        self.delete_stale_pack_files()
+        self.packFile = open(self.pack_file_path(self.generation), mode='a+b')
+        self.packFile.seek(0, os.SEEK_END)
+        self.deadBytes = self.packFile.tell() - sum(length for offset, length in self.entries.values())
+        self.lock = threading.Lock()
+
+    def index_file_path(self):
+        return os.path.join(self.folderPath, PACK_INDEX_FILE)
+
+    def pack_file_path(self, generation: int):
+        return os.path.join(self.folderPath, PACK_FILE.format(generation))
+
+    def delete_stale_pack_files(self):
+        """
+        Deletes the pack files that the index does not reference: the old one if the compaction
+        crashed after the new index had been written, the new one if it crashed before.
+        """
+        for fileName in os.listdir(self.folderPath):
+            match = PACK_FILE_PATTERN.fullmatch(fileName)
+            if match is not None and int(match.group(1)) != self.generation:
+                os.remove(os.path.join(self.folderPath, fileName))
+
+    def store(self, pageUid: str, content: str):
+        """
+        Appends the content of the page to the pack file, returns the number of bytes written.
+        """
+        return self.store_chunks(pageUid, (content,))
+
+    def store_chunks(self, pageUid: str, chunks: [str]):
+        """
+        Appends the content of the page, which is passed in as chunks that are compressed one by
+        one, to the pack file. Only the compressed content is kept in memory until it is written.
+        """
+        uid = pageUid.encode("utf-8")
+        compressor = zlib.compressobj(COMPRESSION_LEVEL)
+        compressedChunks = [compressor.compress(chunk.encode("utf-8")) for chunk in chunks]
+        compressedChunks.append(compressor.flush())
+        compressedContent = b"".join(compressedChunks)
+
+        key = hash_page_uid(pageUid)
+        recordLength = RECORD_HEADER.size + len(uid) + len(compressedContent)
+
+        with self.lock:
+            self.packFile.seek(0, os.SEEK_END)
+            offset = self.packFile.tell()
+            self.packFile.write(RECORD_HEADER.pack(len(uid), len(compressedContent)) + uid + compressedContent)
+
+            if key in self.entries:
+                self.deadBytes += self.entries[key][1]
+            self.entries[key] = (offset, recordLength)
+
+        return recordLength
+
+    def contains(self, pageUid: str):
+        with self.lock:
+            return hash_page_uid(pageUid) in self.entries
+
+    def read(self, pageUid: str):
+        with self.lock:
+            entry = self.entries.get(hash_page_uid(pageUid))
+            if entry is None:
+                return None
+
+            self.packFile.flush()
+            return read_record(self.packFile, entry[0], entry[1])[1]
+
+    def delete(self, pagesUids: [str]):
+        with self.lock:
+            for pageUid in pagesUids:
+                entry = self.entries.pop(hash_page_uid(pageUid), None)
+                if entry is not None:
+                    self.deadBytes += entry[1]
+
+    def flush(self):
+        """
+        Makes the stored pages durable, the pack file is synced before the index that references it is replaced.
+        """
+        with self.lock:
+            self.packFile.flush()
+            os.fsync(self.packFile.fileno())
+            write_index_file(self.index_file_path(), self.generation, self.entries)
+
+    def compact(self):
+        newGeneration = self.generation + 1
+        newEntries = {}
+
+        with open(self.pack_file_path(newGeneration), mode='wb') as newPackFile:
+            for key, (offset, length) in sorted(self.entries.items(), key=lambda item: item[1][0]):
+                self.packFile.seek(offset)
+                newEntries[key] = (newPackFile.tell(), length)
+                newPackFile.write(self.packFile.read(length))
+
+            newPackFile.flush()
+            os.fsync(newPackFile.fileno())
+
+        # the new pack file is only used once the index referencing it has replaced the old index
+        write_index_file(self.index_file_path(), newGeneration, newEntries)
+
+        self.packFile.close()
+        os.remove(self.pack_file_path(self.generation))
+        self.generation = newGeneration
+        self.entries = newEntries
+        self.deadBytes = 0
+        self.packFile = open(self.pack_file_path(self.generation), mode='a+b')
+
+    def needs_compaction(self):
+        self.packFile.seek(0, os.SEEK_END)
+        packSize = self.packFile.tell()
+
+        return self.deadBytes >= COMPACTION_MIN_DEAD_BYTES and self.deadBytes > packSize * COMPACTION_RATIO
+
+    def iterate_pages(self):
+        """
+        Iterates over the uid and the content of all the stored pages in the order of the pack file.
+        """
+        with self.lock:
+            self.packFile.flush()
+            positions = sorted(self.entries.values())
+
+        for offset, length in positions:
+            with self.lock:
+                record = read_record(self.packFile, offset, length)
+            yield record
+
+    def export_to_files(self, folder_path: str, pagesUids: {str} = None):
+        """
+        Writes the pages (all of them or only the passed in ones) as HTML files into the folder.
+        """
+        fileContentStore = FileContentStore(folder_path)
+
+        for pageUid, content in self.iterate_pages():
+            if pagesUids is None or pageUid in pagesUids:
+                fileContentStore.store(pageUid, content)
+
+    def close(self):
+        """
+        Must only be called once no other thread uses the store anymore.
+        """
+        self.flush()
+        if self.needs_compaction():
+            self.compact()
+
+        self.packFile.close()
+
+
+class PackIndex(object):
+    """
+    Read-only view of the index file of a packed content store, which is memory-mapped and
+    searched with a binary search instead of being loaded, e.g. for a script filter that shows
+    one page.
+    """
+
+    def __init__(self, folder_path: str):
+        self.folderPath = folder_path
+        with open(os.path.join(folder_path, PACK_INDEX_FILE), mode='rb') as file:
+            self.index = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.generation, self.count = INDEX_HEADER.unpack_from(self.index, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError("Not a page content index: " + folder_path)
+
+    def lookup(self, pageUid: str):
+        key = hash_page_uid(pageUid)
+        low = 0
+        high = self.count
+
+        while low < high:
+            middle = (low + high) // 2
+            entryPosition = INDEX_HEADER.size + middle * INDEX_ENTRY.size
+            entryKey, offset, length = INDEX_ENTRY.unpack_from(self.index, entryPosition)
+
+            if entryKey == key:
+                return offset, length
+            if entryKey < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return None
+
+    def read(self, pageUid: str):
+        entry = self.lookup(pageUid)
+        if entry is None:
+            return None
+
+        with open(os.path.join(self.folderPath, PACK_FILE.format(self.generation)), mode='rb') as packFile:
+            return read_record(packFile, entry[0], entry[1])[1]
+
+    def close(self):
+        self.index.close()
+
+
+def read_record(packFile, offset: int, length: int):
+    packFile.seek(offset)
+    record = packFile.read(length)
+    uidLength, contentLength = RECORD_HEADER.unpack_from(record, 0)
+    uid = record[RECORD_HEADER.size:RECORD_HEADER.size + uidLength].decode("utf-8")
+    content = zlib.decompress(record[RECORD_HEADER.size + uidLength:]).decode("utf-8")
+
+    return uid, content
+
+
+def read_index_file(file_path: str):
+    """
+    Returns the generation of the pack file and the entries (uid hash -> (offset, length)) of the index file.
+    """
+    if not os.path.isfile(file_path):
+        return 0, {}
+
+    with open(file_path, mode='rb') as file:
+        data = file.read()
+
+    magic, version, generation, count = INDEX_HEADER.unpack_from(data, 0)
+    if magic != INDEX_MAGIC or version != INDEX_VERSION:
+        raise ValueError("Not a page content index: " + file_path)
+
+    entries = {}
+    entriesData = data[INDEX_HEADER.size:INDEX_HEADER.size + count * INDEX_ENTRY.size]
+    for key, offset, length in INDEX_ENTRY.iter_unpack(entriesData):
+        entries[key] = (offset, length)
+
+    return generation, entries
+
+
+def write_index_file(file_path: str, generation: int, entries: {bytes, (int, int)}):
+    data = bytearray(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, generation, len(entries)))
+    for key in sorted(entries.keys()):
+        data += INDEX_ENTRY.pack(key, *entries[key])
+
+    checkpoints.write_file_atomically(file_path, bytes(data))
+
+
+def open_content_store(backend: str, folder_path: str):
+    if backend == FILES_BACKEND:
+        return FileContentStore(folder_path)
+
+    if backend == PACKED_BACKEND:
+        return PackedContentStore(folder_path)
+
+    raise ValueError("Unknown content store backend: " + backend)
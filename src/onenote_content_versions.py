@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+
+import onenote_checkpoint as checkpoints
+
+CONTENT_VERSIONS_FILE = "contentVersions.json"
+
+
+class PageContentVersion(object):
+    """
+    The version of the content of a page that is in the content store: the ETag the server returned
+    for it (None if it did not return one), the hash and the length of the downloaded body and the
+    subtitle that has been added to the body when it was stored.
+    """
+
+    __slots__ = ("etag", "bodyHash", "bodyLength", "subtitle")
+
+    def __init__(self, etag, bodyHash, bodyLength, subtitle):
+        self.etag = etag
+        self.bodyHash = bodyHash
+        self.bodyLength = bodyLength
+        self.subtitle = subtitle
+
+
+class PageContentVersions(object):
+    """
+    The versions of the stored page contents (page uid -> PageContentVersion), which allow to
+    download a page conditionally and to skip storing a page whose content did not change.
+    """
+
+    def __init__(self):
+        self.versions: {str, PageContentVersion} = {}
+        self.changed = False
+
+    def get(self, pageUid: str):
+        return self.versions.get(pageUid)
+
+    def set(self, pageUid: str, version: PageContentVersion):
+        self.versions[pageUid] = version
+        self.changed = True
+
+    def delete(self, pagesUids: [str]):
+        for pageUid in pagesUids:
+            if self.versions.pop(pageUid, None) is not None:
+                self.changed = True
+
+    def store_in_file(self, file_path: str):
+        if not self.changed:
+            return
+
+        checkpoints.write_file_atomically(file_path, json.dumps({
+            pageUid: [version.etag, version.bodyHash, version.bodyLength, version.subtitle]
+            for pageUid, version in self.versions.items()
+        }))
+        self.changed = False
+
+    @classmethod
+    def load_from_file(cls, file_path: str):
+        versions = cls()
+        if not os.path.isfile(file_path):
+            return versions
+
+        with open(file_path, "r") as file:
+            for pageUid, values in json.load(file).items():
+                versions.versions[pageUid] = PageContentVersion(*values)
+
+        return versions
+
+
+def hash_body(body: bytes):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def move_versions_file(old_file_path: str, file_path: str):
+    """
+    Moves the versions file to its new location, unless there already is one.
+    """
+    if os.path.isfile(old_file_path) and not os.path.isfile(file_path):
+        os.replace(old_file_path, file_path)
@@ -0,0 +1,85 @@
+import onenote_types as types
+
+
+class OneNoteElementDictionary(dict):
+    """
+    Dictionary of all OneNote elements (uid -> element) that remembers which elements have been
+    modified or deleted since the changes have been stored the last time. Elements that are
+    changed in place have to be marked with `mark_modified`. The new elements are modified ones
+    that are additionally kept in `addedUids`.
+
+    It also maintains an index of the element uids by type and by parent uid, which is updated
+    whenever an element is added, replaced (e.g. moved to another parent) or deleted.
+    """
+
+    def __init__(self, elements: [types.OneNoteElement] = ()):
+        super(OneNoteElementDictionary, self).__init__()
+        self.uidsByType: {types.OneNoteType, (str)} = {onenoteType: set() for onenoteType in types.OneNoteType}
+        self.childrenUids: {str, (str)} = {}
+
+        for element in elements:
+            super(OneNoteElementDictionary, self).__setitem__(element.uid, element)
+            self.add_to_index(element)
+
+        self.modifiedUids: {str} = set()
+        self.deletedUids: {str} = set()
+        self.addedUids: {str} = set()
+
+    def __setitem__(self, uid: str, element: types.OneNoteElement):
+        if uid in self:
+            self.remove_from_index(self[uid])
+        elif uid not in self.deletedUids:
+            self.addedUids.add(uid)
+
+        super(OneNoteElementDictionary, self).__setitem__(uid, element)
+        self.add_to_index(element)
+        self.modifiedUids.add(uid)
+        self.deletedUids.discard(uid)
+
+    def __delitem__(self, uid: str):
+        self.remove_from_index(self[uid])
+        super(OneNoteElementDictionary, self).__delitem__(uid)
+        self.deletedUids.add(uid)
+        self.modifiedUids.discard(uid)
+        self.addedUids.discard(uid)
+
+    def pop(self, uid: str, *default):
+        if uid not in self:
+            return super(OneNoteElementDictionary, self).pop(uid, *default)
+
+        element = self[uid]
+        del self[uid]
+        return element
+
+    def add_to_index(self, element: types.OneNoteElement):
+        self.uidsByType[element.onenoteType].add(element.uid)
+
+        if element.parentUid is not None:
+            self.childrenUids.setdefault(element.parentUid, set()).add(element.uid)
+
+    def remove_from_index(self, element: types.OneNoteElement):
+        self.uidsByType[element.onenoteType].discard(element.uid)
+
+        if element.parentUid in self.childrenUids:
+            siblingsUids = self.childrenUids[element.parentUid]
+            siblingsUids.discard(element.uid)
+            if not siblingsUids:
+                del self.childrenUids[element.parentUid]
+
+    def uids_of_type(self, onenoteType: types.OneNoteType):
+        return self.uidsByType[types.OneNoteType(onenoteType)]
+
+    def children_uids(self, uid: str):
+        return self.childrenUids.get(uid, set())
+
+    def mark_modified(self, uid: str):
+        if uid in self:
+            self.modifiedUids.add(uid)
+
+    def has_changes(self):
+        return bool(self.modifiedUids or self.deletedUids)
+
+    def clear_changes(self):
+        self.modifiedUids = set()
+        self.deletedUids = set()
+        self.addedUids = set()
@@ -0,0 +1,192 @@
+import os
+import sqlite3
+
+import onenote_checkpoint as checkpoints
+import onenote_json
+import onenote_types as types
+from onenote_element_dictionary import OneNoteElementDictionary
+
+JSON_BACKEND = "json"
+SQLITE_BACKEND = "sqlite"
+
+# the columns are selected in the order of the constructor arguments of the elements
+ELEMENT_FIELDS = types.ELEMENT_FIELDS
+ONENOTE_TYPE_COLUMN = ELEMENT_FIELDS.index("onenoteType")
+
+
+class JsonElementStore(object):
+    """
+    Stores all the elements in one JSON file, which is rewritten completely on every save.
+    """
+
+    def __init__(self, file_path: str):
+        self.filePath = file_path
+
+    def load(self):
+        with open(self.filePath, "r") as file:
+            elements = onenote_json.loads(file.read())
+
+        return OneNoteElementDictionary(types.as_onenoteelement(element) for element in elements)
+
+    def save(self, alfred_data_dictionary: OneNoteElementDictionary):
+        if not alfred_data_dictionary.has_changes() and os.path.isfile(self.filePath):
+            return
+
+        export_elements_to_json(self.filePath, alfred_data_dictionary.values())
+        alfred_data_dictionary.clear_changes()
+
+    def close(self):
+        pass
+
+
+class SqliteElementStore(object):
+    """
+    Stores the elements in an SQLite database with one row per element. Saving only writes the
+    elements that have been modified or deleted since the last save, all in one transaction.
+    Readers can query single elements or elements by type and parent without loading everything.
+    """
+
+    def __init__(self, file_path: str, read_only: bool = False):
+        self.filePath = file_path
+
+        if read_only:
+            self.connection = sqlite3.connect("file:{}?mode=ro".format(file_path), uri=True)
+        else:
+            self.connection = sqlite3.connect(file_path)
+            self.create_schema()
+
+    def create_schema(self):
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS elements (
+                    uid TEXT PRIMARY KEY,
+                    title TEXT,
+                    autocomplete TEXT,
+                    subtitle TEXT,
+                    arg TEXT,
+                    icon TEXT,
+                    icontype TEXT,
+                    onenoteType TEXT NOT NULL,
+                    parentUid TEXT,
+                    lastModifiedDateTime TEXT,
+                    match TEXT
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS elements_parentUid ON elements (parentUid)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS elements_onenoteType ON elements (onenoteType)")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS elements_lastModifiedDateTime ON elements (lastModifiedDateTime)")
+
+    def load(self):
+        return OneNoteElementDictionary(self.find())
+
+    def save(self, alfred_data_dictionary: OneNoteElementDictionary):
+        if not alfred_data_dictionary.has_changes():
+            return
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO elements ({}) VALUES ({})".format(", ".join(ELEMENT_FIELDS),
+                                                                           ", ".join("?" * len(ELEMENT_FIELDS))),
+                (element_to_row(alfred_data_dictionary[uid]) for uid in alfred_data_dictionary.modifiedUids))
+            self.connection.executemany("DELETE FROM elements WHERE uid = ?",
+                                        ((uid,) for uid in alfred_data_dictionary.deletedUids))
+
+        alfred_data_dictionary.clear_changes()
+
+    def import_elements(self, elements: [types.OneNoteElement]):
+        alfredDataDictionary = OneNoteElementDictionary()
+        for element in elements:
+            alfredDataDictionary[element.uid] = element
+
+        self.save(alfredDataDictionary)
+
+    def is_empty(self):
+        return self.connection.execute("SELECT 1 FROM elements LIMIT 1").fetchone() is None
+
+    def get(self, uid: str):
+        row = self.connection.execute(
+            "SELECT {} FROM elements WHERE uid = ?".format(", ".join(ELEMENT_FIELDS)), (uid,)).fetchone()
+
+        return row_to_element(row) if row is not None else None
+
+    def find(self, onenoteType: types.OneNoteType = None, parentUid: str = None):
+        """
+        Iterates over all the elements, optionally only those of one type and/or parent.
+        """
+        conditions = []
+        parameters = []
+
+        if onenoteType is not None:
+            conditions.append("onenoteType = ?")
+            parameters.append(types.OneNoteType(onenoteType).value)
+
+        if parentUid is not None:
+            conditions.append("parentUid = ?")
+            parameters.append(parentUid)
+
+        query = "SELECT {} FROM elements".format(", ".join(ELEMENT_FIELDS))
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        for row in self.connection.execute(query, parameters):
+            yield row_to_element(row)
+
+    def count(self, onenoteType: types.OneNoteType = None):
+        if onenoteType is None:
+            return self.connection.execute("SELECT COUNT(*) FROM elements").fetchone()[0]
+
+        return self.connection.execute("SELECT COUNT(*) FROM elements WHERE onenoteType = ?",
+                                       (types.OneNoteType(onenoteType).value,)).fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+def element_to_row(element: types.OneNoteElement):
+    row = [getattr(element, field) for field in ELEMENT_FIELDS]
+    row[ONENOTE_TYPE_COLUMN] = element.onenoteType.value
+    return row
+
+
+def row_to_element(row):
+    return types.OneNoteElement(*row)
+
+
+def export_elements_to_json(file_path: str, elements: [types.OneNoteElement]):
+    data = [types.onenoteelement_as_dict(element) for element in elements]
+    checkpoints.write_file_atomically(file_path, onenote_json.dumps(data))
+
+
+def open_element_store(backend: str, file_path: str, json_file_path: str):
+    """
+    Opens the element store of the passed in backend. A new SQLite store is initialized with
+    the elements of the JSON file, if there is one.
+    """
+    if backend == JSON_BACKEND:
+        return JsonElementStore(json_file_path)
+
+    if backend == SQLITE_BACKEND:
+        store = SqliteElementStore(file_path)
+
+        if store.is_empty() and os.path.isfile(json_file_path):
+            store.import_elements(JsonElementStore(json_file_path).load().values())
+
+        return store
+
+    raise ValueError("Unknown element store backend: " + backend)
+
+
+def read_elements(file_path: str, json_file_path: str, uids: [str]):
+    """
+    Reads only the passed in elements, for the readers of the synced data that look up a few
+    elements. The JSON file is only read if there is no database.
+    """
+    if not os.path.isfile(file_path):
+        elements = JsonElementStore(json_file_path).load()
+        return [elements.get(uid) for uid in uids]
+
+    store = SqliteElementStore(file_path, read_only=True)
+    try:
+        return [store.get(uid) for uid in uids]
+    finally:
+        store.close()
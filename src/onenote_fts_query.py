@@ -0,0 +1,20 @@
+import re
+
+# the words of a query, everything else (e.g. the operators and quotes of FTS5) is left out
+QUERY_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def build_match_expression(query: str, all_prefixes: bool = False):
+    """
+    Turns the words of a query into an SQLite FTS5 expression, quoting them so that no word is taken
+    as an operator. The last word is matched as a prefix, as it may not be typed completely, or with
+    `all_prefixes` every word. Returns None if the query has no words.
+    """
+    tokens = QUERY_TOKEN_PATTERN.findall(query)
+    if not tokens:
+        return None
+
+    if all_prefixes:
+        return " ".join('"{}"*'.format(token) for token in tokens)
+
+    return " ".join('"{}"'.format(token) for token in tokens) + "*"
@@ -0,0 +1,141 @@
+from datetime import datetime, timezone
+from urllib.parse import quote, urlencode, urlparse
+
+import onenote_types as types
+
+GRAPH_BASE_URL = "https://graph.microsoft.com"
+GRAPH_VERSION_PATH = "/v1.0"
+ONENOTE_PATH = GRAPH_VERSION_PATH + "/me/onenote"
+
+# the largest page size the Graph API accepts for page listings (the default is 20)
+PAGES_PAGE_SIZE = 100
+
+# only the fields that are read by the mapping functions of the sync spider are requested
+NOTEBOOK_FIELDS = "id,displayName,lastModifiedDateTime,links"
+SECTION_GROUP_FIELDS = "id,displayName,lastModifiedDateTime"
+SECTION_FIELDS = "id,displayName,lastModifiedDateTime,links"
+PAGE_FIELDS = "id,title,lastModifiedDateTime,links"
+PARENTS_OF_CONTAINER_EXPANSION = "parentNotebook($select=id,displayName),parentSectionGroup($select=id)"
+PARENT_OF_PAGE_EXPANSION = "parentSection($select=id,displayName)"
+
+ELEMENTS_PATHS = {
+    types.OneNoteType.NOTEBOOK: ("/notebooks", NOTEBOOK_FIELDS, None),
+    types.OneNoteType.SECTION_GROUP: ("/sectionGroups", SECTION_GROUP_FIELDS, PARENTS_OF_CONTAINER_EXPANSION),
+    types.OneNoteType.SECTION: ("/sections", SECTION_FIELDS, PARENTS_OF_CONTAINER_EXPANSION),
+}
+# the last part of the paths of the listings, which are the endpoints besides the content and the batch requests
+ENDPOINTS = ("notebooks", "sectionGroups", "sections", "pages")
+
+
+def build_url(base_url: str, path: str, parameters: {str, str}):
+    parameters = {key: value for key, value in parameters.items() if value is not None}
+    if not parameters:
+        return base_url + path
+
+    return base_url + path + "?" + urlencode(parameters, quote_via=quote, safe="$,()=:")
+
+
+def format_datetime(date: datetime):
+    """
+    Formats a datetime the way OData expects it in a filter expression.
+    """
+    return date.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_graph_date(value: str):
+    """
+    Parses a date of the Graph API like `2021-01-01T12:00:00.123Z`.
+    """
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def elements_url(base_url: str, onenote_type: types.OneNoteType):
+    """
+    Lists all the notebooks, section groups or sections of the user.
+    """
+    path, fields, expansion = ELEMENTS_PATHS[onenote_type]
+
+    return build_url(base_url, ONENOTE_PATH + path, {"$select": fields, "$expand": expansion})
+
+
+def section_pages_url(base_url: str, section_uid: str, modified_since: datetime = None):
+    """
+    Lists the pages of a section. If `modified_since` is passed in, only the pages modified
+    since then are listed.
+    """
+    return build_url(base_url, ONENOTE_PATH + "/sections/" + section_uid + "/pages", {
+        "$select": PAGE_FIELDS,
+        "$expand": PARENT_OF_PAGE_EXPANSION,
+        "$filter": "lastModifiedDateTime ge " + format_datetime(modified_since) if modified_since else None,
+        "$top": str(PAGES_PAGE_SIZE),
+    })
+
+
+def section_pages_uids_url(base_url: str, section_uid: str):
+    """
+    Lists only the uids of all the pages of a section, which is all that is needed to detect deleted pages.
+    """
+    return build_url(base_url, ONENOTE_PATH + "/sections/" + section_uid + "/pages", {
+        "$select": "id",
+        "$top": str(PAGES_PAGE_SIZE),
+    })
+
+
+def account_pages_url(base_url: str, modified_since: datetime = None):
+    """
+    Lists the pages of all sections of the user, the most recently modified pages first. If
+    `modified_since` is passed in, only the pages modified since then are listed.
+    """
+    return build_url(base_url, ONENOTE_PATH + "/pages", {
+        "$select": PAGE_FIELDS,
+        "$expand": PARENT_OF_PAGE_EXPANSION,
+        "$filter": "lastModifiedDateTime ge " + format_datetime(modified_since) if modified_since else None,
+        "$orderby": "lastModifiedDateTime desc",
+        "$top": str(PAGES_PAGE_SIZE),
+    })
+
+
+def account_pages_uids_url(base_url: str):
+    """
+    Lists only the uids of all the pages of the user, which is all that is needed to detect deleted pages.
+    """
+    return build_url(base_url, ONENOTE_PATH + "/pages", {
+        "$select": "id",
+        "$top": str(PAGES_PAGE_SIZE),
+    })
+
+
+def page_content_url(base_url: str, page_uid: str):
+    return base_url + GRAPH_VERSION_PATH + "/users/me/onenote/pages/" + page_uid + "/content"
+
+
+def batch_url(base_url: str):
+    return base_url + GRAPH_VERSION_PATH + "/$batch"
+
+
+def relative_url(url: str, base_url: str):
+    """
+    Returns the URL relative to the API version, the way the sub-requests of a batch request expect it.
+    """
+    prefix = base_url + GRAPH_VERSION_PATH
+    if not url.startswith(prefix):
+        raise ValueError("URL is not part of the Graph API: " + url)
+
+    return url[len(prefix):]
+
+
+def endpoint_of_url(url: str):
+    """
+    Returns the endpoint a request URL belongs to, e.g. for the latencies per endpoint: notebooks,
+    sectionGroups, sections, pages (the page listings of a section or the user), content or batch.
+    """
+    path = urlparse(url).path.rstrip("/")
+
+    if path.endswith("/content"):
+        return "content"
+
+    if path.endswith("/$batch"):
+        return "batch"
+
+    endpoint = path.rsplit("/", 1)[-1]
+    return endpoint if endpoint in ENDPOINTS else "other"
@@ -0,0 +1,101 @@
+import functools
+import json
+
+try:
+    import orjson  # faster JSON backend, used if installed
+except ImportError:
+    orjson = None
+
+VALUE_KEY = "value"
+NEXT_LINK_KEY = "@odata.nextLink"
+
+
+@functools.lru_cache(maxsize=None)
+def streaming_parser():
+    """
+    Returns the streaming JSON parser `ijson` if it is installed, otherwise None. It is only imported
+    once a listing is streamed, as importing it takes longer than the tools reading the synced data need.
+    """
+    try:
+        import ijson
+    except ImportError:
+        return None
+
+    return ijson
+
+
+def loads(data):
+    """
+    Parses a JSON document given as bytes or str with the fastest backend available.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+def dumps(data):
+    """
+    Serializes the data into a JSON document given as str with the fastest backend available.
+    """
+    if orjson is not None:
+        return orjson.dumps(data).decode("utf-8")
+
+    return json.dumps(data)
+
+
+class GraphListing(object):
+    """
+    The parsed response of a Graph listing request: the elements of the `value` array
+    and the link to the next page of the listing (None if it is the last page).
+    """
+
+    def __init__(self, value, next_link):
+        self.value = value
+        self.nextLink = next_link
+
+    def __iter__(self):
+        return iter(self.value)
+
+
+class StreamedGraphListing(object):
+    """
+    A Graph listing whose `value` array is parsed element by element while it is iterated,
+    so that only one element is kept in memory at a time. The listing can only be iterated
+    once and `nextLink` is only known after the iteration has finished.
+    """
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.nextLink = None
+
+    def __iter__(self):
+        builder = None
+        itemPrefix = VALUE_KEY + ".item"
+        ijson = streaming_parser()
+
+        for prefix, event, value in ijson.parse(self.body):
+            if builder is not None:
+                if prefix == itemPrefix and event in ("end_map", "end_array"):
+                    builder.event(event, value)
+                    yield builder.value
+                    builder = None
+                else:
+                    builder.event(event, value)
+            elif prefix == itemPrefix and event in ("start_map", "start_array"):
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            elif prefix == NEXT_LINK_KEY and event == "string":
+                self.nextLink = value
+
+
+def parse_listing(body: bytes, streaming: bool = False):
+    """
+    Parses the body of a Graph listing response exactly once. In streaming mode the
+    elements are parsed lazily, this requires `ijson` and falls back to a full parse otherwise.
+    """
+    if streaming and streaming_parser() is not None:
+        return StreamedGraphListing(body)
+
+    data = loads(body)
+    return GraphListing(data.get(VALUE_KEY, []), data.get(NEXT_LINK_KEY))
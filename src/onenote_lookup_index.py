@@ -0,0 +1,114 @@
+import sqlite3
+
+import onenote_fts_query as fts_query
+import onenote_types as types
+
+LOOKUP_INDEX_DATABASE = "elementLookupIndex.sqlite"
+
+# the ranking weights of the full-text columns: title and match
+TITLE_WEIGHT = 10.0
+MATCH_WEIGHT = 1.0
+
+
+class ElementLookupIndex(object):
+    """
+    Lookup index over the title and the match string (e.g. "Notebook > Section > Page") of all
+    elements for as-you-type queries. Every word of a query is looked up as a prefix in the prefix
+    postings of an SQLite FTS5 table, so a query never scans the elements.
+
+    The table `entries` holds the indexed fields and the type of every element, the full-text table
+    `entries_fts` indexes the fields without storing them again and is kept in sync by triggers.
+    The results are restricted to some types of elements with the type column of `entries`, which
+    is faster than intersecting the postings with the ones of a type.
+    """
+
+    def __init__(self, file_path: str, read_only: bool = False):
+        self.filePath = file_path
+
+        if read_only:
+            self.connection = sqlite3.connect("file:{}?mode=ro".format(file_path), uri=True)
+        else:
+            self.connection = sqlite3.connect(file_path)
+            self.create_schema()
+
+    def create_schema(self):
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY,
+                    uid TEXT NOT NULL UNIQUE,
+                    onenoteType TEXT NOT NULL,
+                    title TEXT,
+                    match TEXT
+                )""")
+            self.connection.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+                    title, match, content = 'entries', content_rowid = 'id',
+                    prefix = '1 2 3', tokenize = 'unicode61 remove_diacritics 2'
+                )""")
+            self.connection.execute("""
+                CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+                    INSERT INTO entries_fts (rowid, title, match) VALUES (new.id, new.title, new.match);
+                END""")
+            self.connection.execute("""
+                CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+                    INSERT INTO entries_fts (entries_fts, rowid, title, match)
+                    VALUES ('delete', old.id, old.title, old.match);
+                END""")
+
+    def is_empty(self):
+        return self.connection.execute("SELECT 1 FROM entries LIMIT 1").fetchone() is None
+
+    def update(self, alfred_data_dictionary: {str, types.OneNoteElement}, modified_uids: {str}, deleted_uids: {str}):
+        """
+        Indexes the modified elements again and removes the deleted ones, in one transaction.
+        """
+        with self.connection:
+            self.connection.executemany("DELETE FROM entries WHERE uid = ?",
+                                        ((uid,) for uid in set(modified_uids) | set(deleted_uids)))
+            self.connection.executemany(
+                "INSERT INTO entries (uid, onenoteType, title, match) VALUES (?, ?, ?, ?)",
+                ((element.uid, element.onenoteType.value, element.title, element.match)
+                 for element in (alfred_data_dictionary.get(uid) for uid in modified_uids) if element is not None))
+
+    def find(self, query: str, onenoteTypes: [types.OneNoteType] = None, limit: int = 20):
+        """
+        Returns the uids of the best matching elements, every word of the query has to be the
+        prefix of a word of their title or their match string.
+        """
+        matchExpression = fts_query.build_match_expression(query, all_prefixes=True)
+        if matchExpression is None:
+            return []
+
+        typeValues = [types.OneNoteType(onenoteType).value for onenoteType in onenoteTypes or ()]
+        typeCondition = "AND entries.onenoteType IN ({})".format(", ".join("?" * len(typeValues))) \
+            if typeValues else ""
+
+        return [row[0] for row in self.connection.execute("""
+            SELECT entries.uid
+            FROM entries_fts JOIN entries ON entries.id = entries_fts.rowid
+            WHERE entries_fts MATCH ? {}
+            ORDER BY bm25(entries_fts, {}, {})
+            LIMIT ?""".format(typeCondition, TITLE_WEIGHT, MATCH_WEIGHT), [matchExpression, *typeValues, limit])]
+
+    def optimize(self):
+        with self.connection:
+            self.connection.execute("INSERT INTO entries_fts (entries_fts) VALUES ('optimize')")
+
+    def close(self):
+        self.connection.close()
+
+
+def update_lookup_index(lookup_index: ElementLookupIndex, alfred_data_dictionary):
+    """
+    Indexes the elements that have been modified or deleted since the element store has been saved
+    the last time, therefore it has to be called before the changes are saved. An empty index is
+    filled with all elements once.
+    """
+    if lookup_index.is_empty():
+        lookup_index.update(alfred_data_dictionary, alfred_data_dictionary.keys(), ())
+        lookup_index.optimize()
+        return
+
+    lookup_index.update(alfred_data_dictionary, alfred_data_dictionary.modifiedUids,
+                        alfred_data_dictionary.deletedUids)
@@ -0,0 +1,60 @@
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+import onenote_page_text as page_text
+
+
+class PageContentProcessor(object):
+    """
+    Post-processes downloaded pages and writes them into the content store on a bounded pool of
+    worker threads, so that large pages do not block the reactor while they are processed. At most
+    `max_pending` pages are processed or waiting for a worker at a time; as the callbacks of the
+    page content spider wait for their page to be processed, Scrapy stops downloading further pages
+    while the workers are busy.
+
+    A thread pool is used instead of a process pool, as sending multi-megabyte pages to another
+    process would copy them again; the compression of the packed content store and the file writes
+    release the interpreter lock, and the regular expressions at least do not block the reactor.
+    """
+
+    def __init__(self, content_store, workers: int = 2, max_pending: int = 4, strip_images: bool = False,
+                 extract_text: bool = False):
+        self.contentStore = content_store
+        self.stripImages = strip_images
+        self.extractText = extract_text
+        self.pendingSemaphore = defer.DeferredSemaphore(max(max_pending, 1))
+        self.threadPool = ThreadPool(minthreads=0, maxthreads=max(workers, 1), name="OneNotePageContentProcessor")
+        self.threadPool.start()
+        # the worker threads would keep the process alive if the reactor is stopped before the spider is closed
+        self.shutdownTrigger = reactor.addSystemEventTrigger('during', 'shutdown', self.threadPool.stop)
+
+    @classmethod
+    def from_settings(cls, content_store, settings):
+        workers = settings.getint('ONENOTE_CONTENT_WORKERS', 2)
+
+        return cls(content_store, workers, settings.getint('ONENOTE_CONTENT_MAX_PENDING', workers * 2),
+                   settings.getbool('ONENOTE_CONTENT_STRIP_IMAGES'), settings.getbool('ONENOTE_CONTENT_EXTRACT_TEXT'))
+
+    def process(self, pageUid: str, body: bytes, encoding: str, subtitle: str):
+        """
+        Returns a Deferred that fires with the number of bytes written once the page has been processed and stored.
+        """
+        return self.pendingSemaphore.run(threads.deferToThreadPool, reactor, self.threadPool,
+                                         self.process_in_worker, pageUid, body, encoding, subtitle)
+
+    def process_in_worker(self, pageUid: str, body: bytes, encoding: str, subtitle: str):
+        # the page is decoded, transformed and written chunk by chunk instead of being copied as a whole
+        pageChunks = page_text.transform_page_content_chunks(body, encoding, subtitle, self.stripImages)
+
+        if self.extractText:
+            # the text extraction needs the whole page
+            return self.contentStore.store(pageUid, page_text.extract_text("".join(pageChunks)))
+
+        return self.contentStore.store_chunks(pageUid, pageChunks)
+
+    def close(self):
+        if not self.threadPool.started:  # already stopped by the shutdown of the reactor
+            return
+
+        reactor.removeSystemEventTrigger(self.shutdownTrigger)
+        self.threadPool.stop()
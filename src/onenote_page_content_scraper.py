@@ -1,60 +1,173 @@
 # -*- coding: utf-8 -*-
-import os
+from datetime import datetime, timezone
 
-import scrapy
+from scrapy.utils.defer import maybe_deferred_to_future
 
-import auth_token_request as req
+import onenote_batch as batch
+import onenote_content_versions as content_versions
+import onenote_graph_api as graph_api
+import onenote_page_content_processor as content_processor
+import onenote_sync_metrics as sync_metrics
 import onenote_types as types
 
+EARLIEST_DATETIME = datetime.min.replace(tzinfo=timezone.utc)
 
-class OneNotePageContentSpider(scrapy.Spider):
+
+class OneNotePageContentSpider(batch.GraphBatchSpider):
     """
-    This spider scrapes all the content of the pages and stores them it html files.
+    This spider scrapes all the content of the pages and stores them in the content store.
     """
 
-    def __init__(self, modified_pages_uids: set(), download_folder_path: str,
-                 alfred_data_dictionary: {str, types.OneNoteElement}):
+    # downloading the content of a page is expensive for the server, therefore fewer of them run in parallel
+    custom_settings = {
+        'ONENOTE_AIMD_MAX_CONCURRENCY': 6,
+    }
+
+    def __init__(self, modified_pages_uids: set(), content_store,
+                 alfred_data_dictionary: {str, types.OneNoteElement}, pages_downloaded: {str, str},
+                 page_content_versions: content_versions.PageContentVersions = None, requests_used: int = 0):
         self.name = 'OneNotePageContentSpider'
-        self.allowed_domains = ['graph.microsoft.com']
         self.alfred_data_dictionary = alfred_data_dictionary
         self.modified_pages_uids = modified_pages_uids
-        self.downloadFolderPath = download_folder_path
+        # either an onenote_content_store.FileContentStore or an onenote_content_store.PackedContentStore
+        self.contentStore = content_store
+        # page uid -> lastModifiedDateTime of the downloaded version of the page
+        self.pagesDownloaded = pages_downloaded
+        self.pageContentVersions = page_content_versions if page_content_versions is not None \
+            else content_versions.PageContentVersions()
+        self.pageContentProcessor = None
+        # requests that have already been sent in this run, they count against ONENOTE_REQUEST_BUDGET
+        self.requestsUsed = requests_used
+        # the requests this spider may still send, which onenote_rate_limiter.QuotaRateLimiterMiddleware enforces
+        self.requestBudget = None
+        self.pagesUids = []
 
     def start_requests(self):
-        for modifiedPageUid in self.modified_pages_uids:
-            yield req.AuthTokenRequest(meta={types.PAGE_UID_KEY: modifiedPageUid},
-                                       url='https://graph.microsoft.com/v1.0/users/me/onenote/pages/' + modifiedPageUid + '/content',
-                                       method="GET", callback=self.parse_page_content)
+        self.pageContentProcessor = content_processor.PageContentProcessor.from_settings(self.contentStore,
+                                                                                         self.settings)
+
+        pagesUids = self.prioritize_pages(self.modified_pages_uids)
+        budget = self.settings.getint('ONENOTE_REQUEST_BUDGET', 0)
+
+        if budget > 0:
+            self.requestBudget = max(budget - self.requestsUsed, 0)
+            # the pages beyond the budget stay pending in the checkpoint and are downloaded by the next run, the
+            # ones that do not get their request because retries used up the budget are counted when the spider closes
+            self.crawler.stats.set_value('onenote_content/pages_deferred',
+                                         max(len(pagesUids) - self.requestBudget, 0))
+            pagesUids = pagesUids[:self.requestBudget]
+        self.pagesUids = pagesUids
+
+        # the priorities keep the order in the scheduler, which would otherwise return the latest requests first
+        yield from self.batch_requests(
+            self.build_page_content_request(pageUid, len(pagesUids) - index) for index, pageUid in enumerate(pagesUids)
+        )
 
-    def parse_page_content(self, response):
+    def prioritize_pages(self, pagesUids: {str}):
         """
-        Is used to parse page content and store it in a file.
+        Returns the uids of the pages in the order they are downloaded in, which is set with the
+        setting `ONENOTE_CONTENT_PRIORITY`: a list of `types.PageContentPriority` values of which
+        the first one is applied first and the following ones order the pages it considers equal.
         """
-        pageUid = response.meta[types.PAGE_UID_KEY]
-        pageContent = response.text
-        pageContent = self.post_process_page_content(pageUid, pageContent)
+        priorities = [types.PageContentPriority(priority) for priority in
+                      self.settings.getlist('ONENOTE_CONTENT_PRIORITY', [types.PageContentPriority.MISSING,
+                                                                         types.PageContentPriority.RECENT])]
+        priorityNotebooks = set(self.settings.getlist('ONENOTE_CONTENT_PRIORITY_NOTEBOOKS'))
+        # sorted by uid first so that the order does not depend on the order of the set
+        pagesUids = sorted(pagesUids)
+
+        # sorting is stable, therefore sorting by the last priority first leaves the first one deciding
+        for priority in reversed(priorities):
+            if priority == types.PageContentPriority.RECENT:
+                pagesUids.sort(key=self.last_modified, reverse=True)
+            elif priority == types.PageContentPriority.MISSING:
+                pagesUids.sort(key=self.contentStore.contains)
+            elif priority == types.PageContentPriority.NOTEBOOKS:
+                pagesUids.sort(key=lambda pageUid: not self.is_in_notebooks(pageUid, priorityNotebooks))
+
+        return pagesUids
+
+    def last_modified(self, pageUid: str):
+        """
+        The dates are compared parsed, as the Graph API does not always return them with the same number of
+        fractional digits (or with any).
+        """
+        lastModifiedDateTime = self.alfred_data_dictionary[pageUid].lastModifiedDateTime
+        return graph_api.parse_graph_date(lastModifiedDateTime) if lastModifiedDateTime else EARLIEST_DATETIME
 
-        self.store_page_content_in_file(pageUid, pageContent)
+    def is_in_notebooks(self, pageUid: str, notebooks: {str}):
+        """
+        The notebooks are given by their name or their uid.
+        """
+        element = self.alfred_data_dictionary.get(pageUid)
+        while element is not None and element.onenoteType != types.OneNoteType.NOTEBOOK:
+            element = self.alfred_data_dictionary.get(element.parentUid)
 
-    def post_process_page_content(self, pageUid, pageContent):
+        return element is not None and (element.title in notebooks or element.uid in notebooks)
+
+    def build_page_content_request(self, pageUid, priority: int = 0):
         """
-        This function removes the head-tag so that the infromation eisting in head is also
-        indexed by spotlight. Further, it adds the subtitle of the OneNote element to the
-        HTML file so that the file can also be found based on the names of its parent elements.
+        The content of a page is requested conditionally if the server returned an ETag for the stored
+        version, the stored version still has the current subtitle, as a `304 - Not modified`
+        response has no body the subtitle could be added to, and the content store still has it.
         """
-        pageContent = pageContent.replace("<head>", "")
-        pageContent = pageContent.replace("</head>", self.alfred_data_dictionary[pageUid].subtitle)
+        headers = {}
+        version = self.pageContentVersions.get(pageUid)
+
+        if version is not None and version.etag is not None and \
+                version.subtitle == self.alfred_data_dictionary[pageUid].subtitle and \
+                self.contentStore.contains(pageUid):
+            headers['If-None-Match'] = version.etag
 
-        return pageContent
+        return self.auth_token_request(meta={types.PAGE_UID_KEY: pageUid, 'handle_httpstatus_list': [304]},
+                                       url=graph_api.page_content_url(self.baseUrl, pageUid), method="GET",
+                                       headers=headers, priority=priority, callback=self.parse_page_content)
 
-    def store_page_content_in_file(self, pageUid, data):
+    def closed(self, reason):
+        if self.pageContentProcessor is not None:
+            # waits for the workers to finish the pages they are processing
+            with sync_metrics.metrics_of_crawler(self.settings).phase("content_processor_close"):
+                self.pageContentProcessor.close()
+
+        stats = self.crawler.stats
+        if stats.get_value('onenote_rate_limiter/requests_over_budget'):
+            stats.inc_value('onenote_content/pages_deferred', sum(
+                1 for pageUid in self.pagesUids
+                if self.pagesDownloaded.get(pageUid) != self.alfred_data_dictionary[pageUid].lastModifiedDateTime))
+
+    async def parse_page_content(self, response):
         """
-        Stores content in an HTML file
+        Is used to parse page content and store it in the content store. Pages whose body and
+        subtitle did not change since they have been stored the last time are not stored again,
+        unless they are missing from the content store, e.g. because its files have been deleted.
+        The page is processed and stored by a worker thread, the callback waits until it is done.
         """
-        file_path = self.downloadFolderPath + pageUid + ".html"
+        pageUid = response.meta[types.PAGE_UID_KEY]
+        element = self.alfred_data_dictionary[pageUid]
+        version = self.pageContentVersions.get(pageUid)
+        stats = self.crawler.stats
+
+        if response.status == 304:  # Not modified
+            stats.inc_value('onenote_content/pages_not_modified')
+            stats.inc_value('onenote_content/bytes_saved', version.bodyLength if version is not None else 0)
+            self.pagesDownloaded[pageUid] = element.lastModifiedDateTime
+            return
+
+        etag = response.headers.get('ETag')
+        etag = etag.decode("latin-1") if etag is not None else None
+        bodyHash = content_versions.hash_body(response.body)
+        stats.inc_value('onenote_content/bytes_downloaded', len(response.body))
 
-        if not os.path.isdir(self.downloadFolderPath):
-            os.mkdir(self.downloadFolderPath)
+        if version is not None and version.bodyHash == bodyHash and version.subtitle == element.subtitle and \
+                self.contentStore.contains(pageUid):
+            stats.inc_value('onenote_content/pages_unchanged')
+            stats.inc_value('onenote_content/bytes_saved', len(response.body))
+        else:
+            bytesStored = await maybe_deferred_to_future(self.pageContentProcessor.process(
+                pageUid, response.body, response.encoding, element.subtitle))
+            stats.inc_value('onenote_content/pages_stored')
+            stats.inc_value('onenote_content/bytes_stored', bytesStored or 0)
 
-        with open(file_path, mode='w') as file:
-            file.write(data)
+        self.pageContentVersions.set(pageUid, content_versions.PageContentVersion(etag, bodyHash, len(response.body),
+                                                                                  element.subtitle))
+        self.pagesDownloaded[pageUid] = element.lastModifiedDateTime
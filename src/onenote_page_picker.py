@@ -0,0 +1,476 @@
+import mmap
+import os
+import random
+import struct
+from datetime import datetime, timezone
+
+import onenote_checkpoint as checkpoints
+import onenote_graph_api as graph_api
+import onenote_json
+import onenote_types as types
+
+PAGE_SAMPLING_INDEX_FILE = "pageSamplingIndex.bin"
+# the index file of the former versions, which had to be parsed completely for every pick
+LEGACY_PAGE_SAMPLING_INDEX_FILE = "pageSamplingIndex.json"
+RECENTLY_SHOWN_PAGES_FILE = "recentlyShownPages.json"
+
+# index file: header (magic, version, number of pages, length of the uids, length of the metadata),
+# the metadata (weighting, reference time and notebook weights) as JSON and the entries (cumulative
+# weight up to and including the page, weight of the page, uid padded with NUL bytes) sorted by uid
+SAMPLING_INDEX_HEADER = struct.Struct("<4sIIII")
+SAMPLING_INDEX_MAGIC = b"ONPS"
+SAMPLING_INDEX_VERSION = 2
+
+SECONDS_PER_DAY = 24 * 60 * 60
+# the recency weights grow with every half-life that passes after the index has been built, the
+# index is rebuilt (which moves the reference time to the present) before they could overflow
+MAX_RECENCY_WEIGHT = 2.0 ** 256
+MAX_PICK_ATTEMPTS = 16
+
+
+class FenwickTree(object):
+    """
+    Binary indexed tree over the weights of the pages, which updates a weight and finds the
+    position that a cumulative weight falls on in O(log n).
+    """
+
+    def __init__(self, weights: [float] = ()):
+        self.tree = [0.0] + [float(weight) for weight in weights]
+
+        # builds the tree in O(n) by adding every node to its parent
+        for index in range(1, len(self.tree)):
+            parentIndex = index + (index & -index)
+            if parentIndex < len(self.tree):
+                self.tree[parentIndex] += self.tree[index]
+
+    def __len__(self):
+        return len(self.tree) - 1
+
+    def append(self, weight: float):
+        index = len(self.tree)
+        lowestBit = index & -index
+        # the new node covers the weights of the positions index - lowestBit + 1 to index
+        self.tree.append(weight + self.prefix_sum(index - 1) - self.prefix_sum(index - lowestBit))
+
+    def add(self, position: int, delta: float):
+        index = position + 1
+        while index < len(self.tree):
+            self.tree[index] += delta
+            index += index & -index
+
+    def prefix_sum(self, count: int):
+        """
+        Returns the sum of the weights of the first `count` positions.
+        """
+        total = 0.0
+        while count > 0:
+            total += self.tree[count]
+            count -= count & -count
+
+        return total
+
+    def total(self):
+        return self.prefix_sum(len(self))
+
+    def find(self, value: float):
+        """
+        Returns the position whose range of cumulative weights contains the value, positions
+        with a weight of 0 are never returned for values below the total.
+        """
+        position = 0
+        step = 1 << (len(self).bit_length() - 1) if len(self) > 0 else 0
+
+        while step > 0:
+            if position + step < len(self.tree) and self.tree[position + step] <= value:
+                position += step
+                value -= self.tree[position]
+            step >>= 1
+
+        return position
+
+
+class PageWeighting(object):
+    """
+    How likely a page is picked: pages modified `recency_half_life_days` days earlier than another
+    page are picked half as often (all pages are equally likely if it is None), the pages of a
+    notebook are weighted by `notebook_weights` (notebook name or uid -> weight, 1 if the notebook
+    is not listed) and the last `exclude_recently_shown` picked pages are not picked again.
+    """
+
+    def __init__(self, recency_half_life_days: float = None, notebook_weights: {str, float} = None,
+                 exclude_recently_shown: int = 0):
+        self.recencyHalfLifeDays = recency_half_life_days
+        self.notebookWeights = notebook_weights or {}
+        self.excludeRecentlyShown = exclude_recently_shown
+
+    def notebook_weight(self, notebook: types.OneNoteElement):
+        if notebook is None:
+            return 1.0
+
+        return float(self.notebookWeights.get(notebook.uid, self.notebookWeights.get(notebook.title, 1.0)))
+
+    def recency_weight(self, lastModifiedDateTime: str, referenceTimestamp: float):
+        if self.recencyHalfLifeDays is None or not lastModifiedDateTime:
+            return 1.0
+
+        lastModifiedTimestamp = graph_api.parse_graph_date(lastModifiedDateTime).timestamp()
+        ageInDays = (referenceTimestamp - lastModifiedTimestamp) / SECONDS_PER_DAY
+        return 2.0 ** (-ageInDays / self.recencyHalfLifeDays)
+
+    def as_dict(self):
+        return {
+            'recencyHalfLifeDays': self.recencyHalfLifeDays,
+            'notebookWeights': self.notebookWeights,
+            'excludeRecentlyShown': self.excludeRecentlyShown,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['recencyHalfLifeDays'], data['notebookWeights'], data['excludeRecentlyShown'])
+
+
+class PageSamplingIndex(object):
+    """
+    The uids of all pages with their weights and a Fenwick tree over the weights, which picks a
+    page at random in O(log n) and is updated in O(log n) per modified or deleted page. The
+    positions of deleted pages get a weight of 0 and are reused by the next added page.
+
+    The index is stored without the tree, with the cumulative weights of the pages sorted by uid,
+    which `SamplingIndexFile` memory-maps and searches with a binary search to pick a page without
+    loading the index. The tree is rebuilt in O(n) when the sync loads the index, so that rounding
+    errors of the incremental updates do not accumulate.
+    """
+
+    def __init__(self, weighting: PageWeighting, reference_timestamp: float, pages_uids: [str] = (),
+                 weights: [float] = (), notebook_weights: {str, float} = None):
+        self.weighting = weighting
+        # the recency weights are relative to this time, which keeps them valid as time passes
+        self.referenceTimestamp = reference_timestamp
+        self.pagesUids: [str] = list(pages_uids)
+        self.weights: [float] = list(weights)
+        # the weight of every notebook when the index has been built, to notice renamed notebooks
+        self.notebookWeights: {str, float} = notebook_weights or {}
+        self.positions: {str, int} = {pageUid: position for position, pageUid in enumerate(self.pagesUids)
+                                      if pageUid is not None}
+        self.freePositions: [int] = [position for position, pageUid in enumerate(self.pagesUids) if pageUid is None]
+        self.tree = FenwickTree(self.weights)
+
+    @classmethod
+    def build(cls, alfred_data_dictionary: {str, types.OneNoteElement}, weighting: PageWeighting):
+        index = cls(weighting, datetime.now(timezone.utc).timestamp(),
+                    notebook_weights=notebook_weights(alfred_data_dictionary, weighting))
+        pagesUids = sorted(alfred_data_dictionary.uids_of_type(types.OneNoteType.PAGE))
+
+        index.pagesUids = pagesUids
+        index.weights = [index.page_weight(alfred_data_dictionary, pageUid) for pageUid in pagesUids]
+        index.positions = {pageUid: position for position, pageUid in enumerate(pagesUids)}
+        index.tree = FenwickTree(index.weights)
+
+        return index
+
+    def __len__(self):
+        return len(self.positions)
+
+    def page_weight(self, alfred_data_dictionary: {str, types.OneNoteElement}, pageUid: str):
+        page = alfred_data_dictionary[pageUid]
+
+        return self.weighting.notebook_weight(find_notebook(alfred_data_dictionary, page)) * \
+            self.weighting.recency_weight(page.lastModifiedDateTime, self.referenceTimestamp)
+
+    def needs_rebuild(self, alfred_data_dictionary: {str, types.OneNoteElement}, weighting: PageWeighting):
+        return self.weighting.as_dict() != weighting.as_dict() or \
+            self.notebookWeights != notebook_weights(alfred_data_dictionary, weighting) or \
+            any(weight > MAX_RECENCY_WEIGHT for weight in self.weights)
+
+    def update(self, alfred_data_dictionary: {str, types.OneNoteElement}, pages_modified: {str},
+               pages_deleted: {str}):
+        for pageUid in pages_deleted:
+            self.set_weight(pageUid, None)
+
+        for pageUid in pages_modified:
+            if pageUid in alfred_data_dictionary:
+                self.set_weight(pageUid, self.page_weight(alfred_data_dictionary, pageUid))
+
+    def set_weight(self, pageUid: str, weight: float):
+        """
+        Adds, updates or (with a weight of None) removes a page.
+        """
+        position = self.positions.get(pageUid)
+
+        if weight is None:
+            if position is None:
+                return
+            self.tree.add(position, -self.weights[position])
+            self.weights[position] = 0.0
+            self.pagesUids[position] = None
+            del self.positions[pageUid]
+            self.freePositions.append(position)
+            return
+
+        if position is None and self.freePositions:
+            position = self.freePositions.pop()
+            self.pagesUids[position] = pageUid
+            self.positions[pageUid] = position
+
+        if position is None:
+            self.positions[pageUid] = len(self.pagesUids)
+            self.pagesUids.append(pageUid)
+            self.weights.append(weight)
+            self.tree.append(weight)
+            return
+
+        self.tree.add(position, weight - self.weights[position])
+        self.weights[position] = weight
+
+    def pick(self, excluded_pages_uids: [str] = (), rng: random.Random = random):
+        """
+        Returns the uid of a page picked at random according to the weights or None if there is no
+        page to pick. The excluded pages are only left out as long as there are other pages.
+        """
+        excludedPositions = {self.positions[pageUid] for pageUid in excluded_pages_uids if pageUid in self.positions}
+        if len(excludedPositions) >= len(self.positions):
+            excludedPositions = set()
+
+        for position in excludedPositions:
+            self.tree.add(position, -self.weights[position])
+
+        try:
+            total = self.tree.total()
+
+            # rounding errors of the tree can let a value fall on the end of the tree or on an excluded page
+            for _ in range(MAX_PICK_ATTEMPTS):
+                if total <= 0:
+                    return None
+
+                position = self.tree.find(rng.random() * total)
+                if position < len(self.pagesUids) and self.pagesUids[position] is not None and \
+                        position not in excludedPositions:
+                    return self.pagesUids[position]
+
+            return None
+        finally:
+            for position in excludedPositions:
+                self.tree.add(position, self.weights[position])
+
+    def store_in_file(self, file_path: str):
+        pages = sorted((pageUid.encode("utf-8"), self.weights[position])
+                       for pageUid, position in self.positions.items())
+        uidLength = max((len(uid) for uid, weight in pages), default=0)
+        metadata = onenote_json.dumps({
+            'weighting': self.weighting.as_dict(),
+            'referenceTimestamp': self.referenceTimestamp,
+            'notebookWeights': self.notebookWeights,
+        }).encode("utf-8")
+
+        data = bytearray(SAMPLING_INDEX_HEADER.pack(SAMPLING_INDEX_MAGIC, SAMPLING_INDEX_VERSION, len(pages), uidLength,
+                                                    len(metadata)))
+        data += metadata
+        entry = sampling_index_entry(uidLength)
+        cumulativeWeight = 0.0
+        for uid, weight in pages:
+            cumulativeWeight += weight
+            data += entry.pack(cumulativeWeight, weight, uid)
+
+        checkpoints.write_file_atomically(file_path, bytes(data))
+
+    @classmethod
+    def load_from_file(cls, file_path: str):
+        """
+        Returns the index stored in the file or None if there is none or it has an older format.
+        """
+        if not os.path.isfile(file_path):
+            return None
+
+        with open(file_path, "rb") as file:
+            data = file.read()
+
+        magic, version, count, uidLength, metadataLength = SAMPLING_INDEX_HEADER.unpack_from(data, 0)
+        if magic != SAMPLING_INDEX_MAGIC or version != SAMPLING_INDEX_VERSION:
+            return None
+
+        entriesStart = SAMPLING_INDEX_HEADER.size + metadataLength
+        metadata = onenote_json.loads(data[SAMPLING_INDEX_HEADER.size:entriesStart])
+        entry = sampling_index_entry(uidLength)
+        entries = list(entry.iter_unpack(data[entriesStart:entriesStart + count * entry.size]))
+
+        return cls(PageWeighting.from_dict(metadata['weighting']), metadata['referenceTimestamp'],
+                   [uid.rstrip(b"\0").decode("utf-8") for cumulativeWeight, weight, uid in entries],
+                   [weight for cumulativeWeight, weight, uid in entries], metadata['notebookWeights'])
+
+
+class SamplingIndexFile(object):
+    """
+    Read-only view of a stored page sampling index, which is memory-mapped and picks a page with a
+    binary search over the cumulative weights in O(log n) instead of being loaded, e.g. for a
+    script filter that shows one page.
+    """
+
+    def __init__(self, file_path: str):
+        with open(file_path, mode='rb') as file:
+            self.index = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.count, self.uidLength, metadataLength = SAMPLING_INDEX_HEADER.unpack_from(self.index, 0)
+        if magic != SAMPLING_INDEX_MAGIC or version != SAMPLING_INDEX_VERSION:
+            self.index.close()
+            raise ValueError("Not a page sampling index: " + file_path)
+
+        self.entriesStart = SAMPLING_INDEX_HEADER.size + metadataLength
+        metadata = onenote_json.loads(self.index[SAMPLING_INDEX_HEADER.size:self.entriesStart])
+        self.weighting = PageWeighting.from_dict(metadata['weighting'])
+        self.entry = sampling_index_entry(self.uidLength)
+
+    def __len__(self):
+        return self.count
+
+    def read_entry(self, position: int):
+        """
+        Returns the cumulative weight, the weight and the uid of the page at the position.
+        """
+        return self.entry.unpack_from(self.index, self.entriesStart + position * self.entry.size)
+
+    def cumulative_weight(self, position: int):
+        return self.read_entry(position)[0] if position >= 0 else 0.0
+
+    def total(self):
+        return self.cumulative_weight(self.count - 1)
+
+    def find(self, value: float):
+        """
+        Returns the position whose range of cumulative weights contains the value, positions
+        with a weight of 0 are never returned for values below the total.
+        """
+        low = 0
+        high = self.count
+
+        while low < high:
+            middle = (low + high) // 2
+            if self.read_entry(middle)[0] <= value:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def position_of(self, pageUid: str):
+        uid = pageUid.encode("utf-8")
+        if len(uid) > self.uidLength:
+            return None
+
+        uid = uid.ljust(self.uidLength, b"\0")
+        low = 0
+        high = self.count
+
+        while low < high:
+            middle = (low + high) // 2
+            entryUid = self.read_entry(middle)[2]
+
+            if entryUid == uid:
+                return middle
+            if entryUid < uid:
+                low = middle + 1
+            else:
+                high = middle
+
+        return None
+
+    def pick(self, excluded_pages_uids: [str] = (), rng: random.Random = random):
+        """
+        Returns the uid of a page picked at random according to the weights or None if there is no
+        page to pick. The excluded pages are only left out as long as there are other pages.
+        """
+        excludedPositions = {self.position_of(pageUid) for pageUid in excluded_pages_uids} - {None}
+        if len(excludedPositions) >= self.count:
+            excludedPositions = set()
+
+        # the ranges of cumulative weights of the excluded pages, which the picked value skips
+        excludedRanges = [(self.cumulative_weight(position - 1), self.read_entry(position)[1])
+                          for position in sorted(excludedPositions)]
+        total = self.total() - sum(weight for start, weight in excludedRanges)
+
+        # rounding errors can let a value fall on the end of the index or on an excluded page
+        for _ in range(MAX_PICK_ATTEMPTS):
+            if total <= 0:
+                return None
+
+            value = rng.random() * total
+            for start, weight in excludedRanges:
+                if value < start:
+                    break
+                value += weight
+
+            position = self.find(value)
+            if position < self.count and position not in excludedPositions:
+                return self.read_entry(position)[2].rstrip(b"\0").decode("utf-8")
+
+        return None
+
+    def close(self):
+        self.index.close()
+
+
+def sampling_index_entry(uidLength: int):
+    return struct.Struct("<dd{}s".format(uidLength))
+
+
+def find_notebook(alfred_data_dictionary: {str, types.OneNoteElement}, element: types.OneNoteElement):
+    while element is not None and element.onenoteType != types.OneNoteType.NOTEBOOK:
+        element = alfred_data_dictionary.get(element.parentUid)
+
+    return element
+
+
+def notebook_weights(alfred_data_dictionary: {str, types.OneNoteElement}, weighting: PageWeighting):
+    return {notebookUid: weighting.notebook_weight(alfred_data_dictionary[notebookUid])
+            for notebookUid in alfred_data_dictionary.uids_of_type(types.OneNoteType.NOTEBOOK)}
+
+
+def update_sampling_index(file_path: str, alfred_data_dictionary: {str, types.OneNoteElement},
+                          weighting: PageWeighting, pages_modified: {str}, pages_deleted: {str}):
+    """
+    Updates the stored index with the pages modified and deleted by a sync. It is rebuilt from all
+    pages if it does not exist yet or the weights of all pages have to be recomputed.
+    """
+    index = PageSamplingIndex.load_from_file(file_path)
+
+    legacyFilePath = os.path.join(os.path.dirname(file_path), LEGACY_PAGE_SAMPLING_INDEX_FILE)
+    if os.path.isfile(legacyFilePath):
+        os.remove(legacyFilePath)
+
+    if index is None or index.needs_rebuild(alfred_data_dictionary, weighting):
+        index = PageSamplingIndex.build(alfred_data_dictionary, weighting)
+    else:
+        index.update(alfred_data_dictionary, pages_modified, pages_deleted)
+
+    index.store_in_file(file_path)
+    return index
+
+
+def load_recently_shown_pages(file_path: str):
+    if not os.path.isfile(file_path):
+        return []
+
+    with open(file_path, "rb") as file:
+        return onenote_json.loads(file.read())
+
+
+def pick_page(index_file_path: str, recently_shown_file_path: str, rng: random.Random = random):
+    """
+    Picks a page from the stored index and remembers it as shown. Returns None if there is no index or no page.
+    """
+    if not os.path.isfile(index_file_path):
+        return None
+
+    index = SamplingIndexFile(index_file_path)
+    try:
+        excludeRecentlyShown = index.weighting.excludeRecentlyShown
+        recentlyShownPagesUids = load_recently_shown_pages(recently_shown_file_path) \
+            if excludeRecentlyShown > 0 else []
+        pageUid = index.pick(recentlyShownPagesUids, rng)
+    finally:
+        index.close()
+
+    if pageUid is not None and excludeRecentlyShown > 0:
+        recentlyShownPagesUids = (recentlyShownPagesUids + [pageUid])[-excludeRecentlyShown:]
+        checkpoints.write_file_atomically(recently_shown_file_path, onenote_json.dumps(recentlyShownPagesUids))
+
+    return pageUid
@@ -0,0 +1,74 @@
+import codecs
+import html
+import re
+
+# "<head>" is removed and "</head>" is replaced by the subtitle in one pass over the page
+HEAD_TAGS_PATTERN = re.compile(r"<head>|</head>")
+IMAGE_TAG_PATTERN = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+INVISIBLE_ELEMENTS_PATTERN = re.compile(r"<(script|style)\b[^>]*>.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+BLOCK_TAG_PATTERN = re.compile(r"</?(p|div|br|li|tr|h[1-6])\b[^>]*>", re.IGNORECASE)
+TAG_PATTERN = re.compile(r"<[^>]+>")
+BLANK_LINES_PATTERN = re.compile(r"\s*\n\s*")
+# the pages are decoded and transformed in chunks of this many bytes
+CHUNK_SIZE = 64 * 1024
+
+
+def transform_page_content(pageContent: str, subtitle: str, strip_images: bool = False):
+    """
+    Removes the head-tag so that the information existing in head is also indexed by spotlight
+    and adds the subtitle of the page in its place, so that the page can also be found based on
+    the names of its parent elements. Images (which may be embedded as base64 data) are removed
+    if `strip_images` is set.
+    """
+    subtitle = subtitle or ""
+    pageContent = HEAD_TAGS_PATTERN.sub(lambda match: "" if match.group() == "<head>" else subtitle, pageContent)
+
+    if strip_images:
+        pageContent = IMAGE_TAG_PATTERN.sub("", pageContent)
+
+    return pageContent
+
+
+def transform_page_content_chunks(body: bytes, encoding: str, subtitle: str, strip_images: bool = False):
+    """
+    Decodes and transforms the page like `transform_page_content`, but chunk by chunk, so that the
+    transformed chunks can be written into the content store without the whole page being decoded
+    and copied by every transformation. A tag that is split between two chunks (e.g. an image with
+    base64 data) is held back until it is complete, as the patterns only match whole tags.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    body = memoryview(body)
+    # the parts of a tag that has not been closed yet
+    openTagParts = []
+
+    for start in range(0, len(body) + 1, CHUNK_SIZE):
+        final = start + CHUNK_SIZE > len(body)
+        text = decoder.decode(body[start:start + CHUNK_SIZE], final)
+
+        if not final and openTagParts and "<" not in text and ">" not in text:
+            openTagParts.append(text)
+            continue
+
+        if openTagParts:
+            text = "".join(openTagParts) + text
+            openTagParts = []
+
+        end = len(text)
+        openTagStart = text.rfind("<")
+        if not final and openTagStart >= 0 and text.find(">", openTagStart) < 0:
+            end = openTagStart
+            openTagParts.append(text[openTagStart:])
+
+        if end > 0:
+            yield transform_page_content(text[:end], subtitle, strip_images)
+
+
+def extract_text(pageContent: str):
+    """
+    Returns the text of an HTML page without tags, one line per paragraph.
+    """
+    text = INVISIBLE_ELEMENTS_PATTERN.sub("", pageContent)
+    text = BLOCK_TAG_PATTERN.sub("\n", text)
+    text = TAG_PATTERN.sub("", text)
+
+    return BLANK_LINES_PATTERN.sub("\n", html.unescape(text)).strip()
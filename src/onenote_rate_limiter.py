@@ -0,0 +1,202 @@
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from scrapy.exceptions import IgnoreRequest
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet import reactor, task
+
+import onenote_types as types
+
+# documented OneNote service limits of the Graph API: (number of requests, window in seconds)
+# https://docs.microsoft.com/en-us/graph/throttling#onenote-service-limits
+ONENOTE_SERVICE_LIMITS = ((120, 60), (400, 60 * 60))
+
+DEFAULT_RATE_LIMITER_KEY = "default"
+
+# signal sent with the arguments response, request and spider for every `429 - Too many requests` that is retried,
+# also for the sub-requests of a batch request, as the retried responses never reach `signals.response_received`
+response_throttled = object()
+
+
+class TokenBucket(object):
+    """
+    A token bucket holding up to `capacity` tokens that is refilled continuously so that
+    it regains its full capacity within `period` seconds. Reservations are allowed to
+    drive the bucket negative, the deficit then is the time a caller has to wait.
+    """
+
+    def __init__(self, capacity: int, period: float, now: float):
+        self.capacity = float(capacity)
+        self.rate = capacity / float(period)
+        self.tokens = float(capacity)
+        self.lastRefill = now
+
+    def refill(self, now: float):
+        elapsed = now - self.lastRefill
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.lastRefill = now
+
+    def reserve(self, now: float, count: int = 1):
+        """
+        Takes `count` tokens out of the bucket and returns the seconds to wait until the tokens
+        are actually available.
+        """
+        self.refill(now)
+        self.tokens -= count
+
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def drain(self, now: float):
+        self.refill(now)
+        self.tokens = min(self.tokens, 0.0)
+
+
+class QuotaRateLimiter(object):
+    """
+    Paces requests against several token buckets at once (one per quota window) and
+    additionally blocks all requests for the time the server asked for with `Retry-After`.
+    The limiter never sleeps itself, it only tells the caller how long to wait.
+    """
+
+    def __init__(self, limits=ONENOTE_SERVICE_LIMITS, clock=time.monotonic):
+        self.clock = clock
+        now = self.clock()
+        self.buckets = [TokenBucket(capacity, period, now) for capacity, period in limits]
+        self.blockedUntil = now
+        self.waitingUntil = now
+
+    def reserve(self, count: int = 1):
+        """
+        Reserves slots for `count` requests (e.g. the sub-requests of a batch request) and returns
+        the seconds the request has to be delayed.
+        """
+        now = self.clock()
+        delay = max(bucket.reserve(now, count) for bucket in self.buckets)
+
+        return max(delay, self.blocked_delay(now))
+
+    def blocked_delay(self, now: float = None):
+        now = self.clock() if now is None else now
+        return max(0.0, self.blockedUntil - now)
+
+    def block_for(self, seconds: float):
+        """
+        Blocks all requests for the passed in number of seconds. This is used when
+        the server answered with `429 - Too many requests`.
+
+        Returns the seconds by which the requests are blocked longer than before, so that the wall-clock
+        time of overlapping blocks (e.g. of several requests throttled at once) is only counted once.
+        """
+        now = self.clock()
+        blockedUntil = max(self.blockedUntil, now + seconds)
+        extendedSeconds = blockedUntil - max(self.blockedUntil, now)
+        self.blockedUntil = blockedUntil
+
+        for bucket in self.buckets:
+            bucket.drain(now)
+
+        return extendedSeconds
+
+    def wait_for(self, seconds: float):
+        """
+        Records that a request waits the passed in number of seconds from now on and returns the seconds by
+        which the time any request is waiting got longer, so that requests waiting at once are only counted once.
+        """
+        now = self.clock()
+        waitingUntil = max(self.waitingUntil, now + seconds)
+        extendedSeconds = waitingUntil - max(self.waitingUntil, now)
+        self.waitingUntil = waitingUntil
+
+        return extendedSeconds
+
+
+_rate_limiters: {str, QuotaRateLimiter} = {}
+
+
+def get_rate_limiter(key: str = DEFAULT_RATE_LIMITER_KEY, limits=ONENOTE_SERVICE_LIMITS):
+    """
+    Returns the rate limiter registered for the key. The limiters are shared between all
+    crawlers of the process so that subsequent crawls continue with the current quota state.
+    """
+    if key not in _rate_limiters:
+        _rate_limiters[key] = QuotaRateLimiter(limits)
+
+    return _rate_limiters[key]
+
+
+def rate_limiter_of_crawler(settings):
+    """
+    Returns the rate limiter of a crawler, which is shared by all crawlers with the same `ONENOTE_RATE_LIMITER_KEY`.
+    The limits can be changed with `ONENOTE_RATE_LIMITS`, e.g. for a local stand-in of the Graph API.
+    """
+    limits = tuple(tuple(limit) for limit in settings.getlist('ONENOTE_RATE_LIMITS', ONENOTE_SERVICE_LIMITS))
+
+    return get_rate_limiter(settings.get('ONENOTE_RATE_LIMITER_KEY', DEFAULT_RATE_LIMITER_KEY), limits)
+
+
+def parse_retry_after(headers):
+    """
+    Returns the seconds to wait as requested by the server with the `Retry-After` header,
+    which either holds a number of seconds or a date. Returns None if the header is missing.
+    """
+    retryAfter = headers.get('Retry-After')
+    if not retryAfter:
+        return None
+
+    retryAfter = retryAfter.decode('latin-1').strip()
+    if retryAfter.isdigit():
+        return int(retryAfter)
+
+    try:
+        retryDate = parsedate_to_datetime(retryAfter)
+        return max(0, (retryDate - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def sleep(seconds: float):
+    """
+    Returns a deferred that fires after the passed in seconds without blocking the reactor.
+    """
+    return maybe_deferred_to_future(task.deferLater(reactor, seconds, lambda: None))
+
+
+class QuotaRateLimiterMiddleware(object):
+    """
+    Downloader middleware that delays every request until the shared rate limiter has a
+    free slot for it. Waiting is done with deferreds so that the reactor keeps running.
+
+    A spider with a `requestBudget` attribute other than None only gets that many requests
+    (retries included) through, the requests beyond it are ignored without being sent.
+    """
+
+    def __init__(self, crawler, rate_limiter: QuotaRateLimiter):
+        self.crawler = crawler
+        self.rateLimiter = rate_limiter
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler, rate_limiter_of_crawler(crawler.settings))
+
+    async def process_request(self, request, spider):
+        cost = request.meta.get(types.REQUEST_COST_KEY, 1)
+        requestBudget = getattr(spider, 'requestBudget', None)
+        if requestBudget is not None and \
+                self.crawler.stats.get_value('onenote_rate_limiter/requests', 0) + cost > requestBudget:
+            self.crawler.stats.inc_value('onenote_rate_limiter/requests_over_budget', cost)
+            raise IgnoreRequest("The request budget is used up")
+
+        # a batch request counts as many requests as it contains, like it does for the service limits
+        self.crawler.stats.inc_value('onenote_rate_limiter/requests', cost)
+        delay = self.rateLimiter.reserve(cost)
+        if delay > 0:
+            self.crawler.stats.inc_value('onenote_rate_limiter/delayed_requests')
+
+        # the limiter can get blocked by a 429 while this request is waiting, therefore
+        # the block is checked again after every wait
+        while delay > 0:
+            self.crawler.stats.inc_value('onenote_rate_limiter/delay_seconds', self.rateLimiter.wait_for(delay))
+            await sleep(delay)
+            delay = self.rateLimiter.blocked_delay()
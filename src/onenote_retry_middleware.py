@@ -1,14 +1,18 @@
 from datetime import datetime
 
-import time
 from scrapy.downloadermiddlewares.retry import RetryMiddleware
 from scrapy.utils.response import response_status_message
 
+import auth_token_request as req
+import onenote_rate_limiter as rate_limiter
+import onenote_sync_metrics as sync_metrics
+
 
 class TooManyRequestsRetryMiddleware(RetryMiddleware):
     def __init__(self, crawler):
         super(TooManyRequestsRetryMiddleware, self).__init__(crawler.settings)
         self.crawler = crawler
+        self.rateLimiter = rate_limiter.rate_limiter_of_crawler(crawler.settings)
         self.last429Error = datetime.strptime('2000-01-01T00:00:00.000', "%Y-%m-%dT%H:%M:%S.%f")
 
     @classmethod
@@ -20,22 +24,44 @@ class TooManyRequestsRetryMiddleware(RetryMiddleware):
             return response
 
         if response.status == 429:  # Too many requests
-            secondsSinceLast429Error = (datetime.now() - self.last429Error).total_seconds()
-
-            self.crawler.engine.pause()
+            waitingTime = self.retry_after_in_seconds(response)
 
-            if secondsSinceLast429Error > 70:
-                print("429 occurred. Waiting for 60 seconds before continuing.")
-                time.sleep(60)  # Sleep 60 seconds.
-            else:
-                print("429 occurred. Waiting for 60 minutes before continuing.")
-                time.sleep(60 * 60)  # Sleep 1 hour.
-
-            self.crawler.engine.unpause()
+            print("429 occurred. Delaying all requests for {} seconds before continuing.".format(waitingTime))
+            throttledSeconds = self.rateLimiter.block_for(waitingTime)
+            self.crawler.stats.inc_value('onenote_rate_limiter/throttled_seconds', throttledSeconds)
             self.last429Error = datetime.now()
+            self.crawler.signals.send_catch_log(signal=rate_limiter.response_throttled, response=response,
+                                                request=request, spider=spider)
+
+        if response.status == 401 and isinstance(request, req.AuthTokenRequest):  # Unauthorized
+            request.invalidate_authorization_token()
 
         if response.status in self.retry_http_codes:
             reason = response_status_message(response.status)
-            return self._retry(request, reason, spider) or response
+            retryRequest = self._retry(request, reason, spider)
+            if retryRequest is None:
+                return response
+
+            # the retried response never reaches signals.response_received
+            self.crawler.signals.send_catch_log(signal=sync_metrics.response_observed, response=response,
+                                                request=request, latency=request.meta.get('download_latency'),
+                                                downloaded=True, spider=spider)
+            return retryRequest
 
         return response
+
+    def retry_after_in_seconds(self, response):
+        """
+        Returns the time to wait as requested by the server with the `Retry-After` header.
+        If the header is missing, it waits for 60 seconds or for 60 minutes in case the
+        last 429 error has been thrown during the last 70 seconds.
+        """
+        retryAfter = rate_limiter.parse_retry_after(response.headers)
+        if retryAfter is not None:
+            return retryAfter
+
+        secondsSinceLast429Error = (datetime.now() - self.last429Error).total_seconds()
+        if secondsSinceLast429Error > 70:
+            return 60
+
+        return 60 * 60
@@ -0,0 +1,143 @@
+import sqlite3
+
+import onenote_fts_query as fts_query
+import onenote_page_text as page_text
+import onenote_types as types
+
+SEARCH_INDEX_DATABASE = "pageSearchIndex.sqlite"
+
+# the ranking weights of the columns of the full-text table: title, path (the subtitle of the page) and text
+TITLE_WEIGHT = 10.0
+PATH_WEIGHT = 3.0
+TEXT_WEIGHT = 1.0
+SNIPPET_TOKENS = 12
+
+
+class PageSearchIndex(object):
+    """
+    Full-text index over the title, the path and the text of the stored pages in an SQLite FTS5
+    table, which keeps the postings of every term on disk so that a query only reads the postings
+    of its terms. Pages are added, replaced and deleted one by one, the index is never rebuilt.
+
+    Next to the full-text table, the table `documents` maps the uid of every page to the rowid of
+    its row in the full-text table and to the signature of the indexed version of the page.
+    """
+
+    def __init__(self, file_path: str, read_only: bool = False):
+        self.filePath = file_path
+
+        if read_only:
+            self.connection = sqlite3.connect("file:{}?mode=ro".format(file_path), uri=True)
+        else:
+            self.connection = sqlite3.connect(file_path)
+            self.create_schema()
+
+    def create_schema(self):
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    uid TEXT NOT NULL UNIQUE,
+                    signature TEXT
+                )""")
+            self.connection.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(
+                    title, path, text, tokenize = 'unicode61 remove_diacritics 2'
+                )""")
+
+    def is_empty(self):
+        return self.connection.execute("SELECT 1 FROM documents LIMIT 1").fetchone() is None
+
+    def signature(self, pageUid: str):
+        row = self.connection.execute("SELECT signature FROM documents WHERE uid = ?", (pageUid,)).fetchone()
+
+        return row[0] if row is not None else None
+
+    def index_page(self, pageUid: str, title: str, path: str, text: str, signature: str = None):
+        """
+        Adds the page or replaces its indexed version. Must be called within a transaction.
+        """
+        self.delete_pages([pageUid])
+
+        documentId = self.connection.execute("INSERT INTO documents (uid, signature) VALUES (?, ?)",
+                                             (pageUid, signature)).lastrowid
+        self.connection.execute("INSERT INTO pages (rowid, title, path, text) VALUES (?, ?, ?, ?)",
+                                (documentId, title or "", path or "", text or ""))
+
+    def delete_pages(self, pagesUids: [str]):
+        for pageUid in pagesUids:
+            row = self.connection.execute("SELECT id FROM documents WHERE uid = ?", (pageUid,)).fetchone()
+            if row is None:
+                continue
+
+            self.connection.execute("DELETE FROM pages WHERE rowid = ?", row)
+            self.connection.execute("DELETE FROM documents WHERE id = ?", row)
+
+    def search(self, query: str, limit: int = 20):
+        """
+        Returns the uids of the best matching pages together with a snippet of their text. All
+        words of the query have to match, the last one as a prefix as it may not be typed completely.
+        """
+        matchExpression = fts_query.build_match_expression(query)
+        if matchExpression is None:
+            return []
+
+        return self.connection.execute("""
+            SELECT documents.uid, snippet(pages, -1, '', '', '...', {})
+            FROM pages JOIN documents ON documents.id = pages.rowid
+            WHERE pages MATCH ?
+            ORDER BY bm25(pages, {}, {}, {})
+            LIMIT ?""".format(SNIPPET_TOKENS, TITLE_WEIGHT, PATH_WEIGHT, TEXT_WEIGHT),
+                                       (matchExpression, limit)).fetchall()
+
+    def optimize(self):
+        """
+        Merges the segments of the full-text index, which makes it smaller and queries faster.
+        """
+        with self.connection:
+            self.connection.execute("INSERT INTO pages (pages) VALUES ('optimize')")
+
+    def close(self):
+        self.connection.close()
+
+
+def page_signature(page: types.OneNoteElement, version):
+    """
+    Identifies the indexed version of a page by the hash of its downloaded body, its title and its path.
+    """
+    if version is None:
+        return None
+
+    return "{}\n{}\n{}".format(version.bodyHash, page.title, page.subtitle)
+
+
+def update_search_index(search_index: PageSearchIndex, content_store,
+                        alfred_data_dictionary: {str, types.OneNoteElement}, page_content_versions,
+                        pages_modified: {str}, pages_deleted: {str}):
+    """
+    Indexes the modified pages whose content, title or path changed since they have been indexed and
+    removes the deleted pages. An empty index is filled with all the stored pages once.
+    """
+    isInitialBuild = search_index.is_empty()
+    pagesUids = alfred_data_dictionary.uids_of_type(types.OneNoteType.PAGE) if isInitialBuild else pages_modified
+
+    with search_index.connection:
+        search_index.delete_pages(pages_deleted)
+
+        for pageUid in pagesUids:
+            page = alfred_data_dictionary.get(pageUid)
+            if page is None:
+                continue
+
+            signature = page_signature(page, page_content_versions.get(pageUid))
+            if signature is not None and signature == search_index.signature(pageUid):
+                continue
+
+            content = content_store.read(pageUid)
+            if content is None:
+                continue
+
+            search_index.index_page(pageUid, page.title, page.subtitle, page_text.extract_text(content), signature)
+
+    if isInitialBuild:
+        search_index.optimize()
@@ -0,0 +1,8 @@
+# the names of the files of the synced data, which are shared by the sync and the tools reading the synced data,
+# so that the tools do not have to import main.py and the modules of the sync
+LAST_SYNC_DATE_FILE = "lastSyncDate.txt"
+ONENOTE_ELEMENTS_FILE = "onenoteElements.json"
+ONENOTE_ELEMENTS_DATABASE = "onenoteElements.sqlite"
+PAGE_CONTENT_FOLDER = "./page-content/"
+PAGE_CONTENT_PACK_FOLDER = "./page-content-pack/"
+SYNC_CHECKPOINT_FILE = "syncCheckpoint.json"
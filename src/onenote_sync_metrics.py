@@ -0,0 +1,391 @@
+import bisect
+import collections
+import contextlib
+import json
+import time
+from datetime import datetime
+
+import onenote_checkpoint as checkpoints
+import onenote_graph_api as graph_api
+import onenote_types as types
+
+JSON_FORMAT = "json"
+PROMETHEUS_FORMAT = "prometheus"
+PROMETHEUS_PREFIX = "onenote_sync_"
+
+# upper bounds of the buckets of the latency histograms in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# signal sent with the arguments response, request, latency, downloaded and spider for the responses that do not
+# reach signals.response_received: the responses of retried requests and the sub-responses of batch requests,
+# which have the latency of their batch request and whose bytes are downloaded with it
+response_observed = object()
+
+# crawler stats that are added up over all crawlers of a sync: stat -> metric
+CRAWLER_STATS_METRICS = {
+    'onenote_rate_limiter/requests': 'graph_requests',
+    'onenote_rate_limiter/delayed_requests': 'paced_requests',
+    'onenote_rate_limiter/delay_seconds': 'paced_seconds',
+    'onenote_rate_limiter/throttled_seconds': 'throttled_seconds',
+    'onenote_aimd/decreases': 'concurrency_decreases',
+    'onenote_content/bytes_stored': 'stored_bytes',
+    'onenote_content/bytes_saved': 'saved_bytes',
+    'onenote_content/pages_stored': 'pages_stored',
+    'onenote_content/pages_unchanged': 'pages_unchanged',
+    'onenote_content/pages_not_modified': 'pages_not_modified',
+    'retry/count': 'retries',
+}
+# crawler stats whose last part is the status of a response: prefix -> metric
+CRAWLER_STATUS_STATS_METRICS = {
+    'downloader/response_status_count/': 'responses',
+    'onenote_batch/response_status_count/': 'batched_responses',
+}
+
+
+class LatencyHistogram(object):
+    """
+    Counts the latencies in buckets with fixed upper bounds, like a Prometheus histogram, so that
+    the distribution of thousands of requests takes a few numbers.
+    """
+
+    def __init__(self, buckets: (float) = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bucketCounts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.bucketCounts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative_counts(self):
+        """
+        Returns the pairs of the upper bound of every bucket (the last one is infinite) and the number of
+        latencies up to it.
+        """
+        cumulativeCount = 0
+        for upperBound, bucketCount in zip(self.buckets + (float("inf"),), self.bucketCounts):
+            cumulativeCount += bucketCount
+            yield upperBound, cumulativeCount
+
+    def quantile(self, q: float):
+        """
+        Returns the upper bound of the bucket that holds the quantile, None if nothing has been observed.
+        """
+        if not self.count:
+            return None
+
+        for upperBound, cumulativeCount in self.cumulative_counts():
+            if cumulativeCount >= q * self.count:
+                return upperBound
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": {format_bound(upperBound): cumulativeCount
+                        for upperBound, cumulativeCount in self.cumulative_counts()},
+        }
+
+
+class QuotaWindowUsage(object):
+    """
+    Tracks the requests sent within a sliding window of one quota and the most of them at any time,
+    which shows how close a sync came to the limit.
+    """
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.period = period
+        self.sentRequests = collections.deque()
+        self.requestsInWindow = 0
+        self.peakRequests = 0
+
+    def add(self, now: float, count: int = 1):
+        self.sentRequests.append((now, count))
+        self.requestsInWindow += count
+
+        while self.sentRequests[0][0] <= now - self.period:
+            self.requestsInWindow -= self.sentRequests.popleft()[1]
+
+        self.peakRequests = max(self.peakRequests, self.requestsInWindow)
+
+    def as_dict(self):
+        return {"capacity": self.capacity, "periodSeconds": self.period, "peakRequests": self.peakRequests}
+
+
+class SyncMetrics(object):
+    """
+    The metrics of one sync: values such as the number of requests or bytes, values per label such
+    as the responses per status, the latency histograms per endpoint of the Graph API, the usage of
+    the quota windows and the time spent in the phases of the sync, e.g. loading and saving the stores.
+    They are collected by the sync, the spiders and the `SyncMetricsExtension` and written into a
+    JSON or Prometheus text file once the sync is done.
+    """
+
+    def __init__(self):
+        self.startedAt = None
+        self.startTime = None
+        self.values: {str, float} = {}
+        self.labeledValues: {str, (str, dict)} = {}
+        self.latencies: {str, LatencyHistogram} = {}
+        self.quotaWindows: [QuotaWindowUsage] = []
+        self.phases: {str, (int, float)} = {}
+
+    def start(self):
+        self.startedAt = datetime.now().astimezone().isoformat()
+        self.startTime = time.perf_counter()
+
+    def seconds(self):
+        return time.perf_counter() - self.startTime if self.startTime is not None else 0.0
+
+    def inc_value(self, name: str, value: float = 1):
+        self.values[name] = self.values.get(name, 0) + value
+
+    def set_value(self, name: str, value: float):
+        self.values[name] = value
+
+    def inc_labeled_value(self, name: str, label: str, labelValue: str, value: float = 1):
+        _, valuesByLabel = self.labeledValues.setdefault(name, (label, {}))
+        valuesByLabel[labelValue] = valuesByLabel.get(labelValue, 0) + value
+
+    def observe_latency(self, endpoint: str, seconds: float):
+        if endpoint not in self.latencies:
+            self.latencies[endpoint] = LatencyHistogram()
+
+        self.latencies[endpoint].observe(seconds)
+
+    def track_quota(self, limits):
+        """
+        Starts tracking the usage of the quota windows, unless another crawler of the sync already did.
+        """
+        if not self.quotaWindows:
+            self.quotaWindows = [QuotaWindowUsage(capacity, period) for capacity, period in limits]
+
+    def add_requests_to_quota(self, count: int = 1):
+        now = time.monotonic()
+        for quotaWindow in self.quotaWindows:
+            quotaWindow.add(now, count)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """
+        Adds the time spent in the `with` block to the phase, the phases that run several times per sync
+        (e.g. saving the elements with every checkpoint) are added up.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            calls, seconds = self.phases.get(name, (0, 0.0))
+            self.phases[name] = (calls + 1, seconds + time.perf_counter() - start)
+
+    def add_crawler_stats(self, stats: dict):
+        for stat, metric in CRAWLER_STATS_METRICS.items():
+            if stat in stats:
+                self.inc_value(metric, stats[stat])
+
+        for stat, value in stats.items():
+            for prefix, metric in CRAWLER_STATUS_STATS_METRICS.items():
+                if stat.startswith(prefix):
+                    self.inc_labeled_value(metric, "status", stat[len(prefix):], value)
+
+    def as_dict(self):
+        data = {"startedAt": self.startedAt, "seconds": self.seconds()}
+        data.update(self.values)
+        data.update({name: dict(valuesByLabel) for name, (_, valuesByLabel) in self.labeledValues.items()})
+        data["latencySeconds"] = {endpoint: histogram.as_dict() for endpoint, histogram in self.latencies.items()}
+        data["quotaWindows"] = [quotaWindow.as_dict() for quotaWindow in self.quotaWindows]
+        data["phases"] = {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in self.phases.items()}
+
+        return data
+
+    def as_prometheus_text(self):
+        """
+        Returns the metrics in the Prometheus text format, e.g. for the textfile collector of the node
+        exporter. As the file describes the last sync, all values are gauges.
+        """
+        lines = []
+
+        def add_metric(name: str, metricType: str, samples):
+            lines.append("# TYPE {}{} {}".format(PROMETHEUS_PREFIX, name, metricType))
+            for suffix, labels, value in samples:
+                lines.append("{}{}{}{} {}".format(PROMETHEUS_PREFIX, name, suffix, format_labels(labels),
+                                                  format_value(value)))
+
+        add_metric("seconds", "gauge", [("", {}, self.seconds())])
+        for name, value in sorted(self.values.items()):
+            add_metric(name, "gauge", [("", {}, value)])
+
+        for name, (label, valuesByLabel) in sorted(self.labeledValues.items()):
+            add_metric(name, "gauge", [("", {label: labelValue}, value)
+                                       for labelValue, value in sorted(valuesByLabel.items())])
+
+        if self.latencies:
+            samples = []
+            for endpoint, histogram in sorted(self.latencies.items()):
+                samples.extend(("_bucket", {"endpoint": endpoint, "le": format_bound(upperBound)}, cumulativeCount)
+                               for upperBound, cumulativeCount in histogram.cumulative_counts())
+                samples.append(("_sum", {"endpoint": endpoint}, histogram.sum))
+                samples.append(("_count", {"endpoint": endpoint}, histogram.count))
+            add_metric("request_latency_seconds", "histogram", samples)
+
+        if self.quotaWindows:
+            add_metric("quota_capacity", "gauge", [("", {"period_seconds": format_value(quotaWindow.period)},
+                                                    quotaWindow.capacity) for quotaWindow in self.quotaWindows])
+            add_metric("quota_peak_requests", "gauge", [("", {"period_seconds": format_value(quotaWindow.period)},
+                                                         quotaWindow.peakRequests)
+                                                        for quotaWindow in self.quotaWindows])
+
+        if self.phases:
+            add_metric("phase_calls", "gauge", [("", {"phase": name}, calls)
+                                                for name, (calls, _) in sorted(self.phases.items())])
+            add_metric("phase_seconds", "gauge", [("", {"phase": name}, seconds)
+                                                  for name, (_, seconds) in sorted(self.phases.items())])
+
+        return "\n".join(lines) + "\n"
+
+    def store_in_file(self, file_path: str, format: str = JSON_FORMAT):
+        if format == JSON_FORMAT:
+            checkpoints.write_file_atomically(file_path, json.dumps(self.as_dict(), indent=2))
+        elif format == PROMETHEUS_FORMAT:
+            checkpoints.write_file_atomically(file_path, self.as_prometheus_text())
+        else:
+            raise ValueError("Unknown metrics format: " + format)
+
+
+def format_bound(upperBound: float):
+    return "+Inf" if upperBound == float("inf") else format_value(upperBound)
+
+
+def format_value(value: float):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels: {str, str}):
+    if not labels:
+        return ""
+
+    return "{" + ",".join('{}="{}"'.format(label, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                          for label, value in labels.items()) + "}"
+
+
+# the metrics of the running syncs by the rate limiter key of their crawlers, i.e. per account
+_sync_metrics: {str, SyncMetrics} = {}
+
+
+def register_sync_metrics(key: str, metrics: SyncMetrics):
+    _sync_metrics[key] = metrics
+
+
+def metrics_key(settings):
+    """
+    Returns the key of the metrics of the crawlers with the settings, which is their `ONENOTE_RATE_LIMITER_KEY`.
+    """
+    import onenote_rate_limiter as rate_limiter
+
+    return settings.get('ONENOTE_RATE_LIMITER_KEY', rate_limiter.DEFAULT_RATE_LIMITER_KEY)
+
+
+def metrics_of_crawler(settings):
+    """
+    Returns the metrics of the sync a crawler belongs to, a crawler that does not belong to a sync gets
+    metrics of its own.
+    """
+    key = metrics_key(settings)
+    if key not in _sync_metrics:
+        _sync_metrics[key] = SyncMetrics()
+
+    return _sync_metrics[key]
+
+
+class SyncMetricsExtension(object):
+    """
+    Scrapy extension that records the latency, the number and the bytes of the responses per
+    endpoint of the Graph API and the requests sent per quota window into the metrics of the sync,
+    and adds the stats of the crawler to them once its spider is closed. It is activated with
+    `ONENOTE_METRICS_ENABLED`.
+
+    The sub-responses of a batch request are recorded per endpoint of their request, and the
+    throttled and unauthorized responses, which are retried, are counted per endpoint as well.
+    """
+
+    def __init__(self, crawler, metrics: SyncMetrics):
+        self.crawler = crawler
+        self.metrics = metrics
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        from scrapy import signals
+        from scrapy.exceptions import NotConfigured
+
+        import onenote_rate_limiter as rate_limiter
+
+        if not crawler.settings.getbool('ONENOTE_METRICS_ENABLED'):
+            raise NotConfigured
+
+        extension = cls(crawler, metrics_of_crawler(crawler.settings))
+        extension.metrics.track_quota(tuple(tuple(limit) for limit in crawler.settings.getlist(
+            'ONENOTE_RATE_LIMITS', rate_limiter.ONENOTE_SERVICE_LIMITS)))
+        crawler.signals.connect(extension.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.response_observed, signal=response_observed)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def request_reached_downloader(self, request, spider):
+        # the request has been paced by the rate limiter middleware by now, a batch request counts as its sub-requests
+        self.metrics.add_requests_to_quota(request.meta.get(types.REQUEST_COST_KEY, 1))
+
+    def response_received(self, response, request, spider):
+        self.response_observed(response, request, request.meta.get('download_latency'), True, spider)
+
+    def response_observed(self, response, request, latency, downloaded, spider):
+        endpoint = graph_api.endpoint_of_url(request.url)
+        self.metrics.inc_labeled_value("requests", "endpoint", endpoint)
+        if downloaded:
+            self.metrics.inc_value("downloaded_bytes", len(response.body))
+
+        if response.status == 429:
+            self.metrics.inc_labeled_value("throttled_responses", "endpoint", endpoint)
+        elif response.status == 401:
+            self.metrics.inc_labeled_value("unauthorized_responses", "endpoint", endpoint)
+
+        if latency is not None:
+            self.metrics.observe_latency(endpoint, latency)
+
+    def spider_closed(self, spider):
+        self.metrics.add_crawler_stats(self.crawler.stats.get_stats())
+
+
+_active_profiler = None
+
+
+def start_profiler():
+    """
+    Returns a running cProfile profiler, or None if another profiler is running already, e.g. the one
+    of the sync of another account. The profile includes everything the reactor runs meanwhile.
+    """
+    global _active_profiler
+    if _active_profiler is not None:
+        return None
+
+    import cProfile
+
+    _active_profiler = cProfile.Profile()
+    _active_profiler.enable()
+    return _active_profiler
+
+
+def stop_profiler(profiler, file_path: str):
+    """
+    Stops the profiler and writes its stats into the file, which can be read with `python -m pstats`.
+    """
+    global _active_profiler
+    profiler.disable()
+    if profiler is _active_profiler:
+        _active_profiler = None
+    profiler.dump_stats(file_path)
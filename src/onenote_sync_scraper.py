@@ -1,54 +1,62 @@
 # -*- coding: utf-8 -*-
-import json
-import re
+import math
 from datetime import datetime
 
-import scrapy
-
-import auth_token_request as req
+import onenote_batch as batch
+import onenote_graph_api as graph_api
+import onenote_json
+import onenote_sync_metrics as sync_metrics
+import onenote_tree_finalizer as tree_finalizer
 import onenote_types as types
 
 
-class OneNoteSyncSpider(scrapy.Spider):
+class OneNoteSyncSpider(batch.GraphBatchSpider):
     """
     This spider loads all types of onenote elements (e.g. notebook, section, section group,
     page) and syncs them with the current set of onenote elements. If onenote elements already
     exist, this spider will only load those elements again that changed since the last sync.
     """
 
+    # listing requests are cheap, therefore more of them can run in parallel
+    custom_settings = {
+        'ONENOTE_AIMD_MAX_CONCURRENCY': 16,
+    }
+
     def __init__(self, alfred_data_dictionary: {str, types.OneNoteElement}, lastSyncDate, pagesModified: set(),
                  pagesDeleted: set()):
         self.name = 'OneNoteSyncSpider'
-        self.allowed_domains = ['graph.microsoft.com']
-        self.lastSyncDate = lastSyncDate if type(lastSyncDate) is datetime else datetime.strptime(
+        self.isIncrementalSync = type(lastSyncDate) is datetime
+        self.lastSyncDate = lastSyncDate if self.isIncrementalSync else datetime.strptime(
             '2000-01-01T00:00:00.000Z', "%Y-%m-%dT%H:%M:%S.%f%z")
         self.alfred_data_dictionary = alfred_data_dictionary
-        self.alfred_parent_child_dictionary: {str, (str)} = self.genarateParentChildDictionaryFromDictionary(
-            self.alfred_data_dictionary)
         self.pagesModified = pagesModified
         self.pagesDeleted = pagesDeleted
-        self.baseUrl = "https://graph.microsoft.com"
+        # uids of the pages seen so far per section whose paginated page listing is being loaded
+        self.loadedPagesUidsPerSection: {str, {str}} = {}
+        # uids of the pages seen so far while the pages of the whole account are being listed
+        self.loadedPagesUidsOfAccount: {str} = set()
+        # uids of the elements that have been added or updated by this sync
+        self.mappedElementsUids: {str} = set()
+        # the modified sections whose pages are listed with the pages of the account, they are listed section by
+        # section instead if the listing of the account fails
+        self.sectionsListedWithAccount = None
 
     def start_requests(self):
-        yield req.AuthTokenRequest(meta={types.ONENOTE_TYPE_KEY: types.OneNoteType.NOTEBOOK},
-                                   url=self.baseUrl + '/v1.0/me/onenote/notebooks', method="GET",
-                                   callback=self.parse_onenote_elements)
-
-        yield req.AuthTokenRequest(meta={types.ONENOTE_TYPE_KEY: types.OneNoteType.SECTION_GROUP},
-                                   url=self.baseUrl + '/v1.0/me/onenote/sectiongroups', method="GET",
-                                   callback=self.parse_onenote_elements)
-
-        yield req.AuthTokenRequest(meta={types.ONENOTE_TYPE_KEY: types.OneNoteType.SECTION},
-                                   url=self.baseUrl + '/v1.0/me/onenote/sections', method="GET",
-                                   callback=self.parse_onenote_elements)
+        yield from self.batch_requests(
+            self.auth_token_request(meta={types.ONENOTE_TYPE_KEY: onenoteType},
+                                    url=graph_api.elements_url(self.baseUrl, onenoteType), method="GET",
+                                    callback=self.parse_onenote_elements)
+            for onenoteType in [types.OneNoteType.NOTEBOOK, types.OneNoteType.SECTION_GROUP, types.OneNoteType.SECTION]
+        )
 
     def closed(self, reason):
-        alfred_parent_child_dictionary = self.genarateParentChildDictionaryFromDictionary(self.alfred_data_dictionary)
+        finalizer = tree_finalizer.TreeFinalizer(self.alfred_data_dictionary, self.alfred_data_dictionary.childrenUids)
 
-        self.add_page_urls_to_elements_without_url(self.alfred_data_dictionary,
-                                                   alfred_parent_child_dictionary)
-
-        self.add_subtitle_and_match_string_to_elements(self.alfred_data_dictionary)
+        with sync_metrics.metrics_of_crawler(self.settings).phase("tree_finalization"):
+            if self.isIncrementalSync:
+                finalizer.finalize_modified(self.mappedElementsUids)
+            else:
+                finalizer.finalize_all()
 
     def parse_onenote_elements(self, response):
         """
@@ -57,55 +65,142 @@ class OneNoteSyncSpider(scrapy.Spider):
         """
 
         onenoteType = response.meta[types.ONENOTE_TYPE_KEY]
-        elements = json.loads(response.text)["value"]
+        elements = onenote_json.parse_listing(response.body).value
 
         deletedElementsUids = self.identify_deleted_elements_uids(onenoteType, elements)
         self.delete_recursively(deletedElementsUids)
 
-        modifiedElements = self.identify_modified_elements(elements)
+        modifiedElements = list(self.identify_modified_elements(elements))
 
         for element in modifiedElements:
             self.update_modified_element(onenoteType, element)
 
-            if onenoteType == types.OneNoteType.SECTION:
-                yield self.scrape_pages(element)
+        if onenoteType == types.OneNoteType.SECTION:
+            yield from self.scrape_pages_of_sections(modifiedElements)
 
     def parse_onenote_pages(self, response):
         """
         Is used to parse a list of onenote pages. The function syncs the data with the current set of data.
         """
         sectionUid = response.meta[types.PARENT_UID_KEY]
-        pagesOfSameSectionAlreadyLoaded = response.meta[types.PAGES_OF_SAME_SECTION_ALREADY_LOADED]
-        pages = json.loads(response.text)["value"]
+        detectsDeletedPages = response.meta[types.DETECTS_DELETED_PAGES_KEY]
+        loadedPagesUids = self.loadedPagesUidsPerSection.setdefault(sectionUid, set()) if detectsDeletedPages else set()
+        pages = onenote_json.parse_listing(response.body, self.settings.getbool('ONENOTE_STREAMING_JSON'))
+
+        for page in pages:
+            loadedPagesUids.add(page['id'])
+
+            if self.is_element_modified(page):
+                self.pagesModified.add(page['id'])
+                self.update_modified_element(types.OneNoteType.PAGE, page)
+
+        if pages.nextLink is not None:
+            yield self.auth_token_request(meta={types.PARENT_UID_KEY: sectionUid,
+                                             types.DETECTS_DELETED_PAGES_KEY: detectsDeletedPages},
+                                          url=pages.nextLink, method="GET",
+                                          callback=self.parse_onenote_pages)
+        elif detectsDeletedPages:
+            self.delete_deleted_pages(sectionUid)
 
-        modifiedPages = self.identify_modified_elements(pages)
+    def parse_onenote_pages_uids(self, response):
+        """
+        Is used to parse a list of page uids, which only serves to detect the deleted pages of a section.
+        """
+        sectionUid = response.meta[types.PARENT_UID_KEY]
+        loadedPagesUids = self.loadedPagesUidsPerSection.setdefault(sectionUid, set())
+        pages = onenote_json.parse_listing(response.body, self.settings.getbool('ONENOTE_STREAMING_JSON'))
 
-        for page in modifiedPages:
-            self.pagesModified.add(page['id'])
-            self.update_modified_element(types.OneNoteType.PAGE, page)
+        for page in pages:
+            loadedPagesUids.add(page['id'])
 
-        if "@odata.nextLink" in json.loads(response.text):
-            yield req.AuthTokenRequest(meta={types.PARENT_UID_KEY: sectionUid,
-                                             types.PAGES_OF_SAME_SECTION_ALREADY_LOADED: pagesOfSameSectionAlreadyLoaded + pages},
-                                       url=json.loads(response.text)["@odata.nextLink"], method="GET",
-                                       callback=self.parse_onenote_pages)
+        if pages.nextLink is not None:
+            yield self.auth_token_request(meta={types.PARENT_UID_KEY: sectionUid},
+                                          url=pages.nextLink, method="GET",
+                                          callback=self.parse_onenote_pages_uids)
+        else:
+            self.delete_deleted_pages(sectionUid)
 
-        if "@odata.nextLink" not in json.loads(response.text):
-            deletedPagesUids = self.identify_deleted_pages_uids(sectionUid, pagesOfSameSectionAlreadyLoaded + pages)
-            self.delete_recursively(deletedPagesUids)
+    def delete_deleted_pages(self, sectionUid):
+        """
+        Deletes the pages of the section that have not been part of its complete page listing.
+        """
+        loadedPagesUids = self.loadedPagesUidsPerSection.pop(sectionUid)
+        deletedPagesUids = self.identify_deleted_pages_uids(sectionUid, loadedPagesUids)
+        self.delete_recursively(deletedPagesUids)
 
-    def identify_deleted_pages_uids(self, sectionUid, pages):
+    def parse_onenote_pages_of_account(self, response):
         """
-        This function detects all the deleted pages of a section.
-        For this to work, it is expected that the list of pages includes all the pages
-        the section currently has.
+        Is used to parse a list of onenote pages of all sections of the account. Pages of sections
+        that are not synced (e.g. archived sections) are ignored.
+        """
+        detectsDeletedPages = response.meta[types.DETECTS_DELETED_PAGES_KEY]
+        pages = onenote_json.parse_listing(response.body, self.settings.getbool('ONENOTE_STREAMING_JSON'))
+
+        for page in pages:
+            if detectsDeletedPages:
+                self.loadedPagesUidsOfAccount.add(page['id'])
+
+            if self.extract_parentUid(page) in self.alfred_data_dictionary and self.is_element_modified(page):
+                self.pagesModified.add(page['id'])
+                self.update_modified_element(types.OneNoteType.PAGE, page)
+
+        if pages.nextLink is not None:
+            yield self.auth_token_request(meta={types.DETECTS_DELETED_PAGES_KEY: detectsDeletedPages},
+                                          url=pages.nextLink, method="GET",
+                                          callback=self.parse_onenote_pages_of_account,
+                                          errback=self.account_listing_failed)
+        elif detectsDeletedPages:
+            self.delete_deleted_pages_of_account()
+
+    def parse_onenote_pages_uids_of_account(self, response):
+        """
+        Is used to parse a list of the page uids of all sections, which only serves to detect deleted pages.
         """
-        pagesUids = set()
+        pages = onenote_json.parse_listing(response.body, self.settings.getbool('ONENOTE_STREAMING_JSON'))
+
         for page in pages:
-            pagesUids.add(page["id"])
+            self.loadedPagesUidsOfAccount.add(page['id'])
+
+        if pages.nextLink is not None:
+            yield self.auth_token_request(url=pages.nextLink, method="GET",
+                                          callback=self.parse_onenote_pages_uids_of_account,
+                                          errback=self.account_listing_failed)
+        else:
+            self.delete_deleted_pages_of_account()
+
+    def account_listing_failed(self, failure):
+        """
+        Lists the pages of the modified sections section by section if a listing of the pages of the
+        account failed, e.g. because the account has too many sections. The pages that have been
+        listed already are listed again, which does not change them.
+        """
+        if self.sectionsListedWithAccount is None:
+            return
+
+        self.logger.warning("Listing the pages of the account failed (%s), listing them per section instead",
+                            failure.getErrorMessage())
+        self.crawler.stats.inc_value('onenote_sync/account_listing_failures')
+
+        sections, self.sectionsListedWithAccount = self.sectionsListedWithAccount, None
+        yield from self.batch_requests(request for section in sections for request in self.scrape_pages(section))
+
+    def delete_deleted_pages_of_account(self):
+        """
+        Deletes the pages of all sections that have not been part of the complete page listing of the account.
+        """
+        loadedPagesUids = self.loadedPagesUidsOfAccount
+        self.loadedPagesUidsOfAccount = set()
+
+        deletedPagesUids = self.alfred_data_dictionary.uids_of_type(types.OneNoteType.PAGE) - loadedPagesUids
+        self.delete_recursively(deletedPagesUids)
 
-        pastChildrenUids = self.alfred_parent_child_dictionary[
-            sectionUid] if sectionUid in self.alfred_parent_child_dictionary else set()
+    def identify_deleted_pages_uids(self, sectionUid, pagesUids: {str}):
+        """
+        This function detects all the deleted pages of a section.
+        For this to work, it is expected that the set of page uids includes all the pages
+        the section currently has.
+        """
+        pastChildrenUids = self.alfred_data_dictionary.children_uids(sectionUid)
 
         deletedPages = pastChildrenUids - pagesUids
 
@@ -123,10 +218,7 @@ class OneNoteSyncSpider(scrapy.Spider):
         for element in elements:
             elementUids.add(element["id"])
 
-        pastElementUids = set()
-        for pastElement in self.alfred_data_dictionary.values():
-            if pastElement.onenoteType == onenoteType:
-                pastElementUids.add(pastElement.uid)
+        pastElementUids = self.alfred_data_dictionary.uids_of_type(onenoteType)
 
         deletedElements = pastElementUids - elementUids
 
@@ -140,15 +232,19 @@ class OneNoteSyncSpider(scrapy.Spider):
         """
 
         for element in elements:
-            if self.is_element_archived(element):
-                continue
+            if self.is_element_modified(element):
+                yield element
 
-            # do only scrape elements which have been updated since the last sync
-            lastModified = self.parse_datetime(element["lastModifiedDateTime"])
-            if lastModified < self.lastSyncDate:
-                continue
+    def is_element_modified(self, element):
+        """
+        An element is modified if it is not archived and has been updated since the last sync.
+        """
+        if self.is_element_archived(element):
+            return False
 
-            yield element
+        # do only scrape elements which have been updated since the last sync
+        lastModified = self.parse_datetime(element["lastModifiedDateTime"])
+        return lastModified >= self.lastSyncDate
 
     def is_element_archived(self, element):
         """
@@ -168,16 +264,102 @@ class OneNoteSyncSpider(scrapy.Spider):
 
         return False
 
+    def scrape_pages_of_sections(self, sections):
+        """
+        Scrapes the pages of the passed in modified sections, either section by section or with
+        one listing of all pages of the account, whichever needs fewer requests.
+        """
+        strategy = self.choose_page_discovery_strategy(sections)
+
+        if strategy == types.PageDiscoveryStrategy.ACCOUNT:
+            self.sectionsListedWithAccount = sections
+            yield from self.batch_requests(self.scrape_pages_of_account())
+            return
+
+        yield from self.batch_requests(request for section in sections for request in self.scrape_pages(section))
+
+    def choose_page_discovery_strategy(self, modifiedSections):
+        """
+        The strategy can be set with the setting `ONENOTE_PAGE_DISCOVERY`. By default it is chosen
+        automatically based on the number of requests that are expected to list the pages, which
+        is estimated with the number of pages per section known from the last sync. Without known
+        pages, e.g. on the first sync, the pages are listed section by section, as the listing of
+        the account fails for accounts with many sections.
+        """
+        strategy = types.PageDiscoveryStrategy(
+            self.settings.get('ONENOTE_PAGE_DISCOVERY', types.PageDiscoveryStrategy.AUTO))
+        if strategy != types.PageDiscoveryStrategy.AUTO:
+            return strategy
+
+        numberOfPages = len(self.alfred_data_dictionary.uids_of_type(types.OneNoteType.PAGE))
+        if numberOfPages == 0:
+            return types.PageDiscoveryStrategy.SECTIONS
+
+        # on an incremental sync an additional listing of the modified pages is needed
+        modifiedPagesListingRequests = 1 if self.isIncrementalSync else 0
+
+        requestsPerSection = 0
+        for section in modifiedSections:
+            sectionPages = len(self.alfred_data_dictionary.children_uids(section['id']))
+            requestsPerSection += self.estimate_listing_requests(sectionPages) + modifiedPagesListingRequests
+
+        requestsForAccount = self.estimate_listing_requests(numberOfPages) + modifiedPagesListingRequests
+
+        if requestsForAccount < requestsPerSection:
+            return types.PageDiscoveryStrategy.ACCOUNT
+
+        return types.PageDiscoveryStrategy.SECTIONS
+
+    def estimate_listing_requests(self, numberOfElements):
+        return max(1, math.ceil(numberOfElements / graph_api.PAGES_PAGE_SIZE))
+
+    def scrape_pages_of_account(self):
+        """
+        Scrapes the pages of all sections of the account at once. On an incremental sync only the
+        pages modified since the last sync are listed with all their fields, the deleted pages are
+        detected with a separate listing of the uids of all the pages.
+        """
+        self.loadedPagesUidsOfAccount = set()
+
+        if not self.isIncrementalSync:
+            yield self.auth_token_request(
+                meta={types.DETECTS_DELETED_PAGES_KEY: True},
+                url=graph_api.account_pages_url(self.baseUrl), method="GET",
+                callback=self.parse_onenote_pages_of_account, errback=self.account_listing_failed)
+            return
+
+        yield self.auth_token_request(
+            url=graph_api.account_pages_uids_url(self.baseUrl), method="GET",
+            callback=self.parse_onenote_pages_uids_of_account, errback=self.account_listing_failed)
+
+        yield self.auth_token_request(
+            meta={types.DETECTS_DELETED_PAGES_KEY: False},
+            url=graph_api.account_pages_url(self.baseUrl, self.lastSyncDate), method="GET",
+            callback=self.parse_onenote_pages_of_account, errback=self.account_listing_failed)
+
     def scrape_pages(self, parent):
         """
-        Scrapes the pages of the passed in element.
+        Scrapes the pages of the passed in section. On an incremental sync only the pages modified
+        since the last sync are listed with all their fields, the deleted pages are detected
+        with a separate listing of the uids of all the pages.
         """
 
-        if "pagesUrl" in parent:
-            return req.AuthTokenRequest(
-                meta={types.PARENT_UID_KEY: parent["id"], types.PAGES_OF_SAME_SECTION_ALREADY_LOADED: []},
-                url=parent["pagesUrl"], method="GET",
+        if not self.isIncrementalSync:
+            yield self.auth_token_request(
+                meta={types.PARENT_UID_KEY: parent["id"], types.DETECTS_DELETED_PAGES_KEY: True},
+                url=graph_api.section_pages_url(self.baseUrl, parent["id"]), method="GET",
                 callback=self.parse_onenote_pages)
+            return
+
+        yield self.auth_token_request(
+            meta={types.PARENT_UID_KEY: parent["id"]},
+            url=graph_api.section_pages_uids_url(self.baseUrl, parent["id"]), method="GET",
+            callback=self.parse_onenote_pages_uids)
+
+        yield self.auth_token_request(
+            meta={types.PARENT_UID_KEY: parent["id"], types.DETECTS_DELETED_PAGES_KEY: False},
+            url=graph_api.section_pages_url(self.baseUrl, parent["id"], self.lastSyncDate), method="GET",
+            callback=self.parse_onenote_pages)
 
     def map_element(self, elementType: types.OneNoteType, element):
         if elementType == types.OneNoteType.NOTEBOOK:
@@ -255,12 +437,14 @@ class OneNoteSyncSpider(scrapy.Spider):
     def update_modified_element(self, elementOnenoteType, element):
         elementMapped = self.map_element(elementOnenoteType, element)
         self.alfred_data_dictionary[elementMapped.uid] = elementMapped
+        self.mappedElementsUids.add(elementMapped.uid)
+        # a page moved to another section may have been considered as deleted from its former section
+        self.pagesDeleted.discard(elementMapped.uid)
 
     def delete_recursively(self, uids: [str]):
         for uid in uids:
-            if uid in self.alfred_parent_child_dictionary:
-                children = self.alfred_parent_child_dictionary[uid]
-                self.delete_recursively(children)
+            # the children are copied as deleting them updates the index of the children
+            self.delete_recursively(list(self.alfred_data_dictionary.children_uids(uid)))
 
             if uid in self.alfred_data_dictionary and self.alfred_data_dictionary[
                 uid].onenoteType == types.OneNoteType.PAGE:
@@ -304,65 +488,3 @@ class OneNoteSyncSpider(scrapy.Spider):
             return element['links']['oneNoteClientUrl']['href']
 
         return element['links']['oneNoteClientUrl']
-
-    def genarateParentChildDictionaryFromDictionary(self, alfredDataDictionary: {str, types.OneNoteElement}):
-        alfredParentChildDictionary = {}
-
-        for element in alfredDataDictionary:
-            element = alfredDataDictionary[element]
-
-            if element.parentUid == None:
-                continue
-
-            if element.parentUid not in alfredParentChildDictionary:
-                alfredParentChildDictionary[element.parentUid] = set()
-
-            alfredParentChildDictionary[element.parentUid].add(element.uid)
-
-        return alfredParentChildDictionary
-
-    def recursively_find_url_of_first_child_page(self, element: types.OneNoteElement, alfredDataDictionary,
-                                                 alfredParentChildDictionary):
-        if (element.onenoteType == types.OneNoteType.PAGE):
-            return element.arg
-
-        if (element.uid in alfredParentChildDictionary):
-            childElement = alfredDataDictionary[list(alfredParentChildDictionary[element.uid])[0]]
-            return self.recursively_find_url_of_first_child_page(childElement, alfredDataDictionary,
-                                                                 alfredParentChildDictionary)
-
-        return None
-
-    def recursively_generate_subtitle(self, element: types.OneNoteElement, alfredDataDictionary):
-        if (element.onenoteType == types.OneNoteType.NOTEBOOK):
-            return element.title
-
-        return self.recursively_generate_subtitle(alfredDataDictionary[element.parentUid],
-                                                  alfredDataDictionary) + " > " + element.title
-
-    def add_page_urls_to_elements_without_url(self, alfredDataDictionary,
-                                              alfredParentChildDictionary):
-        for uid in alfredDataDictionary.keys():
-            element: types.OneNoteElement = alfredDataDictionary[uid]
-            if (element.arg == None):
-                pageUrl = self.recursively_find_url_of_first_child_page(element, alfredDataDictionary,
-                                                                        alfredParentChildDictionary)
-
-                if (pageUrl != None):
-                    sectionUrl = re.sub(r'page-id=.*&', '', pageUrl)
-                    element.arg = sectionUrl
-
-    def add_subtitle_and_match_string_to_elements(self, alfredDataDictionary):
-        for uid in alfredDataDictionary.keys():
-            element: types.OneNoteElement = alfredDataDictionary[uid]
-
-            if (element.onenoteType == types.OneNoteType.NOTEBOOK):
-                element.subtitle = "Notebook"
-                element.match = element.title
-                continue
-
-            subtitle = self.recursively_generate_subtitle(alfredDataDictionary[element.parentUid], alfredDataDictionary)
-            subtitle = subtitle.replace("--", "")
-
-            element.subtitle = subtitle
-            element.match = subtitle + " > " + element.title
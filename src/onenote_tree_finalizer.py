@@ -0,0 +1,127 @@
+import re
+
+import onenote_types as types
+
+
+class TreeFinalizer(object):
+    """
+    Computes the subtitle, the match string and the url (arg) of the OneNote elements from their
+    position in the tree of notebooks, section groups, sections and pages. The tree is walked
+    top-down and the title path of every element is computed only once. Children are visited
+    ordered by uid, so that a container always gets the url of the same page and elements whose
+    values did not change are not marked as modified.
+    """
+
+    def __init__(self, alfred_data_dictionary: {str, types.OneNoteElement},
+                 alfred_parent_child_dictionary: {str, (str)}):
+        self.alfredDataDictionary = alfred_data_dictionary
+        self.alfredParentChildDictionary = alfred_parent_child_dictionary
+        # uid -> titles of the element and all of its ancestors, e.g. "Notebook > Section Group > Section"
+        self.titlePaths: {str, str} = {}
+
+    def finalize_all(self):
+        for uid in sorted(self.alfredDataDictionary.keys()):
+            if self.alfredDataDictionary[uid].parentUid is None:
+                self.finalize_subtree(uid)
+
+    def finalize_modified(self, modifiedUids: {str}):
+        """
+        Only finalizes the subtrees of the modified (or re-parented) elements and the urls of their
+        ancestors that have no url yet. Everything else is left as computed by the last sync.
+        """
+        for uid in sorted(modifiedUids):
+            if uid not in self.alfredDataDictionary or self.has_modified_ancestor(uid, modifiedUids):
+                continue
+
+            self.finalize_subtree(uid)
+            self.finalize_urls_of_ancestors(uid)
+
+    def finalize_subtree(self, uid: str):
+        element = self.alfredDataDictionary[uid]
+        self.finalize_subtitle_and_match(element)
+
+        for childUid in self.children_uids(uid):
+            self.finalize_subtree(childUid)
+
+        if element.arg is None:
+            self.update_element(element, arg=self.find_url_of_first_child(uid))
+
+    def finalize_subtitle_and_match(self, element: types.OneNoteElement):
+        if element.onenoteType == types.OneNoteType.NOTEBOOK:
+            self.update_element(element, subtitle="Notebook", match=element.title)
+            return
+
+        parentTitlePath = self.title_path(element.parentUid)
+        if parentTitlePath is None:
+            return
+
+        # the subtitle is shared by all children of the parent, therefore it is only kept once in memory
+        subtitle = types.intern_string(parentTitlePath.replace("--", ""))
+        self.update_element(element, subtitle=subtitle, match=subtitle + " > " + element.title)
+
+    def finalize_urls_of_ancestors(self, uid: str):
+        parentUid = self.alfredDataDictionary[uid].parentUid
+
+        while parentUid in self.alfredDataDictionary:
+            parent = self.alfredDataDictionary[parentUid]
+            if parent.arg is not None:
+                return
+
+            self.update_element(parent, arg=self.find_url_of_first_child(parentUid))
+            parentUid = parent.parentUid
+
+    def find_url_of_first_child(self, uid: str):
+        """
+        The url of a container is the url of its first page without the page id, which opens the section.
+        """
+        for childUid in self.children_uids(uid):
+            childUrl = self.alfredDataDictionary[childUid].arg
+            if childUrl is not None:
+                return re.sub(r'page-id=.*&', '', childUrl)
+
+        return None
+
+    def title_path(self, uid: str):
+        """
+        Returns None if the element or one of its ancestors is not known, e.g. because it is archived.
+        """
+        if uid in self.titlePaths:
+            return self.titlePaths[uid]
+
+        element = self.alfredDataDictionary.get(uid)
+        if element is None:
+            return None
+
+        if element.onenoteType == types.OneNoteType.NOTEBOOK:
+            titlePath = element.title
+        else:
+            parentTitlePath = self.title_path(element.parentUid)
+            titlePath = parentTitlePath + " > " + element.title if parentTitlePath is not None else None
+
+        self.titlePaths[uid] = titlePath
+        return titlePath
+
+    def children_uids(self, uid: str):
+        return sorted(childUid for childUid in self.alfredParentChildDictionary.get(uid, ())
+                      if childUid in self.alfredDataDictionary)
+
+    def has_modified_ancestor(self, uid: str, modifiedUids: {str}):
+        parentUid = self.alfredDataDictionary[uid].parentUid
+
+        while parentUid in self.alfredDataDictionary:
+            if parentUid in modifiedUids:
+                return True
+            parentUid = self.alfredDataDictionary[parentUid].parentUid
+
+        return False
+
+    def update_element(self, element: types.OneNoteElement, **values):
+        changed = False
+
+        for field, value in values.items():
+            if getattr(element, field) != value:
+                setattr(element, field, value)
+                changed = True
+
+        if changed:
+            self.alfredDataDictionary.mark_modified(element.uid)
@@ -1,8 +1,11 @@
+import sys
 from enum import Enum
 
 PARENT_UID_KEY = "parentUid"
-PAGES_OF_SAME_SECTION_ALREADY_LOADED = "pagesOfSameSectionAlreadyLoaded"
 PAGE_UID_KEY = "pageUid"
+DETECTS_DELETED_PAGES_KEY = "detectsDeletedPages"
+REQUEST_COST_KEY = "requestCost"
+BATCHED_REQUESTS_KEY = "batchedRequests"
 ONENOTE_TYPE_KEY = "onenoteType"
 NOTEBOOKS_KEY = "notebooks"
 
@@ -14,23 +17,75 @@ class OneNoteType(str, Enum):
     PAGE = "page"
 
 
+# maps the values (or the types themselves) to the types, which is faster than calling OneNoteType(value)
+ONENOTE_TYPES = {onenoteType.value: onenoteType for onenoteType in OneNoteType}
+
+
+class PageDiscoveryStrategy(str, Enum):
+    SECTIONS = "sections"  # list the pages of every modified section
+    ACCOUNT = "account"  # list the pages of all sections at once
+    AUTO = "auto"  # choose the strategy that needs fewer requests
+
+
+class PageContentPriority(str, Enum):
+    RECENT = "recent"  # download the most recently modified pages first
+    MISSING = "missing"  # download the pages that are not in the content store yet first
+    NOTEBOOKS = "notebooks"  # download the pages of the notebooks in ONENOTE_CONTENT_PRIORITY_NOTEBOOKS first
+
+
+# the fields of an element in the order of the constructor arguments
+ELEMENT_FIELDS = ("title", "autocomplete", "uid", "subtitle", "arg", "icon", "icontype", "onenoteType", "parentUid",
+                  "lastModifiedDateTime", "match")
+
+
 class OneNoteElement(object):
+    """
+    One notebook, section group, section or page. The elements use slots instead of a `__dict__`
+    and the strings that many elements share (icon, icon type, parent uid and subtitle) are
+    interned, so that each of them is only kept once in memory.
+    """
+
+    __slots__ = ELEMENT_FIELDS
+
     def __init__(self, title, autocomplete, uid, subtitle, arg, icon, icontype, onenoteType, parentUid,
                  lastModifiedDateTime, match):
         self.title = title
         self.autocomplete = autocomplete
         self.uid = uid
-        self.subtitle = subtitle
+        self.subtitle = intern_string(subtitle)
         self.arg = arg
-        self.icon = icon
-        self.icontype = icontype
-        self.onenoteType = onenoteType
-        self.parentUid = parentUid
+        self.icon = intern_string(icon)
+        self.icontype = intern_string(icontype)
+        self.onenoteType = ONENOTE_TYPES[onenoteType]
+        self.parentUid = intern_string(parentUid)
         self.lastModifiedDateTime = lastModifiedDateTime
         self.match = match
 
 
+def intern_string(value):
+    return sys.intern(value) if value is not None else None
+
+
 def as_onenoteelement(data):
     return OneNoteElement(data['title'], data['autocomplete'], data['uid'], data['subtitle'], data['arg'], data['icon'],
                           data['icontype'], data['onenoteType'], data['parentUid'], data['lastModifiedDateTime'],
                           data['match'])
+
+
+def onenoteelement_as_dict(element: OneNoteElement):
+    """
+    The counterpart of `as_onenoteelement`, returns the element in the format of the onenoteElements.json file.
+    """
+    return {
+        'title': element.title,
+        'autocomplete': element.autocomplete,
+        'uid': element.uid,
+        'subtitle': element.subtitle,
+        'arg': element.arg,
+        'icon': element.icon,
+        'icontype': element.icontype,
+        'onenoteType': element.onenoteType.value,
+        'parentUid': element.parentUid,
+        'lastModifiedDateTime': element.lastModifiedDateTime,
+        'match': element.match,
+    }
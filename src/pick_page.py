@@ -0,0 +1,41 @@
+"""
+Picks a random OneNote page from the sampling index written by the sync and prints it as an Alfred
+script filter result. It only reads the synced data, so it neither needs the config nor imports
+Scrapy or MSAL.
+
+Usage: python ./src/pick_page.py
+"""
+import os
+import sys
+
+import onenote_element_store as element_store
+import onenote_json
+import onenote_page_picker as page_picker
+import onenote_settings as settings
+import onenote_types as types
+
+
+def load_page(pageUid: str):
+    """
+    Reads only the picked page from the element store, the JSON file is only read if there is no database.
+    """
+    if os.path.isfile(settings.ONENOTE_ELEMENTS_DATABASE):
+        elementStore = element_store.SqliteElementStore(settings.ONENOTE_ELEMENTS_DATABASE, read_only=True)
+        try:
+            return elementStore.get(pageUid)
+        finally:
+            elementStore.close()
+
+    return element_store.JsonElementStore(settings.ONENOTE_ELEMENTS_FILE).load().get(pageUid)
+
+
+def main():
+    pageUid = page_picker.pick_page(page_picker.PAGE_SAMPLING_INDEX_FILE, page_picker.RECENTLY_SHOWN_PAGES_FILE)
+    page = load_page(pageUid) if pageUid is not None else None
+
+    items = [types.onenoteelement_as_dict(page)] if page is not None else []
+    sys.stdout.write(onenote_json.dumps({"items": items}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Searches the full-text index of the pages written by the sync and prints the best matching pages
+as Alfred script filter results, with a snippet of the matching text as their subtitle. Like
+pick_page.py it only reads the synced data.
+
+Usage: python ./src/search_pages.py <query>
+"""
+import os
+import sys
+
+import onenote_element_store as element_store
+import onenote_json
+import onenote_search_index as search_index
+import onenote_settings as settings
+import onenote_types as types
+
+MAX_RESULTS = 20
+
+
+def main(query: str):
+    items = []
+
+    if os.path.isfile(search_index.SEARCH_INDEX_DATABASE):
+        pageSearchIndex = search_index.PageSearchIndex(search_index.SEARCH_INDEX_DATABASE, read_only=True)
+        try:
+            results = pageSearchIndex.search(query, MAX_RESULTS)
+        finally:
+            pageSearchIndex.close()
+
+        pages = element_store.read_elements(settings.ONENOTE_ELEMENTS_DATABASE, settings.ONENOTE_ELEMENTS_FILE,
+                                            [pageUid for pageUid, _ in results])
+        for page, snippet in zip(pages, (snippet for _, snippet in results)):
+            if page is None:
+                continue
+
+            item = types.onenoteelement_as_dict(page)
+            item['subtitle'] = snippet or page.subtitle
+            items.append(item)
+
+    sys.stdout.write(onenote_json.dumps({"items": items}) + "\n")
+
+
+if __name__ == "__main__":
+    main(" ".join(sys.argv[1:]))
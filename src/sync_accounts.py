@@ -0,0 +1,181 @@
+"""
+Syncs several Microsoft accounts at the same time in one process: the syncs of all accounts run
+concurrently in one reactor, so that the whole run takes about as long as the sync of the
+slowest account instead of the sum of all of them. Every account has its own access token and
+token cache, its own rate limiter and concurrency controller (the service limits apply per user)
+and its own stores in `accounts/<name>/`. The elements of all accounts are merged into the element
+store and the lookup index of the current folder (and into onenoteElements.json, if it is exported),
+which are read by Alfred and find_elements.py as after a single-account sync.
+
+Usage: python ./src/sync_accounts.py [accounts.json]
+
+The accounts file lists the accounts with a name, the config file of their app and optionally the
+username of the account to sign in with and settings that override CRAWLER_CONFIG of main.py, e.g.
+    [{"name": "work", "config": "config.json", "username": "me@example.com"},
+     {"name": "private", "config": "private.json", "settings": {"ONENOTE_REQUEST_BUDGET": 350}}]
+"""
+import json
+import os
+import sys
+
+import main as sync
+import onenote_checkpoint as checkpoints
+import onenote_element_store as element_store
+import onenote_lookup_index as lookup_index
+
+ACCOUNTS_FILE = "accounts.json"
+ACCOUNTS_FOLDER = "./accounts/"
+# the names of the accounts whose elements are in the combined stores
+COMBINED_ACCOUNTS_FILE = "combinedAccounts.json"
+# the names of the accounts whose stores may have changes that are not merged yet, is written before the syncs
+# start and removed once their changes have been merged
+PENDING_MERGE_FILE = "pendingMerge.json"
+
+
+def load_accounts(file_path: str):
+    with open(file_path, "r") as file:
+        accounts = json.load(file)
+
+    names = [account["name"] for account in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError("The names of the accounts are not unique: " + ", ".join(names))
+
+    return accounts
+
+
+def create_account_sync(account: dict):
+    """
+    Registers the authentication of the account and returns the sync of its folder. Signs in
+    before the reactor runs, as the device flow blocks until the code has been entered. The
+    tokens of the crawls are refreshed in a thread (auth_token_request.AccessTokenRefreshMiddleware).
+    """
+    import microsoft_graph_device_flow as auth
+
+    name = account["name"]
+    folder = os.path.join(ACCOUNTS_FOLDER, name)
+    os.makedirs(folder, exist_ok=True)
+
+    # the first sync of an account is a full sync
+    lastSyncDateFile = os.path.join(folder, sync.LAST_SYNC_DATE_FILE)
+    if not os.path.isfile(lastSyncDateFile):
+        sync.store_last_sync_date_in_file(lastSyncDateFile, "")
+
+    authentication = auth.AccountAuthentication(account["config"], os.path.join(folder, auth.TOKEN_CACHE_FILE),
+                                                account.get("username"))
+    auth.register_account(name, authentication)
+    print("Signing in to the account {}.".format(name))
+    authentication.retrieveAccessToken()
+
+    crawlerConfig = dict(sync.CRAWLER_CONFIG, **account.get("settings", {}))
+    crawlerConfig.update(ONENOTE_ACCOUNT=name, ONENOTE_RATE_LIMITER_KEY=name)
+    return sync.OneNoteSync(crawlerConfig, folder)
+
+
+def mark_merge_pending(account_names: [str]):
+    """
+    Records that the syncs of the accounts are about to change their stores. Returns whether the
+    changes of an earlier run have not been merged, e.g. because it was killed before merging.
+    """
+    mergeBehind = os.path.isfile(PENDING_MERGE_FILE)
+    checkpoints.write_file_atomically(PENDING_MERGE_FILE, json.dumps(sorted(account_names)))
+
+    return mergeBehind
+
+
+def clear_merge_pending():
+    if os.path.isfile(PENDING_MERGE_FILE):
+        os.remove(PENDING_MERGE_FILE)
+
+
+class CombinedElements(object):
+    """
+    The elements of all accounts in the element store, the JSON file and the lookup index of the
+    current folder. Only the elements modified and deleted by the syncs are merged, unless the
+    accounts changed since the last merge or an earlier run has not merged its changes, then the
+    combined stores are rebuilt from the stores of the accounts.
+    """
+
+    def __init__(self):
+        self.elementStore = element_store.open_element_store(sync.ELEMENT_STORE_BACKEND,
+                                                             sync.ONENOTE_ELEMENTS_DATABASE,
+                                                             sync.ONENOTE_ELEMENTS_FILE)
+        self.alfredDataDictionary = self.elementStore.load()
+        self.elementLookupIndex = lookup_index.ElementLookupIndex(lookup_index.LOOKUP_INDEX_DATABASE) \
+            if sync.UPDATE_LOOKUP_INDEX else None
+        self.accountNames = []
+        if os.path.isfile(COMBINED_ACCOUNTS_FILE):
+            with open(COMBINED_ACCOUNTS_FILE, "r") as file:
+                self.accountNames = json.load(file)
+
+    def merge(self, one_note_syncs: {str, sync.OneNoteSync}, merge_behind: bool = False):
+        if merge_behind or sorted(one_note_syncs.keys()) != sorted(self.accountNames):
+            self.rebuild(one_note_syncs.values())
+        else:
+            for oneNoteSync in one_note_syncs.values():
+                for uid in oneNoteSync.elementsModified:
+                    if uid in oneNoteSync.alfredDataDictionary:
+                        self.alfredDataDictionary[uid] = oneNoteSync.alfredDataDictionary[uid]
+                for uid in oneNoteSync.elementsDeleted:
+                    self.alfredDataDictionary.pop(uid, None)
+
+        elementsChanged = self.alfredDataDictionary.has_changes()
+        if self.elementLookupIndex is not None:
+            lookup_index.update_lookup_index(self.elementLookupIndex, self.alfredDataDictionary)
+        self.elementStore.save(self.alfredDataDictionary)
+
+        if sync.EXPORT_ONENOTE_ELEMENTS_FILE and sync.ELEMENT_STORE_BACKEND != element_store.JSON_BACKEND \
+                and (elementsChanged or not os.path.isfile(sync.ONENOTE_ELEMENTS_FILE)):
+            element_store.export_elements_to_json(sync.ONENOTE_ELEMENTS_FILE, self.alfredDataDictionary.values())
+
+        self.accountNames = sorted(one_note_syncs.keys())
+        checkpoints.write_file_atomically(COMBINED_ACCOUNTS_FILE, json.dumps(self.accountNames))
+
+    def rebuild(self, one_note_syncs: [sync.OneNoteSync]):
+        accountsUids = set()
+        for oneNoteSync in one_note_syncs:
+            for uid, element in oneNoteSync.alfredDataDictionary.items():
+                self.alfredDataDictionary[uid] = element
+                accountsUids.add(uid)
+
+        for uid in set(self.alfredDataDictionary.keys()) - accountsUids:
+            del self.alfredDataDictionary[uid]
+
+    def close(self):
+        self.elementStore.close()
+        if self.elementLookupIndex is not None:
+            self.elementLookupIndex.close()
+
+
+def main(accounts_file_path: str = ACCOUNTS_FILE):
+    from scrapy.utils.log import configure_logging
+    from twisted.internet import defer, reactor
+
+    configure_logging()
+    oneNoteSyncs = {account["name"]: create_account_sync(account) for account in load_accounts(accounts_file_path)}
+    results = {name: [] for name in oneNoteSyncs}
+    # the syncs save the stores of the accounts before their changes are merged, a run that does not get to
+    # merge them leaves the marker behind and the next run rebuilds the combined stores
+    mergeBehind = mark_merge_pending(oneNoteSyncs.keys())
+
+    syncsDeferreds = [oneNoteSync.run().addBoth(results[name].append) for name, oneNoteSync in oneNoteSyncs.items()]
+    defer.DeferredList(syncsDeferreds).addBoth(lambda _: reactor.stop())
+    reactor.run()  # the script will block here until all syncs are finished or interrupted
+
+    # closing a sync saves the elements of an unfinished one, which are merged as well
+    for oneNoteSync in oneNoteSyncs.values():
+        oneNoteSync.close()
+
+    combinedElements = CombinedElements()
+    try:
+        combinedElements.merge(oneNoteSyncs, mergeBehind)
+    finally:
+        combinedElements.close()
+    clear_merge_pending()
+
+    for name in oneNoteSyncs:
+        print("{}: ".format(name), end="")
+        sync.report_result(results[name])
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
@@ -0,0 +1,233 @@
+"""
+Keeps syncing in one long-running process: the daemon runs a sync every `--interval` seconds
+and whenever it is asked to over a local socket, one sync after the other in the same reactor.
+Unlike a new run of main.py for every sync, it keeps the element store loaded, the access token,
+the connections to the Graph API and the state of the rate limiter and of the concurrency
+controller, so that a small incremental sync only costs its requests.
+
+Usage: python ./src/sync_daemon.py config.json [--interval 900]      starts the daemon
+       python ./src/sync_daemon.py --command sync|trigger|status|stop    talks to the running daemon
+
+The command `sync` waits until a sync that started after it is finished, `trigger` only starts
+one, `status` tells whether a sync is running and `stop` stops the daemon.
+"""
+import argparse
+import socket
+import sys
+import time
+
+import main as sync
+
+SYNC_INTERVAL_IN_SECONDS = 15 * 60
+TRIGGER_SOCKET_FILE = "syncDaemon.sock"
+COMMANDS = ["sync", "trigger", "status", "stop"]
+# the connections of all crawlers are kept in one pool, so that the next sync reuses them
+DAEMON_CRAWLER_CONFIG = dict(sync.CRAWLER_CONFIG, DOWNLOAD_HANDLERS={
+    'http': 'onenote_connection_pool.SharedPoolDownloadHandler',
+    'https': 'onenote_connection_pool.SharedPoolDownloadHandler',
+})
+
+
+class SyncDaemon(object):
+    """
+    Runs the syncs of the daemon one after the other. The syncs requested while one is running are
+    combined into the next one, which starts as soon as the running one is finished.
+    """
+
+    def __init__(self, oneNoteSync):
+        self.oneNoteSync = oneNoteSync
+        self.running = False
+        self.waiters = []
+        self.lastSyncSeconds = None
+        self.lastResult = None
+
+    def trigger(self):
+        """
+        Returns a Deferred that fires with the number of pages left by the request budget once a
+        sync that started not before this call is finished.
+        """
+        from twisted.internet import defer
+
+        waiter = defer.Deferred()
+        self.waiters.append(waiter)
+
+        if not self.running:
+            self.run_sync()
+
+        return waiter
+
+    def start_sync(self):
+        """
+        Starts a sync without waiting for it, its failure has already been reported by `sync_finished`.
+        """
+        self.trigger().addErrback(lambda failure: None)
+
+    def scheduled_sync(self):
+        # a scheduled sync is skipped while another one is running
+        if not self.running:
+            self.start_sync()
+
+    def run_sync(self):
+        waiters, self.waiters = self.waiters, []
+        self.running = True
+        start = time.perf_counter()
+
+        self.oneNoteSync.run().addBoth(self.sync_finished, waiters, start)
+
+    def sync_finished(self, result, waiters: list, start: float):
+        from twisted.python.failure import Failure
+
+        self.running = False
+        self.lastSyncSeconds = time.perf_counter() - start
+        self.lastResult = result
+
+        if isinstance(result, Failure):
+            print("Sync failed after {:.1f} s: {}".format(self.lastSyncSeconds, result.getErrorMessage()))
+            # the failed sync is resumed by the next one
+            if self.oneNoteSync.checkpoint is not None:
+                self.oneNoteSync.store_checkpoint()
+        elif result:
+            print("Sync stopped after {:.1f} s, the request budget is used up and {} pages are left."
+                  .format(self.lastSyncSeconds, result))
+        else:
+            print("Sync done in {:.1f} s.".format(self.lastSyncSeconds))
+
+        for waiter in waiters:
+            waiter.callback(result)
+
+        if self.waiters:
+            self.run_sync()
+
+    def status(self):
+        if self.running:
+            return "running"
+
+        if self.lastSyncSeconds is None:
+            return "idle"
+
+        return "idle, the last sync took {:.1f} s".format(self.lastSyncSeconds)
+
+
+def create_command_protocol(daemon: SyncDaemon):
+    """
+    Returns the protocol of the trigger socket, which reads one command per line and answers each with one line.
+    """
+    from twisted.internet import protocol, reactor
+    from twisted.protocols.basic import LineOnlyReceiver
+    from twisted.python.failure import Failure
+
+    class SyncCommandProtocol(LineOnlyReceiver):
+        delimiter = b"\n"
+        # the command stop stops the reactor once the connection is closed, which is after its reply has been sent
+        stopsReactor = False
+
+        def lineReceived(self, line):
+            command = line.decode("utf-8").strip()
+
+            if command == "sync":
+                daemon.trigger().addBoth(self.sync_finished)
+            elif command == "trigger":
+                self.reply("queued" if daemon.running else "started")
+                daemon.start_sync()
+            elif command == "status":
+                self.reply(daemon.status())
+            elif command == "stop":
+                self.reply("stopping")
+                self.stopsReactor = True
+                self.transport.loseConnection()
+            else:
+                self.reply("unknown command, use one of " + ", ".join(COMMANDS))
+
+        def connectionLost(self, reason=protocol.connectionDone):
+            super(SyncCommandProtocol, self).connectionLost(reason)
+
+            if self.stopsReactor and reactor.running:
+                reactor.stop()
+
+        def sync_finished(self, result):
+            if isinstance(result, Failure):
+                self.reply("failed: " + result.getErrorMessage())
+            elif result:
+                self.reply("done, {} pages are left".format(result))
+            else:
+                self.reply("done")
+
+        def reply(self, message: str):
+            if self.transport.connected:
+                self.sendLine(message.encode("utf-8"))
+
+    return SyncCommandProtocol
+
+
+def run_daemon(config_file_path: str, interval: float, socket_file: str = TRIGGER_SOCKET_FILE):
+    """
+    Runs the daemon until it is stopped. The app is initialized with the config file, unless it is
+    None because the caller has already set up the authentication, e.g. the benchmark of the syncs.
+    """
+    from scrapy.utils.log import configure_logging
+    from twisted.internet import protocol, reactor, task
+
+    import microsoft_graph_device_flow as auth
+    import onenote_connection_pool as connection_pool
+
+    if config_file_path is not None:
+        auth.initializeApp(config_file_path)
+
+    configure_logging()
+    oneNoteSync = sync.OneNoteSync(DAEMON_CRAWLER_CONFIG)
+    daemon = SyncDaemon(oneNoteSync)
+
+    # wantPID replaces the socket file left behind by a daemon that has not been stopped cleanly
+    reactor.listenUNIX(socket_file, protocol.Factory.forProtocol(create_command_protocol(daemon)), wantPID=True)
+    reactor.addSystemEventTrigger('before', 'shutdown', connection_pool.close_connection_pool)
+
+    if interval > 0:
+        task.LoopingCall(daemon.scheduled_sync).start(interval, now=True)
+    print("Sync daemon listening on {}.".format(socket_file))
+
+    reactor.run()  # blocks until the daemon is stopped, e.g. with the command stop or Ctrl-C
+    oneNoteSync.close()
+    print("Sync daemon stopped.")
+
+
+def send_command(command: str, socket_file: str = TRIGGER_SOCKET_FILE):
+    """
+    Sends a command to the running daemon and returns its answer. Only uses the standard library,
+    so that asking for a sync does not import Scrapy or Twisted.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_file)
+        connection.sendall((command + "\n").encode("utf-8"))
+
+        with connection.makefile("r", encoding="utf-8") as answer:
+            return answer.readline().strip()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Syncs OneNote on a schedule and on request in one process.")
+    parser.add_argument("config", nargs="?", help="the config file of the app, as for main.py, required to start "
+                                                  "the daemon")
+    parser.add_argument("--interval", type=float, default=SYNC_INTERVAL_IN_SECONDS,
+                        help="the seconds between the scheduled syncs, 0 to only sync on request")
+    parser.add_argument("--socket", default=TRIGGER_SOCKET_FILE, help="the socket file of the daemon")
+    parser.add_argument("--command", choices=COMMANDS, help="sends the command to the running daemon")
+
+    arguments = parser.parse_args()
+    # without the config file, the app would read its config from the first command line argument
+    if arguments.command is None and arguments.config is None:
+        parser.error("the config file is required to start the daemon")
+
+    return arguments
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+
+    if arguments.command is not None:
+        try:
+            print(send_command(arguments.command, arguments.socket))
+        except OSError as error:
+            print("The sync daemon is not running: {}".format(error))
+            sys.exit(1)
+    else:
+        run_daemon(arguments.config, arguments.interval, arguments.socket)
@@ -0,0 +1,47 @@
+"""
+Builds the OneNote elements of the tests: a notebook with a section group, sections and pages.
+"""
+import onenote_types as types
+from onenote_element_dictionary import OneNoteElementDictionary
+
+
+def element(uid: str, onenoteType: types.OneNoteType, title: str, parentUid: str = None, arg: str = None,
+            lastModifiedDateTime: str = "2021-01-01T12:00:00Z"):
+    return types.OneNoteElement(title, title, uid, None, arg, "icon.png", "fileicon", onenoteType, parentUid,
+                                lastModifiedDateTime, None)
+
+
+def page_url(sectionId: str, pageId: str):
+    return "onenote:https://example.com/Notebook/{}.one#section-id={}&page-id={}&end".format(sectionId, sectionId,
+                                                                                           pageId)
+
+
+def sample_elements():
+    """
+    notebook-1 "Work"
+        section-group-1 "Projects--Old"
+            section-2 "Alpha": page-3, page-4
+        section-1 "Inbox": page-1, page-2
+        section-3 "Empty"
+    notebook-2 "Private"
+        section-4 "Recipes": page-5
+    """
+    return [
+        element("notebook-1", types.OneNoteType.NOTEBOOK, "Work"),
+        element("section-group-1", types.OneNoteType.SECTION_GROUP, "Projects--Old", "notebook-1"),
+        element("section-2", types.OneNoteType.SECTION, "Alpha", "section-group-1"),
+        element("page-3", types.OneNoteType.PAGE, "Plan", "section-2", page_url("s2", "p3")),
+        element("page-4", types.OneNoteType.PAGE, "Notes", "section-2", page_url("s2", "p4")),
+        element("section-1", types.OneNoteType.SECTION, "Inbox", "notebook-1"),
+        element("page-1", types.OneNoteType.PAGE, "Todo", "section-1", page_url("s1", "p1")),
+        element("page-2", types.OneNoteType.PAGE, "Ideas", "section-1", page_url("s1", "p2")),
+        element("section-3", types.OneNoteType.SECTION, "Empty", "notebook-1"),
+        element("notebook-2", types.OneNoteType.NOTEBOOK, "Private"),
+        element("section-4", types.OneNoteType.SECTION, "Recipes", "notebook-2"),
+        element("page-5", types.OneNoteType.PAGE, "Cake", "section-4", page_url("s4", "p5"),
+                "2020-06-01T08:30:00.123Z"),
+    ]
+
+
+def sample_dictionary():
+    return OneNoteElementDictionary(sample_elements())
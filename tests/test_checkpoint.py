@@ -0,0 +1,51 @@
+import os
+
+import onenote_checkpoint as checkpoints
+import onenote_types as types
+from sample_elements import element, sample_dictionary
+
+
+def test_resumes_only_the_pages_that_have_not_been_downloaded(tmp_path):
+    checkpointFilePath = os.path.join(tmp_path, "syncCheckpoint.json")
+    alfredDataDictionary = sample_dictionary()
+
+    checkpoint = checkpoints.SyncCheckpoint("2021-01-01T00:00:00Z", "2021-02-01T00:00:00Z")
+    checkpoint.phase = checkpoints.CONTENT_PHASE
+    checkpoint.pagesModified = {"page-1", "page-2", "page-3", "page-5"}
+    checkpoint.pagesDeleted = {"page-9"}
+    checkpoint.pagesDownloaded = {"page-1": "2021-01-01T12:00:00Z", "page-2": "2020-12-01T12:00:00Z"}
+    checkpoint.store_in_file(checkpointFilePath)
+
+    # page-2 has been modified again after its content was downloaded, page-5 has been deleted since
+    alfredDataDictionary["page-2"] = element("page-2", types.OneNoteType.PAGE, "Ideas", "section-1")
+    del alfredDataDictionary["page-5"]
+
+    resumedCheckpoint = checkpoints.SyncCheckpoint.load_from_file(checkpointFilePath)
+    resumedCheckpoint.alfredDataDictionary = alfredDataDictionary
+
+    assert resumedCheckpoint.lastSyncDate == "2021-01-01T00:00:00Z"
+    assert resumedCheckpoint.thisSyncDate == "2021-02-01T00:00:00Z"
+    assert resumedCheckpoint.phase == checkpoints.CONTENT_PHASE
+    assert resumedCheckpoint.pagesDeleted == {"page-9"}
+    assert resumedCheckpoint.pending_pages_uids() == {"page-2", "page-3"}
+
+
+def test_there_is_no_checkpoint_after_a_finished_sync(tmp_path):
+    checkpointFilePath = os.path.join(tmp_path, "syncCheckpoint.json")
+    checkpoints.SyncCheckpoint(None, "2021-02-01T00:00:00Z").store_in_file(checkpointFilePath)
+
+    checkpoints.delete_checkpoint_file(checkpointFilePath)
+
+    assert checkpoints.SyncCheckpoint.load_from_file(checkpointFilePath) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_write_file_atomically_replaces_the_file(tmp_path):
+    filePath = os.path.join(tmp_path, "lastSyncDate.txt")
+
+    checkpoints.write_file_atomically(filePath, "old")
+    checkpoints.write_file_atomically(filePath, b"new")
+
+    with open(filePath, "r") as file:
+        assert file.read() == "new"
+    assert os.listdir(tmp_path) == ["lastSyncDate.txt"]
@@ -0,0 +1,114 @@
+import os
+
+import onenote_content_store as content_store
+
+
+def page_content(number: int):
+    return "<html><body><h1>Page {}</h1><p>{}</p></body></html>".format(number, "Inhalt äöü " * number)
+
+
+def test_packed_store_round_trip(tmp_path):
+    store = content_store.PackedContentStore(str(tmp_path))
+    for number in range(10):
+        store.store("page-{}".format(number), page_content(number))
+    store.store("page-3", page_content(30))
+    store.delete(["page-4", "unknown"])
+
+    assert store.read("page-3") == page_content(30)
+    assert not store.contains("page-4")
+    store.close()
+
+    store = content_store.PackedContentStore(str(tmp_path))
+    assert store.read("page-0") == page_content(0)
+    assert store.read("page-3") == page_content(30)
+    assert store.read("page-4") is None
+    assert sorted(pageUid for pageUid, content in store.iterate_pages()) == \
+        sorted("page-{}".format(number) for number in range(10) if number != 4)
+    store.close()
+
+    packIndex = content_store.PackIndex(str(tmp_path))
+    assert packIndex.read("page-9") == page_content(9)
+    assert packIndex.read("page-4") is None
+    packIndex.close()
+
+
+def test_packed_store_forgets_pages_that_were_not_flushed(tmp_path):
+    store = content_store.PackedContentStore(str(tmp_path))
+    store.store("page-1", page_content(1))
+    store.flush()
+    store.store("page-2", page_content(2))
+    # a crash before the next flush leaves the record unreferenced in the pack file
+    store.packFile.close()
+
+    store = content_store.PackedContentStore(str(tmp_path))
+    assert store.read("page-1") == page_content(1)
+    assert not store.contains("page-2")
+    assert store.deadBytes > 0
+    store.close()
+
+
+def test_packed_store_compaction_keeps_the_current_pages(tmp_path):
+    store = content_store.PackedContentStore(str(tmp_path))
+    for number in range(20):
+        store.store("page-{}".format(number), page_content(number))
+    store.store("page-1", page_content(100))
+    store.delete(["page-{}".format(number) for number in range(10, 20)])
+    store.flush()
+
+    store.compact()
+
+    assert store.generation == 1
+    assert store.deadBytes == 0
+    assert sorted(os.listdir(str(tmp_path))) == [content_store.PACK_FILE.format(1), content_store.PACK_INDEX_FILE]
+    assert store.read("page-1") == page_content(100)
+    assert store.read("page-15") is None
+    store.close()
+
+    store = content_store.PackedContentStore(str(tmp_path))
+    assert store.generation == 1
+    assert sorted(content for pageUid, content in store.iterate_pages()) == \
+        sorted([page_content(0), page_content(100)] + [page_content(number) for number in range(2, 10)])
+    store.close()
+
+
+def test_file_store_round_trip(tmp_path):
+    store = content_store.FileContentStore(str(tmp_path))
+    store.store("page-1", page_content(1))
+
+    assert store.contains("page-1")
+    assert store.read("page-1") == page_content(1)
+
+    store.delete(["page-1"])
+    assert not store.contains("page-1")
+    assert store.read("page-1") is None
+
+
+def test_packed_store_deletes_the_pack_files_of_a_crashed_compaction(tmp_path):
+    store = content_store.PackedContentStore(str(tmp_path))
+    store.store("page-1", page_content(1))
+    store.flush()
+    store.compact()
+    store.close()
+
+    # a compaction that crashed before the index was replaced leaves the new pack file behind,
+    # one that crashed after it the old pack file
+    for generation in (0, 2):
+        with open(os.path.join(str(tmp_path), content_store.PACK_FILE.format(generation)), mode='wb') as packFile:
+            packFile.write(b"stale")
+
+    store = content_store.PackedContentStore(str(tmp_path))
+
+    assert sorted(os.listdir(str(tmp_path))) == [content_store.PACK_FILE.format(1), content_store.PACK_INDEX_FILE]
+    assert store.read("page-1") == page_content(1)
+    store.close()
+
+
+def test_stores_the_content_chunk_by_chunk(tmp_path):
+    chunks = [page_content(1), page_content(2), page_content(3)]
+
+    for store in (content_store.FileContentStore(str(tmp_path / "files")),
+                  content_store.PackedContentStore(str(tmp_path / "pack"))):
+        store.store_chunks("page-1", iter(chunks))
+
+        assert store.read("page-1") == "".join(chunks)
+        store.close()
@@ -0,0 +1,58 @@
+import onenote_types as types
+from sample_elements import element, sample_dictionary
+
+
+def test_indexes_the_elements_by_type_and_parent():
+    alfredDataDictionary = sample_dictionary()
+
+    assert alfredDataDictionary.uids_of_type(types.OneNoteType.NOTEBOOK) == {"notebook-1", "notebook-2"}
+    assert alfredDataDictionary.uids_of_type("page") == {"page-1", "page-2", "page-3", "page-4", "page-5"}
+    assert alfredDataDictionary.children_uids("notebook-1") == {"section-group-1", "section-1", "section-3"}
+    assert alfredDataDictionary.children_uids("section-3") == set()
+    assert not alfredDataDictionary.has_changes()
+
+
+def test_moves_a_replaced_element_to_its_new_parent():
+    alfredDataDictionary = sample_dictionary()
+
+    alfredDataDictionary["page-1"] = element("page-1", types.OneNoteType.PAGE, "Todo", "section-4")
+
+    assert alfredDataDictionary.children_uids("section-1") == {"page-2"}
+    assert alfredDataDictionary.children_uids("section-4") == {"page-1", "page-5"}
+    assert alfredDataDictionary.modifiedUids == {"page-1"}
+    assert alfredDataDictionary.addedUids == set()
+
+
+def test_removes_deleted_elements_from_the_indexes():
+    alfredDataDictionary = sample_dictionary()
+
+    del alfredDataDictionary["page-5"]
+    assert alfredDataDictionary.pop("page-4").uid == "page-4"
+    assert alfredDataDictionary.pop("unknown", None) is None
+
+    assert alfredDataDictionary.uids_of_type(types.OneNoteType.PAGE) == {"page-1", "page-2", "page-3"}
+    assert "section-4" not in alfredDataDictionary.childrenUids
+    assert alfredDataDictionary.children_uids("section-2") == {"page-3"}
+    assert alfredDataDictionary.deletedUids == {"page-4", "page-5"}
+
+
+def test_tracks_added_modified_and_deleted_elements():
+    alfredDataDictionary = sample_dictionary()
+
+    alfredDataDictionary["page-6"] = element("page-6", types.OneNoteType.PAGE, "New", "section-3")
+    alfredDataDictionary.mark_modified("page-1")
+    alfredDataDictionary.mark_modified("unknown")
+    del alfredDataDictionary["page-2"]
+
+    assert alfredDataDictionary.addedUids == {"page-6"}
+    assert alfredDataDictionary.modifiedUids == {"page-6", "page-1"}
+    assert alfredDataDictionary.deletedUids == {"page-2"}
+
+    # an element that is added again after it has been deleted is a modified one
+    alfredDataDictionary["page-2"] = element("page-2", types.OneNoteType.PAGE, "Ideas", "section-1")
+    assert alfredDataDictionary.deletedUids == set()
+    assert "page-2" not in alfredDataDictionary.addedUids
+
+    alfredDataDictionary.clear_changes()
+    assert not alfredDataDictionary.has_changes()
+    assert alfredDataDictionary.addedUids == set()
@@ -0,0 +1,14 @@
+import onenote_fts_query as fts_query
+
+
+def test_build_match_expression_quotes_the_words():
+    assert fts_query.build_match_expression('Plan "OR" (draft') == '"Plan" "OR" "draft"*'
+    assert fts_query.build_match_expression("Größe NEAR") == '"Größe" "NEAR"*'
+
+
+def test_build_match_expression_with_all_prefixes():
+    assert fts_query.build_match_expression("work > inb", all_prefixes=True) == '"work"* "inb"*'
+
+
+def test_build_match_expression_without_words():
+    assert fts_query.build_match_expression(" > - ") is None
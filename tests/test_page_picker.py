@@ -0,0 +1,156 @@
+import collections
+import os
+import random
+
+import onenote_page_picker as page_picker
+import onenote_types as types
+from sample_elements import element, sample_dictionary
+
+
+def test_fenwick_tree_prefix_sums():
+    weights = [1.0, 0.0, 2.5, 3.0, 0.5, 4.0, 1.0]
+    tree = page_picker.FenwickTree(weights)
+
+    for count in range(len(weights) + 1):
+        assert tree.prefix_sum(count) == sum(weights[:count])
+
+    tree.add(2, -2.5)
+    tree.append(2.0)
+    weights[2] = 0.0
+    weights.append(2.0)
+
+    assert len(tree) == len(weights)
+    for count in range(len(weights) + 1):
+        assert tree.prefix_sum(count) == sum(weights[:count])
+
+
+def test_fenwick_tree_find_skips_zero_weights():
+    tree = page_picker.FenwickTree([1.0, 0.0, 2.0, 0.0, 1.0])
+
+    assert tree.find(0.0) == 0
+    assert tree.find(0.99) == 0
+    assert tree.find(1.0) == 2
+    assert tree.find(2.99) == 2
+    assert tree.find(3.0) == 4
+    assert tree.find(3.99) == 4
+
+
+def test_fenwick_tree_samples_according_to_the_weights():
+    weights = [1.0, 0.0, 3.0, 6.0]
+    tree = page_picker.FenwickTree(weights)
+    rng = random.Random(42)
+
+    counts = collections.Counter(tree.find(rng.random() * tree.total()) for _ in range(20000))
+
+    assert counts[1] == 0
+    for position, weight in enumerate(weights):
+        assert abs(counts[position] / 20000 - weight / 10.0) < 0.02
+
+
+def test_sampling_index_updates_and_reuses_positions():
+    alfredDataDictionary = sample_dictionary()
+    index = page_picker.PageSamplingIndex.build(alfredDataDictionary, page_picker.PageWeighting())
+
+    assert len(index) == 5
+
+    del alfredDataDictionary["page-2"]
+    alfredDataDictionary["page-6"] = element("page-6", types.OneNoteType.PAGE, "New", "section-3")
+    index.update(alfredDataDictionary, {"page-6"}, {"page-2"})
+
+    assert len(index) == 5
+    assert index.pagesUids == ["page-1", "page-6", "page-3", "page-4", "page-5"]
+    assert index.tree.total() == 5.0
+
+    rng = random.Random(1)
+    assert {index.pick(rng=rng) for _ in range(200)} == {"page-1", "page-3", "page-4", "page-5", "page-6"}
+
+
+def test_sampling_index_weights_the_notebooks():
+    alfredDataDictionary = sample_dictionary()
+    weighting = page_picker.PageWeighting(notebook_weights={"Private": 0, "notebook-1": 2})
+    index = page_picker.PageSamplingIndex.build(alfredDataDictionary, weighting)
+
+    rng = random.Random(7)
+    pagesUids = {index.pick(rng=rng) for _ in range(200)}
+
+    assert pagesUids == {"page-1", "page-2", "page-3", "page-4"}
+    assert not index.needs_rebuild(alfredDataDictionary, weighting)
+    assert index.needs_rebuild(alfredDataDictionary, page_picker.PageWeighting())
+
+
+def test_sampling_index_excludes_pages_while_there_are_others():
+    alfredDataDictionary = sample_dictionary()
+    index = page_picker.PageSamplingIndex.build(alfredDataDictionary, page_picker.PageWeighting())
+    rng = random.Random(3)
+
+    excludedPagesUids = ["page-1", "page-2", "page-3", "page-4"]
+    assert {index.pick(excludedPagesUids, rng) for _ in range(50)} == {"page-5"}
+
+    excludedPagesUids.append("page-5")
+    assert index.pick(excludedPagesUids, rng) is not None
+    assert index.tree.total() == 5.0
+
+
+def test_pick_page_from_the_stored_index(tmp_path):
+    indexFilePath = os.path.join(tmp_path, page_picker.PAGE_SAMPLING_INDEX_FILE)
+    recentlyShownFilePath = os.path.join(tmp_path, page_picker.RECENTLY_SHOWN_PAGES_FILE)
+    alfredDataDictionary = sample_dictionary()
+    weighting = page_picker.PageWeighting(exclude_recently_shown=4)
+
+    assert page_picker.pick_page(indexFilePath, recentlyShownFilePath) is None
+
+    page_picker.update_sampling_index(indexFilePath, alfredDataDictionary, weighting, set(), set())
+    del alfredDataDictionary["page-5"]
+    page_picker.update_sampling_index(indexFilePath, alfredDataDictionary, weighting, set(), {"page-5"})
+
+    rng = random.Random(5)
+    pagesUids = [page_picker.pick_page(indexFilePath, recentlyShownFilePath, rng) for _ in range(4)]
+
+    assert sorted(pagesUids) == ["page-1", "page-2", "page-3", "page-4"]
+    assert page_picker.load_recently_shown_pages(recentlyShownFilePath) == pagesUids
+
+
+def test_sampling_index_file_picks_according_to_the_weights(tmp_path):
+    indexFilePath = os.path.join(tmp_path, page_picker.PAGE_SAMPLING_INDEX_FILE)
+    index = page_picker.PageSamplingIndex(page_picker.PageWeighting(), 0.0)
+    for pageUid, weight in (("page-b", 1.0), ("page-a", 3.0), ("page-ä", 0.0), ("page-c", 6.0), ("page-d", 2.0)):
+        index.set_weight(pageUid, weight)
+    index.set_weight("page-d", None)
+    index.store_in_file(indexFilePath)
+
+    indexFile = page_picker.SamplingIndexFile(indexFilePath)
+    rng = random.Random(11)
+
+    assert len(indexFile) == 4
+    assert indexFile.total() == 10.0
+    assert [indexFile.position_of(pageUid) for pageUid in ("page-a", "page-b", "page-c", "page-d", "page-ä")] == \
+        [0, 1, 2, None, 3]
+
+    counts = collections.Counter(indexFile.pick(rng=rng) for _ in range(20000))
+    assert set(counts) == {"page-a", "page-b", "page-c"}
+    for pageUid, weight in (("page-a", 3.0), ("page-b", 1.0), ("page-c", 6.0)):
+        assert abs(counts[pageUid] / 20000 - weight / 10.0) < 0.02
+
+    counts = collections.Counter(indexFile.pick(["page-a", "page-d"], rng) for _ in range(20000))
+    assert set(counts) == {"page-b", "page-c"}
+    assert abs(counts["page-b"] / 20000 - 1.0 / 7.0) < 0.02
+
+    assert indexFile.pick(["page-a", "page-b", "page-c"], rng) is None
+    assert indexFile.pick(["page-a", "page-b", "page-c", "page-ä"], rng) is not None
+    indexFile.close()
+
+
+def test_sampling_index_round_trip(tmp_path):
+    indexFilePath = os.path.join(tmp_path, page_picker.PAGE_SAMPLING_INDEX_FILE)
+    alfredDataDictionary = sample_dictionary()
+    weighting = page_picker.PageWeighting(recency_half_life_days=30, notebook_weights={"Private": 3})
+    index = page_picker.PageSamplingIndex.build(alfredDataDictionary, weighting)
+
+    index.store_in_file(indexFilePath)
+    loadedIndex = page_picker.PageSamplingIndex.load_from_file(indexFilePath)
+
+    assert loadedIndex.weighting.as_dict() == weighting.as_dict()
+    assert loadedIndex.referenceTimestamp == index.referenceTimestamp
+    assert loadedIndex.notebookWeights == index.notebookWeights
+    assert dict(zip(loadedIndex.pagesUids, loadedIndex.weights)) == dict(zip(index.pagesUids, index.weights))
+    assert not loadedIndex.needs_rebuild(alfredDataDictionary, weighting)
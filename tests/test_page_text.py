@@ -0,0 +1,23 @@
+import onenote_page_text as page_text
+
+PAGE = '<html><head><title>Plan</title></head><body><p>Größe</p><img src="data:image/png;base64,{}"/>' \
+       '<p>Ende</p></body></html>'.format("A" * 1000)
+
+
+def test_transform_page_content():
+    pageContent = page_text.transform_page_content("<html><head><title>Plan</title></head><body></body></html>",
+                                                   "Work > Inbox")
+
+    assert pageContent == "<html><title>Plan</title>Work > Inbox<body></body></html>"
+
+
+def test_transform_page_content_chunks_matches_the_whole_page(monkeypatch):
+    for chunkSize in (1, 2, 7, 100, 64 * 1024):
+        monkeypatch.setattr(page_text, "CHUNK_SIZE", chunkSize)
+
+        for encoding in ("utf-8", "utf-16"):
+            for stripImages in (False, True):
+                chunks = list(page_text.transform_page_content_chunks(PAGE.encode(encoding), encoding, "Work > Inbox",
+                                                                      stripImages))
+
+                assert "".join(chunks) == page_text.transform_page_content(PAGE, "Work > Inbox", stripImages)
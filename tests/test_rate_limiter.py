@@ -0,0 +1,39 @@
+import onenote_rate_limiter as rate_limiter
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_overlapping_blocks_are_counted_once():
+    clock = FakeClock()
+    rateLimiter = rate_limiter.QuotaRateLimiter(clock=clock)
+
+    # several requests throttled at once block the requests for the longest of their retry afters
+    assert rateLimiter.block_for(10) == 10
+    assert rateLimiter.block_for(10) == 0
+    clock.now = 4.0
+    assert rateLimiter.block_for(10) == 4
+    assert rateLimiter.blocked_delay() == 10
+
+    clock.now = 20.0
+    assert rateLimiter.block_for(5) == 5
+    assert rateLimiter.blocked_delay() == 5
+
+
+def test_requests_waiting_at_once_are_counted_once():
+    clock = FakeClock()
+    rateLimiter = rate_limiter.QuotaRateLimiter(clock=clock)
+
+    assert rateLimiter.wait_for(2) == 2
+    assert rateLimiter.wait_for(1) == 0
+    clock.now = 1.0
+    assert rateLimiter.wait_for(3) == 2
+
+    clock.now = 10.0
+    assert rateLimiter.wait_for(0.5) == 0.5
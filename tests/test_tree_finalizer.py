@@ -0,0 +1,105 @@
+import re
+
+import onenote_tree_finalizer as tree_finalizer
+import onenote_types as types
+from sample_elements import element, sample_dictionary
+
+
+def baseline_subtitle_match_and_arg(alfredDataDictionary):
+    """
+    The subtitles, match strings and urls as computed by the spider before the tree finalizer,
+    which walked up the tree from every element. It took the url of an arbitrary child, here it
+    is the child with the lowest uid as with the tree finalizer.
+    """
+    def children_uids(uid):
+        return sorted(childUid for childUid in alfredDataDictionary
+                      if alfredDataDictionary[childUid].parentUid == uid)
+
+    def find_url_of_first_child_page(element):
+        if element.onenoteType == types.OneNoteType.PAGE:
+            return element.arg
+
+        childrenUids = children_uids(element.uid)
+        if childrenUids:
+            return find_url_of_first_child_page(alfredDataDictionary[childrenUids[0]])
+
+        return None
+
+    def generate_subtitle(element):
+        if element.onenoteType == types.OneNoteType.NOTEBOOK:
+            return element.title
+
+        return generate_subtitle(alfredDataDictionary[element.parentUid]) + " > " + element.title
+
+    values = {}
+    for uid, element in alfredDataDictionary.items():
+        arg = element.arg
+        if arg is None:
+            pageUrl = find_url_of_first_child_page(element)
+            arg = re.sub(r'page-id=.*&', '', pageUrl) if pageUrl is not None else None
+
+        if element.onenoteType == types.OneNoteType.NOTEBOOK:
+            values[uid] = ("Notebook", element.title, arg)
+            continue
+
+        subtitle = generate_subtitle(alfredDataDictionary[element.parentUid]).replace("--", "")
+        values[uid] = (subtitle, subtitle + " > " + element.title, arg)
+
+    return values
+
+
+def subtitle_match_and_arg(alfredDataDictionary):
+    return {uid: (element.subtitle, element.match, element.arg) for uid, element in alfredDataDictionary.items()}
+
+
+def test_finalize_all_matches_baseline():
+    alfredDataDictionary = sample_dictionary()
+    expectedValues = baseline_subtitle_match_and_arg(alfredDataDictionary)
+
+    tree_finalizer.TreeFinalizer(alfredDataDictionary, alfredDataDictionary.childrenUids).finalize_all()
+
+    assert subtitle_match_and_arg(alfredDataDictionary) == expectedValues
+    assert alfredDataDictionary["page-3"].subtitle == "Work > ProjectsOld > Alpha"
+    assert alfredDataDictionary["page-3"].match == "Work > ProjectsOld > Alpha > Plan"
+    assert alfredDataDictionary["section-group-1"].arg == \
+        "onenote:https://example.com/Notebook/s2.one#section-id=s2&end"
+    assert alfredDataDictionary["section-3"].arg is None
+
+
+def test_finalize_all_marks_only_changed_elements_as_modified():
+    alfredDataDictionary = sample_dictionary()
+    tree_finalizer.TreeFinalizer(alfredDataDictionary, alfredDataDictionary.childrenUids).finalize_all()
+    alfredDataDictionary.clear_changes()
+
+    tree_finalizer.TreeFinalizer(alfredDataDictionary, alfredDataDictionary.childrenUids).finalize_all()
+
+    assert not alfredDataDictionary.has_changes()
+
+
+def test_finalize_modified_updates_the_subtree_of_a_renamed_section():
+    alfredDataDictionary = sample_dictionary()
+    tree_finalizer.TreeFinalizer(alfredDataDictionary, alfredDataDictionary.childrenUids).finalize_all()
+    alfredDataDictionary.clear_changes()
+
+    alfredDataDictionary["section-2"] = element("section-2", types.OneNoteType.SECTION, "Beta", "section-group-1")
+    expectedValues = baseline_subtitle_match_and_arg(alfredDataDictionary)
+
+    tree_finalizer.TreeFinalizer(alfredDataDictionary, alfredDataDictionary.childrenUids) \
+        .finalize_modified({"section-2"})
+
+    assert subtitle_match_and_arg(alfredDataDictionary) == expectedValues
+    assert alfredDataDictionary.modifiedUids == {"section-2", "page-3", "page-4"}
+
+
+def test_finalize_modified_adds_the_url_to_the_ancestors_of_a_new_page():
+    alfredDataDictionary = sample_dictionary()
+    tree_finalizer.TreeFinalizer(alfredDataDictionary, alfredDataDictionary.childrenUids).finalize_all()
+    alfredDataDictionary.clear_changes()
+
+    alfredDataDictionary["page-6"] = element("page-6", types.OneNoteType.PAGE, "First", "section-3",
+                                             "onenote:https://example.com/Notebook/s3.one#section-id=s3&page-id=p6&end")
+    tree_finalizer.TreeFinalizer(alfredDataDictionary, alfredDataDictionary.childrenUids).finalize_modified({"page-6"})
+
+    assert alfredDataDictionary["page-6"].match == "Work > Empty > First"
+    assert alfredDataDictionary["section-3"].arg == "onenote:https://example.com/Notebook/s3.one#section-id=s3&end"
+    assert "section-3" in alfredDataDictionary.modifiedUids